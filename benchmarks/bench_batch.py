@@ -0,0 +1,126 @@
+"""
+Benchmark de detect_batch (appels au classifieur groupés entre itérations et images) contre une boucle de
+detect_ecocup sur les mêmes images, avec le même classifieur (StandardScaler + LogisticRegression sur le HOG) :
+mêmes fenêtres et mêmes scores, nombre d'appels à predict_proba, temps passé dans le classifieur et débit.
+Les images sont celles du dossier de test (non annotées), lues au fur et à mesure par un générateur ; elles peuvent
+être réduites d'un facteur (ex : des frames de vidéo en basse résolution), cas où les itérations ont peu de fenêtres
+et où le coût fixe de chaque appel au classifieur compte le plus.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_batch.py [nombre_d_images] [mode] [facteur_de_réduction]
+"""
+
+import contextlib
+import importlib
+import io
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from skimage.transform import rescale
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.detection import PREDICT_BATCH_SIZE, detect_batch, detect_ecocup
+
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+NB_IMAGES = 8
+MODE = "hog_pyramid"
+DOWNSCALE = 1
+TEST_FOLDER = os.path.join("local_data", "1_data_filtered", "test")
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5, "hog_params": {}}
+BATCH_SIZES = [PREDICT_BATCH_SIZE, 8 * PREDICT_BATCH_SIZE]
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+class TimedClassifier:
+    """
+    Classifieur dont les appels à predict_proba sont comptés et chronométrés.
+    """
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.calls = 0
+        self.seconds = 0.0
+
+    def predict_proba(self, X):
+        start = time.time()
+        probas = self.classifier.predict_proba(X)
+        self.seconds += time.time() - start
+        self.calls += 1
+        return probas
+
+
+def iter_images(folder, nb_images, downscale):
+    """
+    Images du dossier lues une à une (comme un flux de frames).
+    """
+    for f_name in sorted(os.listdir(folder))[:nb_images]:
+        img = plt.imread(os.path.join(folder, f_name))
+        yield img if downscale == 1 else rescale(img, 1 / downscale, channel_axis=-1 if img.ndim == 3 else None)
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else NB_IMAGES
+    mode = sys.argv[2] if len(sys.argv) > 2 else MODE
+    downscale = float(sys.argv[3]) if len(sys.argv) > 3 else DOWNSCALE
+
+    start = time.time()
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    indices = np.arange(len(dataset))
+    classifier = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, class_weight="balanced"))
+    classifier.fit(dataset.features(indices, HOG_extractor, hog_params={}), np.where(dataset.labels == POS_LABEL, 1, 0))
+    print(f"Classifieur linéaire : {time.time() - start:.1f} s")
+
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, mode=mode)
+    params.update({key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+
+    timed = TimedClassifier(classifier)
+    start = time.time()
+    references = []
+    with contextlib.redirect_stdout(io.StringIO()): # logs par itération de detect_ecocup
+        for img in iter_images(TEST_FOLDER, nb_images, downscale):
+            references.append(detect_ecocup(img, timed, HOG_extractor, **params))
+    seconds_ref = time.time() - start
+    print(
+        f"{'detect_ecocup':24s} | {seconds_ref:7.1f} s ({nb_images / seconds_ref:.3f} images/s) | "
+        f"predict_proba : {timed.calls:5d} appels, {timed.seconds:6.2f} s"
+    )
+
+    for predict_batch_size in BATCH_SIZES:
+        timed = TimedClassifier(classifier)
+        start = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = list(
+                detect_batch(
+                    iter_images(TEST_FOLDER, nb_images, downscale), timed, HOG_extractor,
+                    predict_batch_size=predict_batch_size, **params
+                )
+            )
+        seconds = time.time() - start
+
+        same = all(
+            np.array_equal(windows, windows_ref) and np.allclose(scores, scores_ref, rtol=0, atol=1e-12)
+            for (windows, scores), (windows_ref, scores_ref) in zip(results, references)
+        )
+        print(
+            f"{f'detect_batch ({predict_batch_size})':24s} | {seconds:7.1f} s ({nb_images / seconds:.3f} images/s) | "
+            f"predict_proba : {timed.calls:5d} appels, {timed.seconds:6.2f} s | mêmes résultats : {same}"
+        )
@@ -0,0 +1,97 @@
+"""
+Benchmark de la détection en cascade (utils.cascade) contre la détection directe (HOG + SVC sur toutes les fenêtres),
+sur des images positives d'entraînement : temps de détection et rappel des annotations (une annotation est retrouvée
+si une fenêtre gardée la recouvre avec une IoU >= IOU_MATCH).
+Classifieur final comme dans les notebooks (HOG par défaut, SVC polynomial) ; étapes de la cascade : régression
+logistique sur des moyennes de gradients par blocs (gradient_blocks), puis régression logistique sur le HOG.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_cascade.py [nombre_d_images]
+"""
+
+import importlib
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from sklearn.svm import SVC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.cascade import Cascade, gradient_blocks, train_cascade_stage
+from utils.detection import detect_ecocup, get_iou_matrix
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+NB_IMAGES = 3
+IOU_MATCH = 0.5
+STAGE_RECALLS = (0.995, 0.99) # fraction des positifs d'entraînement gardée par chaque étape
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5}
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def recall(windows, gt_windows):
+    if len(gt_windows) == 0:
+        return 0, 0
+    if len(windows) == 0:
+        return 0, len(gt_windows)
+    found = get_iou_matrix(gt_windows, np.asarray(windows).reshape(-1, 4)).max(axis=1) >= IOU_MATCH
+    return int(found.sum()), len(gt_windows)
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else NB_IMAGES
+
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    indices = np.arange(len(dataset))
+    y = np.where(dataset.labels == POS_LABEL, 1, 0)
+
+    start = time.time()
+    X_hog = dataset.features(indices, HOG_extractor, hog_params={})
+    classifier = SVC(kernel="poly", probability=True)
+    classifier.fit(X_hog, y)
+    print(f"Classifieur final : {time.time() - start:.1f} s")
+
+    groups = indices // len(getattr(dataset, "transforms", [None])) # les augmentations d'un même patch dans le même pli
+    stages = [
+        train_cascade_stage(
+            gradient_blocks(dataset.batch(indices)), y, STAGE_RECALLS[0], features_func=gradient_blocks, groups=groups
+        ),
+        train_cascade_stage(X_hog, y, STAGE_RECALLS[1], name="HOG linéaire", groups=groups),
+    ]
+    cascade = Cascade(stages)
+
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, **{key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+    bbox_train, _, _ = splitter.load_annotations()
+
+    results = {"direct": [0.0, 0, 0], "cascade": [0.0, 0, 0]} # temps, annotations retrouvées, annotations
+    for f_name in list(bbox_train)[:nb_images]:
+        img = plt.imread(os.path.join(splitter.IMAGES_FOLDER, "pos", f"{f_name}.jpg"))
+        bbox = np.asarray(bbox_train[f_name], dtype=np.float64).reshape(-1, 5)
+        gt_windows = np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3]], axis=1)
+
+        for name, image_cascade in (("direct", None), ("cascade", cascade)):
+            start = time.time()
+            windows, _ = detect_ecocup(img, classifier, HOG_extractor, cascade=image_cascade, **params)
+            results[name][0] += time.time() - start
+            found, total = recall(windows, gt_windows)
+            results[name][1] += found
+            results[name][2] += total
+
+    for name, (seconds, found, total) in results.items():
+        print(f"{name:8s} | {seconds:8.1f} s | annotations retrouvées : {found}/{total}")
+    print(f"Speedup x{results['direct'][0] / max(results['cascade'][0], 1e-9):.1f}")
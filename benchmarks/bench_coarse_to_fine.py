@@ -0,0 +1,153 @@
+"""
+Benchmark de la recherche coarse-to-fine de detect_ecocup (search="coarse_to_fine", utils.coarse_to_fine) contre le
+balayage exhaustif, avec le même classifieur linéaire (StandardScaler + LogisticRegression sur le HOG, mode "linear"
+par défaut) :
+- temps et nombre de fenêtres évaluées ;
+- rappel des détections (après NMS) du balayage exhaustif sur des images de test (sans annotations), toutes et
+  celles de score >= HIGH_SCORE ;
+- rappel des annotations sur des images d'entraînement annotées (une annotation est retrouvée si une fenêtre gardée la
+  recouvre avec une IoU >= 0.5).
+Les paramètres de la recherche testés sont dans SEARCH_PARAMS.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_coarse_to_fine.py [nombre_d_images] [mode]
+"""
+
+import contextlib
+import importlib
+import io
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.detection import detect_ecocup, non_maxima_suppression_grid, window_recall
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+NB_IMAGES = 4
+MODE = "linear"
+TEST_FOLDER = os.path.join("local_data", "1_data_filtered", "test")
+TRAIN_OFFSET = 100 # images annotées prises à partir de celle-ci (les premières servent aux autres benchmarks)
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5, "hog_params": {}}
+SEARCH_PARAMS = [
+    {},                               # valeurs par défaut de utils.coarse_to_fine
+    {"promising_threshold": 0.05},
+    {"grid_factor": 3},
+    {"step_factor": 3},
+]
+HIGH_SCORE = 0.9 # détections exhaustives "sûres"
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def timed_detection(img, classifier, **params):
+    """
+    :return: Fenêtres gardées (n, 4), scores (n,), temps en secondes, nombre de fenêtres évaluées.
+    """
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()) as logs: # logs par itération de detect_ecocup
+        windows, scores = detect_ecocup(img, classifier, HOG_extractor, **params)
+    seconds = time.time() - start
+    n_evaluated = next(
+        int(line.split(":")[1]) for line in logs.getvalue().splitlines() if line.startswith("Fenêtres évaluées")
+    )
+    return np.asarray(windows).reshape(-1, 4), np.asarray(scores), seconds, n_evaluated
+
+
+def annotations_windows(bbox):
+    """
+    Annotations (x, y, hauteur, largeur, classe) au format des fenêtres (upper_left_x, upper_left_y, lower_right_x,
+    lower_right_y).
+    """
+    bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 5)
+    return np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3]], axis=1)
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else NB_IMAGES
+    mode = sys.argv[2] if len(sys.argv) > 2 else MODE
+
+    start = time.time()
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    indices = np.arange(len(dataset))
+    classifier = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, class_weight="balanced"))
+    classifier.fit(dataset.features(indices, HOG_extractor, hog_params={}), np.where(dataset.labels == POS_LABEL, 1, 0))
+    print(f"Classifieur linéaire : {time.time() - start:.1f} s")
+
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, mode=mode)
+    params.update({key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+
+    # Images de test : détections du balayage exhaustif comme référence
+    test_names = sorted(os.listdir(TEST_FOLDER))
+    test_names = test_names[:: max(1, len(test_names) // nb_images)][:nb_images]
+    test_images = [plt.imread(os.path.join(TEST_FOLDER, f_name)) for f_name in test_names]
+    references = []
+    seconds_ref = 0.0
+    n_ref = 0
+    for img in test_images:
+        windows, scores, seconds, n_evaluated = timed_detection(img, classifier, **params)
+        windows, scores = non_maxima_suppression_grid(windows, scores, output_score=True)
+        references.append((np.asarray(windows).reshape(-1, 4), np.asarray(scores)))
+        seconds_ref += seconds
+        n_ref += n_evaluated
+    n_high = sum(int(np.sum(scores >= HIGH_SCORE)) for _, scores in references)
+    print(
+        f"{'exhaustive':40s} | test {seconds_ref:7.1f} s, {n_ref:8d} fenêtres | "
+        f"{sum(len(windows) for windows, _ in references)} détections, {n_high} >= {HIGH_SCORE}"
+    )
+    for search_params in SEARCH_PARAMS:
+        seconds_total = 0.0
+        n_total = 0
+        found = found_high = 0
+        for img, (windows_ref, scores_ref) in zip(test_images, references):
+            windows, _, seconds, n_evaluated = timed_detection(
+                img, classifier, search="coarse_to_fine", search_params=search_params, **params
+            )
+            seconds_total += seconds
+            n_total += n_evaluated
+            found += window_recall(windows_ref, windows)[0]
+            found_high += window_recall(windows_ref[scores_ref >= HIGH_SCORE], windows)[0]
+        print(
+            f"{str(search_params):40s} | test {seconds_total:7.1f} s, {n_total:8d} fenêtres | "
+            f"rappel {found}/{sum(len(windows) for windows, _ in references)}, >= {HIGH_SCORE} : {found_high}/{n_high}"
+        )
+
+    # Images d'entraînement annotées : rappel des annotations
+    bbox_train, _, _ = splitter.load_annotations()
+    train_names = list(bbox_train)[TRAIN_OFFSET:TRAIN_OFFSET + 3 * nb_images]
+    for search_params in [None] + SEARCH_PARAMS:
+        search = "exhaustive" if search_params is None else "coarse_to_fine"
+        seconds_total = 0.0
+        n_total = 0
+        found = total = 0
+        for f_name in train_names:
+            img = plt.imread(os.path.join(splitter.IMAGES_FOLDER, "pos", f"{f_name}.jpg"))
+            windows, _, seconds, n_evaluated = timed_detection(
+                img, classifier, search=search, search_params=search_params, **params
+            )
+            seconds_total += seconds
+            n_total += n_evaluated
+            f, t = window_recall(annotations_windows(bbox_train[f_name]), windows)
+            found += f
+            total += t
+        label = search if search_params is None else str(search_params)
+        print(f"{label:40s} | annotées {seconds_total:7.1f} s, {n_total:8d} fenêtres | annotations {found}/{total}")
@@ -0,0 +1,106 @@
+"""
+Démarrage à froid d'un worker d'inférence : import de utils.model_bundle puis load_detector(bundle), dans un
+interpréteur neuf à chaque exécution (rien en cache dans le processus, contrairement à un chargement répété).
+
+Le temps retenu (médian de nb_runs exécutions) est comparé à COLD_START_BUDGET_S. Sans bundle donné, deux bundles
+synthétiques sont créés dans un dossier temporaire (features de la taille du HOG par défaut d'un patch 128x64) :
+une LogisticRegression derrière un StandardScaler, enregistrée en LinearClassifier (chargement sans sklearn), et un
+SVC, qui importe sklearn et scipy au dépickling (1 à 1.5 s, au-dessus du budget : chiffre indiqué, pas un échec).
+Le code de sortie est 1 si un bundle donné, ou le bundle linéaire synthétique, dépasse le budget.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_cold_start.py [modele.joblib] [nombre_de_répétitions]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+from utils.model_bundle import save_bundle
+
+NB_RUNS = 5                # le temps retenu est le médian des exécutions (la première subit le cache disque)
+COLD_START_BUDGET_S = 0.5  # import de utils.model_bundle et load_detector, numpy compris
+N_FEATURES = 6804          # taille du HOG par défaut de skimage sur un patch 128x64
+N_SAMPLES = 2000
+STATS = {"min_ratio": 0.5, "max_ratio": 0.8, "min_scale": 60, "max_scale": 300}
+TARGET_SHAPE = (128, 64)
+HEAVY_MODULES = ["sklearn", "scipy"]
+
+CODE = """
+import sys, time
+start = time.perf_counter()
+from utils.model_bundle import load_detector
+imported = time.perf_counter()
+load_detector(sys.argv[1])
+loaded = time.perf_counter()
+print(imported - start, loaded - imported, " ".join(sorted({name.split(".")[0] for name in sys.modules})))
+"""
+
+
+def cold_start(path):
+    """
+    Import et chargement de path dans un nouvel interpréteur.
+    :return: Durée de l'import (s), durée de load_detector (s) et ensemble des modules de premier niveau chargés.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", CODE, path], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    import_s, load_s, *modules = result.stdout.split()
+    return float(import_s), float(load_s), set(modules)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def synthetic_bundles(folder):
+    """
+    Bundles synthétiques (voir docstring du module).
+    :return: Liste de (nom, chemin, True si le bundle doit respecter le budget).
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    rng = np.random.default_rng(0)
+    X = rng.random((N_SAMPLES, N_FEATURES))
+    y = rng.integers(0, 2, N_SAMPLES)
+
+    linear_path = os.path.join(folder, "linear.joblib")
+    linear = make_pipeline(StandardScaler(), LogisticRegression(max_iter=200)).fit(X, y)
+    save_bundle(linear_path, linear, TARGET_SHAPE, STATS)
+    svc_path = os.path.join(folder, "svc.joblib")
+    save_bundle(svc_path, SVC(kernel="poly", probability=True).fit(X[:600], y[:600]), TARGET_SHAPE, STATS)
+    return [("LogisticRegression (LinearClassifier)", linear_path, True), ("SVC", svc_path, False)]
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    nb_runs = int(sys.argv[2]) if len(sys.argv) > 2 else NB_RUNS
+
+    with tempfile.TemporaryDirectory() as folder:
+        bundles = [(path, path, True)] if path is not None else synthetic_bundles(folder)
+
+        ok = True
+        for name, bundle_path, checked in bundles:
+            runs = [cold_start(bundle_path) for _ in range(nb_runs)]
+            import_s = median([run[0] for run in runs])
+            load_s = median([run[1] for run in runs])
+            total = median([run[0] + run[1] for run in runs])
+            heavy = sorted(runs[-1][2] & set(HEAVY_MODULES))
+            print(
+                f"{name} : {total:.3f} s (import : {import_s:.3f} s, load_detector : {load_s:.3f} s, "
+                f"budget : {COLD_START_BUDGET_S} s), modules lourds chargés : {heavy or 'aucun'}"
+            )
+            if checked and total > COLD_START_BUDGET_S:
+                ok = False
+
+    print("Budget respecté" if ok else "Budget dépassé")
+    sys.exit(0 if ok else 1)
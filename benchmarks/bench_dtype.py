@@ -0,0 +1,203 @@
+"""
+Précision des classifieurs retenus selon le type flottant de la chaîne (float64 historique, float32),
+au format de resultats_classification.csv, pour vérifier que le passage en float32 est neutre.
+Même protocole que classifieur_v2.ipynb : patchs normalisés de local_data/4_normalized_patches, HOG par défaut,
+80 % des patchs (mélangés) pour l'entraînement et 20 % pour le test.
+
+Puis détections de detect_ecocup(..., dtype=np.float64) et dtype=np.float32 sur des images de validation, dont les
+patchs sont retirés du jeu d'entraînement du classifieur (SVC polynomial, entraîné une fois) : fenêtres gardées,
+écart des scores, rappel et précision (après NMS) des annotations, temps.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_dtype.py [fichier_csv_de_sortie] [nombre_d_images_de_validation]
+"""
+
+import csv
+import importlib
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from skimage.util import img_as_float32, img_as_float64
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, average_precision_score, precision_score, recall_score
+from sklearn.svm import SVC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.detection import detect_ecocup, non_maxima_suppression_v2, window_recall
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+PATCHS_FOLDER = os.path.join("local_data", "4_normalized_patches")
+DEFAULT_OUTPUT = os.path.join("benchmarks", "resultats_dtype.csv")
+TRAIN_PART = 80 / 100
+CSV_COLUMNS = [
+    "model",
+    "features",
+    "accuracy",
+    "error%",
+    "rappel",
+    "precision",
+    "f1_score",
+    "average_precision_score",
+    "time_train",
+    "time_pred",
+]
+NB_IMAGES = 10 # images de validation pour la comparaison des détections
+IOU_MATCH = 0.5
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5}
+
+
+def load_patchs():
+    patchs = []
+    y = []
+    for label, folder in ((1, "pos"), (0, "neg")):
+        for f in sorted(os.listdir(os.path.join(PATCHS_FOLDER, folder))):
+            if f.endswith(".jpg"):
+                # le channel grayscale est dupliqué sur les 3 chanaux RGB (on en isole 1)
+                patchs.append(plt.imread(os.path.join(PATCHS_FOLDER, folder, f))[:, :, 0])
+                y.append(label)
+    return np.array(patchs), np.array(y)
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def test_model(name, model, X_train, y_train, X_test, y_test, X_name):
+    print(f"Testing {name} (x) {X_name} ...")
+
+    start = time.time()
+    model.fit(X_train, y_train)
+    time_train = time.time() - start
+
+    start = time.time()
+    y_pred = model.predict(X_test)
+    time_pred = time.time() - start
+
+    accuracy = accuracy_score(y_test, y_pred)
+    rappel = recall_score(y_test, y_pred)
+    precision = precision_score(y_test, y_pred)
+    return {
+        "model": name,
+        "features": X_name,
+        "accuracy": accuracy,
+        "error%": (1 - accuracy) * 100,
+        "rappel": rappel,
+        "precision": precision,
+        "f1_score": 2 * (precision * rappel) / (precision + rappel),
+        "average_precision_score": average_precision_score(y_test, y_pred),
+        "time_train": time_train,
+        "time_pred": time_pred,
+    }
+
+
+def gt_windows_of(bbox):
+    bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 5)
+    return np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3]], axis=1)
+
+
+def compare_detections(nb_images):
+    """
+    Détections float64 et float32 sur les nb_images dernières images positives annotées (voir la docstring du module).
+    """
+    bbox_train, _, _ = splitter.load_annotations()
+    validation = sorted(bbox_train)[-nb_images:]
+    validation_sources = {f"pos/{f_name}" for f_name in validation}
+
+    dataset = read_augmented(packed_path(PATCHS_FOLDER))
+    indices = np.array([i for i, source in enumerate(dataset.sources) if source not in validation_sources])
+    start = time.time()
+    classifier = SVC(kernel="poly", probability=True)
+    classifier.fit(
+        dataset.features(indices, HOG_extractor, hog_params={}), np.where(dataset.labels[indices] == POS_LABEL, 1, 0)
+    )
+    print(f"Classifieur de détection : {len(indices)} patchs ({time.time() - start:.1f} s)")
+
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, **{key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+
+    # temps, fenêtres gardées, annotations retrouvées, annotations, détections justes, détections (après NMS)
+    results = {"float64": [0.0, 0, 0, 0, 0, 0], "float32": [0.0, 0, 0, 0, 0, 0]}
+    nb_changed = 0
+    max_score_diff = 0.0
+    for f_name in validation:
+        img = plt.imread(os.path.join(splitter.IMAGES_FOLDER, "pos", f"{f_name}.jpg"))
+        gt_windows = gt_windows_of(bbox_train[f_name])
+
+        kept = {}
+        for dtype_name, dtype in (("float64", np.float64), ("float32", np.float32)):
+            start = time.time()
+            windows, scores = detect_ecocup(img, classifier, HOG_extractor, dtype=dtype, **params)
+            results[dtype_name][0] += time.time() - start
+            windows = np.asarray(windows).reshape(-1, 4)
+            kept[dtype_name] = {tuple(window): score for window, score in zip(windows, scores)}
+            detections = np.asarray(non_maxima_suppression_v2(windows, scores)).reshape(-1, 4) if len(scores) else windows
+            found, total = window_recall(gt_windows, detections, IOU_MATCH)
+            correct, nb_detections = window_recall(detections, gt_windows, IOU_MATCH)
+            for k, value in enumerate((len(scores), found, total, correct, nb_detections)):
+                results[dtype_name][k + 1] += value
+
+        common = kept["float64"].keys() & kept["float32"].keys()
+        nb_changed += len(kept["float64"].keys() ^ kept["float32"].keys())
+        if common:
+            max_score_diff = max(max_score_diff, max(abs(kept["float64"][w] - kept["float32"][w]) for w in common))
+
+    print()
+    for dtype_name, (seconds, nb_kept, found, total, correct, nb_detections) in results.items():
+        print(
+            f"Détection {dtype_name} | {seconds:7.1f} s | fenêtres gardées : {nb_kept:5d} | rappel : {found}/{total} "
+            f"({found / max(total, 1):.3f}) | précision : {correct}/{nb_detections} ({correct / max(nb_detections, 1):.3f})"
+        )
+    print(f"Fenêtres gardées par un seul des deux types : {nb_changed}")
+    print(f"Écart de score max sur les fenêtres gardées par les deux : {max_score_diff:.3f}")
+
+
+if __name__ == "__main__":
+    output = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_OUTPUT
+    nb_images = int(sys.argv[2]) if len(sys.argv) > 2 else NB_IMAGES
+
+    patchs, y = load_patchs()
+    print(f"{len(patchs)} patchs ({y.sum()} positifs)")
+
+    # Même découpage pour les deux types
+    indices = np.random.default_rng(0).permutation(len(patchs))
+    train_size = int(len(patchs) * TRAIN_PART)
+    train_idx, test_idx = indices[:train_size], indices[train_size:]
+
+    results = []
+    for dtype_name, as_float in (("float64", img_as_float64), ("float32", img_as_float32)):
+        start = time.time()
+        X = HOG_extractor(as_float(patchs))
+        print(f"HOG {dtype_name} : {X.dtype}, {time.time() - start:.1f} s, {X.nbytes / 1e6:.0f} Mo")
+
+        models = {
+            "SVC (kernel=poly)": SVC(kernel="poly"),
+            "Logistic Regression (max_iter=400)": LogisticRegression(max_iter=400),
+        }
+        for name, model in models.items():
+            results.append(
+                test_model(name, model, X[train_idx], y[train_idx], X[test_idx], y[test_idx], f"HOG {dtype_name}")
+            )
+
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    for row in results:
+        print(f"{row['model']:<36} {row['features']:<13} accuracy={row['accuracy']:.4f} f1={row['f1_score']:.4f}")
+    print()
+
+    compare_detections(nb_images)
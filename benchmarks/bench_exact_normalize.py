@@ -0,0 +1,107 @@
+"""
+Effet de la normalisation par lot (normalize_patches, par défaut) sur la détection, contre la normalisation historique
+fenêtre par fenêtre (detect_ecocup(..., exact=True), normalize_patch), avec le classifieur retenu dans
+resultats_classification.csv (HOG par défaut, SVC polynomial).
+
+Les deux normalisations ne diffèrent que par les arrondis flottants (~1e-16), mais le HOG y est sensible : une
+composante du gradient exactement nulle ou de l'ordre de ±1e-16 fait passer l'orientation de 0° à ~180°, donc d'un
+bin extrême à l'autre. Les scores de quelques fenêtres changent et celles proches du seuil peuvent être gardées ou
+non : on mesure donc le nombre de fenêtres gardées, l'écart des scores, le rappel et la précision (après NMS) sur des
+images de validation, dont les patchs sont retirés du jeu d'entraînement du classifieur.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_exact_normalize.py [nombre_d_images_de_validation]
+"""
+
+import importlib
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from sklearn.svm import SVC
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.detection import detect_ecocup, non_maxima_suppression_v2, window_recall
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+NB_IMAGES = 10
+IOU_MATCH = 0.5
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5}
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def gt_windows_of(bbox):
+    bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 5)
+    return np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3]], axis=1)
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else NB_IMAGES
+
+    bbox_train, _, _ = splitter.load_annotations()
+    validation = sorted(bbox_train)[-nb_images:]
+    validation_sources = {f"pos/{f_name}" for f_name in validation}
+
+    # Classifieur entraîné sans les patchs des images de validation
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    indices = np.array([i for i, source in enumerate(dataset.sources) if source not in validation_sources])
+    start = time.time()
+    classifier = SVC(kernel="poly", probability=True)
+    classifier.fit(
+        dataset.features(indices, HOG_extractor, hog_params={}), np.where(dataset.labels[indices] == POS_LABEL, 1, 0)
+    )
+    print(f"Classifieur : {len(indices)} patchs ({time.time() - start:.1f} s)")
+
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, **{key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+
+    # temps, fenêtres gardées, annotations retrouvées, annotations, détections justes, détections (après NMS)
+    results = {"exact": [0.0, 0, 0, 0, 0, 0], "par lot": [0.0, 0, 0, 0, 0, 0]}
+    nb_changed = 0
+    max_score_diff = 0.0
+    for f_name in validation:
+        img = plt.imread(os.path.join(splitter.IMAGES_FOLDER, "pos", f"{f_name}.jpg"))
+        gt_windows = gt_windows_of(bbox_train[f_name])
+
+        kept = {}
+        for name, exact in (("exact", True), ("par lot", False)):
+            start = time.time()
+            windows, scores = detect_ecocup(img, classifier, HOG_extractor, exact=exact, **params)
+            results[name][0] += time.time() - start
+            windows = np.asarray(windows).reshape(-1, 4)
+            kept[name] = {tuple(window): score for window, score in zip(windows, scores)}
+            detections = np.asarray(non_maxima_suppression_v2(windows, scores)).reshape(-1, 4) if len(scores) else windows
+            found, total = window_recall(gt_windows, detections, IOU_MATCH)
+            correct, nb_detections = window_recall(detections, gt_windows, IOU_MATCH)
+            for k, value in enumerate((len(scores), found, total, correct, nb_detections)):
+                results[name][k + 1] += value
+
+        common = kept["exact"].keys() & kept["par lot"].keys()
+        nb_changed += len(kept["exact"].keys() ^ kept["par lot"].keys())
+        if common:
+            max_score_diff = max(max_score_diff, max(abs(kept["exact"][w] - kept["par lot"][w]) for w in common))
+
+    print()
+    for name, (seconds, nb_kept, found, total, correct, nb_detections) in results.items():
+        print(
+            f"{name:7s} | {seconds:7.1f} s | fenêtres gardées : {nb_kept:5d} | rappel : {found}/{total} "
+            f"({found / max(total, 1):.3f}) | précision : {correct}/{nb_detections} ({correct / max(nb_detections, 1):.3f})"
+        )
+    print(f"Fenêtres gardées par une seule des deux normalisations : {nb_changed}")
+    print(f"Écart de score max sur les fenêtres gardées par les deux : {max_score_diff:.3f}")
+    print(f"Speedup x{results['exact'][0] / max(results['par lot'][0], 1e-9):.2f}")
@@ -0,0 +1,69 @@
+"""
+Budget de temps d'import de utils.detection (et de utils.model_bundle, utilisé par les workers d'inférence).
+
+Chaque module est importé dans un interpréteur neuf avec python -X importtime : le temps cumulé de son import
+(numpy compris) est comparé à IMPORT_BUDGET_MS, et les modules lourds qui ne doivent être chargés qu'à la première
+utilisation (HEAVY_MODULES) ne doivent pas apparaître. Les modules les plus coûteux sont affichés.
+Le code de sortie est 1 si le budget est dépassé ou si un module lourd est importé, pour servir de garde-fou.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_import.py [nombre_de_répétitions]
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODULES = ["utils.detection", "utils.model_bundle"]
+NB_RUNS = 5            # le temps retenu est le médian des exécutions (le premier import subit le cache disque)
+IMPORT_BUDGET_MS = 250 # temps cumulé maximal de l'import d'un module de MODULES, numpy compris
+HEAVY_MODULES = ["matplotlib", "skimage", "scipy", "sklearn", "PIL", "cv2"]
+NB_SHOWN = 10          # nombre de modules les plus coûteux affichés
+
+
+def import_times(module):
+    """
+    Importe module dans un nouvel interpréteur avec -X importtime.
+    :return: Dictionnaire module -> temps cumulé d'import (ms), et ensemble des modules chargés à la fin.
+    """
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000
+    return times, set(result.stdout.split())
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+if __name__ == "__main__":
+    nb_runs = int(sys.argv[1]) if len(sys.argv) > 1 else NB_RUNS
+
+    ok = True
+    for module in MODULES:
+        runs = [import_times(module) for _ in range(nb_runs)]
+        total = median([times[module] for times, _ in runs])
+        times, loaded = runs[-1]
+        heavy = sorted({name.split(".")[0] for name in loaded} & set(HEAVY_MODULES))
+
+        print(f"{module} : {total:.1f} ms (budget : {IMPORT_BUDGET_MS} ms), modules lourds chargés : {heavy or 'aucun'}")
+        top_level = {name: t for name, t in times.items() if "." not in name or name.startswith("utils.")}
+        for name, t in sorted(top_level.items(), key=lambda item: -item[1])[:NB_SHOWN]:
+            print(f"\t{name:40s} {t:8.1f} ms")
+
+        if total > IMPORT_BUDGET_MS or heavy:
+            ok = False
+
+    print("Budget respecté" if ok else "Budget dépassé")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,117 @@
+"""
+Benchmark des images intégrales (utils.integral) :
+1. écart-type et énergie des contours de toutes les fenêtres d'une image, par les tables intégrales (4 lectures par
+   fenêtre) contre découpe et parcours de chaque fenêtre, pour plusieurs tailles de fenêtres ;
+2. detect_ecocup avec et sans préfiltre (WindowPrefilter calibré sur les annotations des autres images
+   d'entraînement) : temps et annotations retrouvées (IoU >= IOU_MATCH avec une fenêtre gardée).
+Le classifieur est une régression logistique sur le HOG (rapide à entraîner) : le gain du préfiltre vient des
+fenêtres qui ne sont ni normalisées ni décrites.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_integral.py [nombre_d_images]
+"""
+
+import importlib
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.detection import detect_ecocup, get_iou_matrix, preprocess_image, strided_sliding_window
+from utils.integral import IntegralImage, calibrate_prefilter
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+NB_IMAGES = 3
+IOU_MATCH = 0.5
+WINDOW_SHAPES = [(107, 61), (300, 170), (600, 350)]
+PX_STEP = 35
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5}
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def gt_windows_of(bbox_list):
+    bbox = np.asarray(bbox_list, dtype=np.float64).reshape(-1, 5)
+    return np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3]], axis=1)
+
+
+def recall(windows, gt_windows):
+    if len(windows) == 0:
+        return 0, len(gt_windows)
+    found = get_iou_matrix(gt_windows, np.asarray(windows).reshape(-1, 4)).max(axis=1) >= IOU_MATCH
+    return int(found.sum()), len(gt_windows)
+
+
+def load_image(f_name):
+    return plt.imread(os.path.join(splitter.IMAGES_FOLDER, "pos", f"{f_name}.jpg"))
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else NB_IMAGES
+    bbox_train, _, _ = splitter.load_annotations()
+    f_names = list(bbox_train)
+
+    # 1. Statistiques par fenêtre
+    img = preprocess_image(load_image(f_names[0]))
+    start = time.time()
+    integral = IntegralImage(img)
+    print(f"Construction des tables ({img.shape}) : {time.time() - start:.3f} s")
+    for h, w in WINDOW_SHAPES:
+        windows, coords = strided_sliding_window(img, h, w, PX_STEP, PX_STEP)
+        start = time.time()
+        std_ref = np.array([window.std() for row in windows for window in row])
+        edge_ref = np.array([np.hypot(*np.gradient(window)).mean() for row in windows for window in row])
+        time_ref = time.time() - start
+        start = time.time()
+        std = integral.std(coords)
+        edge = integral.edge_energy(coords)
+        time_integral = time.time() - start
+        print(
+            f"({h}, {w}) {len(coords)} fenêtres | découpe : {time_ref:.3f} s | intégrales : {time_integral:.4f} s "
+            f"(x{time_ref / max(time_integral, 1e-9):.0f}) | écart max std : {np.abs(std - std_ref).max():.2e}"
+        )
+
+    # 2. Détection avec et sans préfiltre
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    indices = np.arange(len(dataset))
+    classifier = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, class_weight="balanced"))
+    classifier.fit(dataset.features(indices, HOG_extractor, hog_params={}), np.where(dataset.labels == POS_LABEL, 1, 0))
+
+    prefilter = calibrate_prefilter(
+        (preprocess_image(load_image(f_name)), gt_windows_of(bbox_train[f_name])) for f_name in f_names[nb_images:]
+    )
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, **{key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+
+    results = {"direct": [0.0, 0, 0], "préfiltre": [0.0, 0, 0]} # temps, annotations retrouvées, annotations
+    for f_name in f_names[:nb_images]:
+        img = load_image(f_name)
+        for name, image_prefilter in (("direct", None), ("préfiltre", prefilter)):
+            start = time.time()
+            windows, _ = detect_ecocup(img, classifier, HOG_extractor, prefilter=image_prefilter, **params)
+            results[name][0] += time.time() - start
+            found, total = recall(windows, gt_windows_of(bbox_train[f_name]))
+            results[name][1] += found
+            results[name][2] += total
+
+    for name, (seconds, found, total) in results.items():
+        print(f"{name:9s} | {seconds:8.1f} s | annotations retrouvées : {found}/{total}")
+    print(f"Speedup x{results['direct'][0] / max(results['préfiltre'][0], 1e-9):.2f}")
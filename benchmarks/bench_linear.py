@@ -0,0 +1,89 @@
+"""
+Benchmark du mode de détection "linear" (utils.linear_detector) contre le mode "hog_pyramid", avec le même
+classifieur linéaire (StandardScaler + LogisticRegression sur le HOG par défaut) : mêmes fenêtres gardées, écart
+maximal des scores et temps de détection. Le mode "linear" est aussi mesuré avec un pas d'une cellule HOG
+(DENSE_PX_STEP), où la corrélation par FFT évalue toutes les positions.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_linear.py [nombre_d_images]
+"""
+
+import contextlib
+import importlib
+import io
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from skimage.feature import hog
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from local_data.augmented_dataset import read_augmented
+from local_data.packed_dataset import POS_LABEL, packed_path
+from utils.detection import detect_ecocup
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+NB_IMAGES = 3
+DETECTION_PARAMS = {"px_step": 35, "scales_nb": 10, "ratios_nb": 5, "confidence_threshold": 0.5, "hog_params": {}}
+DENSE_PX_STEP = 8 # une cellule HOG (pixels_per_cell par défaut)
+
+
+def HOG_extractor(patchs):
+    first_features = hog(patchs[0])  # valeurs par défaut
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def timed_detection(img, classifier, **params):
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()): # logs par itération de detect_ecocup
+        windows, scores = detect_ecocup(img, classifier, HOG_extractor, **params)
+    return np.asarray(windows).reshape(-1, 4), np.asarray(scores), time.time() - start
+
+
+if __name__ == "__main__":
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else NB_IMAGES
+
+    start = time.time()
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    indices = np.arange(len(dataset))
+    classifier = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, class_weight="balanced"))
+    classifier.fit(dataset.features(indices, HOG_extractor, hog_params={}), np.where(dataset.labels == POS_LABEL, 1, 0))
+    print(f"Classifieur linéaire : {time.time() - start:.1f} s")
+
+    stats = normalizer.get_stats()
+    params = dict(DETECTION_PARAMS, **{key: stats[key] for key in ("min_ratio", "max_ratio", "min_scale", "max_scale")})
+    bbox_train, _, _ = splitter.load_annotations()
+
+    times = {"hog_pyramid": 0.0, "linear": 0.0, "linear dense": 0.0}
+    for f_name in list(bbox_train)[:nb_images]:
+        img = plt.imread(os.path.join(splitter.IMAGES_FOLDER, "pos", f"{f_name}.jpg"))
+        windows_ref, scores_ref, seconds_ref = timed_detection(img, classifier, mode="hog_pyramid", **params)
+        windows, scores, seconds = timed_detection(img, classifier, mode="linear", **params)
+        _, scores_dense, seconds_dense = timed_detection(
+            img, classifier, mode="linear", **dict(params, px_step=DENSE_PX_STEP)
+        )
+        times["hog_pyramid"] += seconds_ref
+        times["linear"] += seconds
+        times["linear dense"] += seconds_dense
+
+        same = np.array_equal(windows, windows_ref)
+        max_diff = np.abs(scores - scores_ref).max() if same and len(scores) > 0 else float("nan")
+        print(
+            f"{f_name} | hog_pyramid {seconds_ref:6.1f} s | linear {seconds:6.1f} s | linear dense {seconds_dense:6.1f} s "
+            f"({len(scores_dense)} fenêtres gardées) | mêmes fenêtres : {same} ({len(windows)}), écart max {max_diff:.1e}"
+        )
+
+    for name, seconds in times.items():
+        print(f"{name:12s} | {seconds:8.1f} s")
+    print(f"Speedup x{times['hog_pyramid'] / max(times['linear'], 1e-9):.2f}")
@@ -0,0 +1,127 @@
+"""
+Benchmark de la NMS : implémentation historique (get_iou scalaire dans une compréhension de liste)
+contre la version vectorisée de utils.detection.non_maxima_suppression_v2
+et la version avec index spatial utils.detection.non_maxima_suppression_grid.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_nms.py [n_boxes ...]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.detection import get_iou, non_maxima_suppression_grid, non_maxima_suppression_v2
+
+LEGACY_MAX_BOXES = 10_000  # au-delà, l'implémentation historique prend plusieurs minutes
+IMG_SHAPE = (1000, 1500)
+
+
+def legacy_non_maxima_suppression(windows_list, scores, iou_decision_criteria=0.5, score_decision_criteria=0.5):
+    """
+    Implémentation d'origine de non_maxima_suppression_v2, gardée comme référence.
+    """
+    best_windows = []
+
+    valid_indices = np.where(scores >= score_decision_criteria)[0]
+    windows_list = windows_list[valid_indices]
+    scores = scores[valid_indices]
+
+    order = np.argsort(scores)[::-1]
+    windows_list = windows_list[order]
+    scores = scores[order]
+
+    while len(windows_list) > 0:
+        best_window = windows_list[0]
+        best_windows.append(best_window)
+
+        windows_list = windows_list[1:]
+        scores = scores[1:]
+
+        iou_scores = np.array([get_iou(best_window, window) for window in windows_list])
+        valid_indices = np.where(iou_scores < iou_decision_criteria)[0]
+        windows_list = windows_list[valid_indices]
+        scores = scores[valid_indices]
+
+    return best_windows
+
+
+def random_windows(n_boxes, rng, img_shape=IMG_SHAPE):
+    """
+    Fenêtres aléatoires au format ((upper_left), (lower_right)), aux tailles des patchs d'entraînement (stats.txt).
+    """
+    heights = rng.integers(107, 400, n_boxes)
+    widths = (heights * rng.uniform(0.43, 0.98, n_boxes)).astype(int)
+    upper_left_x = rng.integers(0, img_shape[0] - heights)
+    upper_left_y = rng.integers(0, img_shape[1] - widths)
+    windows = np.stack(
+        [upper_left_x, upper_left_y, upper_left_x + heights, upper_left_y + widths], axis=1
+    ).reshape(-1, 2, 2)
+    scores = rng.uniform(0.5, 1.0, n_boxes)
+    return windows, scores
+
+
+def bench(n_boxes, rng):
+    windows, scores = random_windows(n_boxes, rng)
+
+    start = time.time()
+    kept = non_maxima_suppression_v2(windows, scores)
+    time_new = time.time() - start
+
+    start = time.time()
+    kept_grid = non_maxima_suppression_grid(windows, scores)
+    time_grid = time.time() - start
+
+    assert np.array_equal(np.array(kept), np.array(kept_grid)), "Résultats différents entre NMS vectorisée et en grille"
+    print(f"{n_boxes:>7} boxes | grille : {time_grid:8.3f} s")
+
+    if n_boxes > LEGACY_MAX_BOXES:
+        print(f"{n_boxes:>7} boxes | vectorisée : {time_new:8.3f} s | historique : ignorée | gardées : {len(kept)}")
+        return
+
+    start = time.time()
+    kept_legacy = legacy_non_maxima_suppression(windows, scores)
+    time_legacy = time.time() - start
+
+    assert np.array_equal(np.array(kept), np.array(kept_legacy)), "Résultats différents entre les deux NMS"
+    print(
+        f"{n_boxes:>7} boxes | vectorisée : {time_new:8.3f} s | historique : {time_legacy:8.3f} s "
+        f"| speedup x{time_legacy / max(time_new, 1e-9):.1f} | gardées : {len(kept)}"
+    )
+
+
+def bench_scaling(n_boxes, rng):
+    """
+    Densité de fenêtres constante (l'image grandit avec n_boxes) : le temps de la NMS en grille doit croître
+    à peu près linéairement, celui de la NMS vectorisée quadratiquement.
+    """
+    side = int(np.sqrt(n_boxes / 1_000) * 1_500)
+    windows, scores = random_windows(n_boxes, rng, img_shape=(side, side))
+
+    start = time.time()
+    kept_grid = non_maxima_suppression_grid(windows, scores)
+    time_grid = time.time() - start
+
+    start = time.time()
+    kept = non_maxima_suppression_v2(windows, scores)
+    time_new = time.time() - start
+
+    assert np.array_equal(np.array(kept), np.array(kept_grid)), "Résultats différents entre NMS vectorisée et en grille"
+    print(
+        f"{n_boxes:>7} boxes (image {side}x{side}) | grille : {time_grid:8.3f} s | vectorisée : {time_new:8.3f} s "
+        f"| gardées : {len(kept)}"
+    )
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [1_000, 10_000, 100_000]
+    rng = np.random.default_rng(0)
+    for n_boxes in sizes:
+        bench(n_boxes, rng)
+    print()
+    for n_boxes in sizes:
+        bench_scaling(n_boxes, rng)
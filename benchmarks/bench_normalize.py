@@ -0,0 +1,49 @@
+"""
+Vérification et benchmark de normalize_patches (par lot) contre normalize_patch (patch par patch),
+sur les fenêtres d'une image d'entraînement, pour plusieurs formes de fenêtres.
+
+Usage (depuis la racine du projet) :
+python benchmarks/bench_normalize.py [chemin_image]
+"""
+
+import importlib
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils.detection import strided_sliding_window
+
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+TOLERANCE = 1e-10  # écart maximal accepté entre les deux versions (valeurs dans [0, 1])
+WINDOW_SHAPES = [(107, 61), (300, 170), (600, 350), (170, 300)]
+PX_STEP = 40
+DEFAULT_IMAGE = os.path.join("local_data", "1_data_filtered", "train", "images", "pos", "0000.jpg")
+
+
+if __name__ == "__main__":
+    img = plt.imread(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE)
+    target_shape = normalizer.get_target_shape()
+
+    for h, w in WINDOW_SHAPES:
+        windows, coords = strided_sliding_window(img, h, w, PX_STEP, PX_STEP)
+
+        start = time.time()
+        reference = np.array([normalizer.normalize_patch(target_shape, window) for row in windows for window in row])
+        time_ref = time.time() - start
+
+        start = time.time()
+        batched = np.concatenate([normalizer.normalize_patches(target_shape, row) for row in windows])
+        time_batch = time.time() - start
+
+        max_diff = np.abs(reference - batched).max()
+        assert max_diff < TOLERANCE, f"Écart trop grand pour ({h}, {w}) : {max_diff}"
+        print(
+            f"({h:3d}, {w:3d}) x {len(coords):5d} | patch par patch : {time_ref:7.3f} s | par lot : {time_batch:7.3f} s "
+            f"| speedup x{time_ref / max(time_batch, 1e-9):.1f} | écart max : {max_diff:.2e}"
+        )
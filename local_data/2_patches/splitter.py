@@ -1,46 +1,242 @@
-
 import os
 import numpy as np
 import matplotlib.pyplot as plt
 import random
-import shutil
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from local_data.build_manifest import BuildManifest, load_previous, params_digest, save_stage
+from local_data.image_io import imread_many, iter_imread, read_shape
+from local_data.packed_dataset import NEG_LABEL, POS_LABEL
+from utils.feature_store import file_digest
 
 # Paramètres 
 NB_NEG_FACTOR = 5       # coefficient : nombre de patchs négatifs = ce coeff * nb patchs positifs
 MIN_PATCH_AREA = 30     # px² : aire minimale pour qu'un patch soit considéré valide (sinon considéré comme une erreur d'annotation) 
 KEEP_DIFFICULT = False  # booléenne. Si True : les annotations marquées 0 (faciles) ET 1 (difficiles) sont découpées, sinon seuelement celles faciles
+EXPORT_JPG = True       # booléen. Si True, les patchs sont aussi enregistrés un par un en .jpg (en plus du format groupé local_data/2_patches/patches)
+STREAMING = True        # booléen. Si True, chaque image est décodée une seule fois, découpée puis libérée (mémoire bornée à STREAMING_PREFETCH + 1 images). Si False, toutes les images lues restent en mémoire
+STREAMING_PREFETCH = 2  # STREAMING : nombre d'images décodées en avance pendant la découpe de la courante (voir iter_imread)
+SEED_PER_NEG_IMAGE = False # booléen. Si True, chaque image négative a un quota égal de patchs, tirés avec une graine issue de son nom : ajouter ou modifier une image ne redécoupe que ses patchs, mais les négatifs ne sont plus ceux des tirages d'origine. Si False, tirages d'origine (random.seed(0), image tirée au hasard à chaque patch), tous refaits si une image négative change
+MAX_NEG_TRIES = 1000    # SEED_PER_NEG_IMAGE : tirages successifs sans découpe valide sur une image avant de l'abandonner (image plus petite que toutes les bbox)
+
+STAGE_FOLDER = os.path.join("local_data", "2_patches")
+IMAGES_FOLDER = os.path.join("local_data", "1_data_filtered", "train", "images")
+LABELS_FOLDER = os.path.join("local_data", "1_data_filtered", "train", "labels_csv")
 
 def splitter():
 
     # De manière à ce que la génération aléatoire soit répétable
     random.seed(0)
-
-    # Clear des dossiers avant mise à jour
-    clear_folder(os.path.join("local_data", "2_patches", "pos"))
-    clear_folder(os.path.join("local_data", "2_patches", "neg"))
     
     print(f"Rappel des paramètres:")
     print(f"\tNB_NEG_FACTOR = {NB_NEG_FACTOR}")
     print(f"\tMIN_PATCH_AREA = {MIN_PATCH_AREA}")
-    print(f"\tKEEP_DIFFICULT = {KEEP_DIFFICULT}\n")
+    print(f"\tKEEP_DIFFICULT = {KEEP_DIFFICULT}")
+    print(f"\tEXPORT_JPG = {EXPORT_JPG}")
+    print(f"\tSTREAMING = {STREAMING}")
+    print(f"\tSEED_PER_NEG_IMAGE = {SEED_PER_NEG_IMAGE}\n")
+
+    # Reconstruction incrémentale (voir local_data/build_manifest.py) : seuls les patchs dont l'image, le CSV ou les paramètres ont changé sont redécoupés
+    manifest = BuildManifest(STAGE_FOLDER)
+    previous_patchs, previous_meta = load_previous(STAGE_FOLDER)
+    pos_params = params_digest({"MIN_PATCH_AREA": MIN_PATCH_AREA, "KEEP_DIFFICULT": KEEP_DIFFICULT})
+
+    bbox_train, inputs_train, neg_paths = load_annotations()
+
+    pos_patchs = {}
+    neg_patchs = {}
+    meta = {} # nom du patch -> (image source, bbox)
+    regenerated = set() # patchs dont le contenu a changé à cette exécution
+
+    pos_cuts = plan_pos_cuts(bbox_train)
+
+    # Seules les images dont un patch n'est pas à jour sont lues (en parallèle)
+    stale_f_names = [
+        f_name
+        for f_name, cuts in pos_cuts.items()
+        if not all(
+            manifest.is_fresh(patch_name, inputs_train[f_name], pos_params) and patch_name in previous_patchs
+            for patch_name, _ in cuts
+        )
+    ]
+    stale_paths = [os.path.join(IMAGES_FOLDER, "pos", f"{f}.jpg") for f in stale_f_names]
+    stale_imgs = iter_imread(stale_paths, prefetch=STREAMING_PREFETCH) if STREAMING else iter(imread_many(stale_paths))
+
+    # Découpe des images positives et enregistrement (stale_f_names est dans l'ordre de pos_cuts)
+    stale_f_names = set(stale_f_names)
+    nb_pos_patches = 0
+    for f_name, cuts in pos_cuts.items():
+        img = next(stale_imgs) if f_name in stale_f_names else None
+        for patch_name, patch_bbox in cuts:
+            nb_pos_patches +=1
+            meta[patch_name] = (f"pos/{f_name}", patch_bbox)
+            if img is None: # patch à jour, repris du jeu précédent
+                pos_patchs[patch_name] = previous_patchs[patch_name]
+                continue
+
+            img_cut = crop(img, patch_bbox)
+            pos_patchs[patch_name] = img_cut
+            if manifest.record(patch_name, inputs_train[f_name], pos_params, img_cut):
+                regenerated.add(patch_name)
+
+    print()
+    print(f"Nombre de patchs positifs conservés : {nb_pos_patches} ({len(stale_f_names)} images redécoupées)")
 
+    split_neg = split_neg_per_image if SEED_PER_NEG_IMAGE else split_neg_pooled
+    neg_status = split_neg(
+        manifest, previous_patchs, previous_meta, bbox_train, inputs_train, neg_paths, nb_pos_patches,
+        neg_patchs, meta, regenerated,
+    )
+
+    print()
+    print(f"Nombre de patchs négatifs conservés : {len(neg_patchs)} ({neg_status})")
+
+    save_stage(STAGE_FOLDER, pos_patchs, neg_patchs, meta, manifest, regenerated, EXPORT_JPG)
+
+
+def split_neg_pooled(
+    manifest, previous_patchs, previous_meta, bbox_train, inputs_train, neg_paths, nb_pos_patches,
+    neg_patchs, meta, regenerated,
+):
+    """
+    Négatifs des tirages d'origine (random.seed(0), voir iter_neg_cuts), ajoutés à neg_patchs, meta et regenerated.
+    :return: État des négatifs pour l'affichage ("repris" ou "redécoupés").
+    """
+    # Les tirages des négatifs dépendent de toutes les bbox, de toutes les images négatives et du nombre de positifs :
+    # si l'un d'eux change, tous les négatifs sont retirés (avec la même graine, donc les mêmes tirages à entrées égales)
+    neg_inputs = {
+        "pool": params_digest({
+            "labels": [inputs_train[f]["labels"] for f in bbox_train],
+            "neg_images": [[f, file_digest(os.path.join(IMAGES_FOLDER, "neg", f"{f}.jpg"))] for f in neg_paths],
+            "nb_pos_patches": nb_pos_patches,
+        })
+    }
+    neg_params = params_digest({"NB_NEG_FACTOR": NB_NEG_FACTOR, "MIN_PATCH_AREA": MIN_PATCH_AREA, "KEEP_DIFFICULT": KEEP_DIFFICULT})
+    previous_neg_names = [name for name, artifact in manifest.artifacts.items() if "pool" in artifact["inputs"]]
+    neg_fresh = len(previous_neg_names) == nb_pos_patches * NB_NEG_FACTOR and all(
+        manifest.is_fresh(name, neg_inputs, neg_params) and name in previous_patchs for name in previous_neg_names
+    )
+
+    if neg_fresh:
+        for patch_name in previous_neg_names:
+            neg_patchs[patch_name] = previous_patchs[patch_name]
+            meta[patch_name] = previous_meta[patch_name]
+    else:
+        for patch_name, f_name, patch_bbox, img_cut in iter_neg_cuts(neg_paths, bbox_train, nb_pos_patches * NB_NEG_FACTOR):
+            neg_patchs[patch_name] = img_cut
+            meta[patch_name] = (f"neg/{f_name}", patch_bbox)
+            if manifest.record(patch_name, neg_inputs, neg_params, img_cut):
+                regenerated.add(patch_name)
+    return "repris" if neg_fresh else "redécoupés"
+
+
+def split_neg_per_image(
+    manifest, previous_patchs, previous_meta, bbox_train, inputs_train, neg_paths, nb_pos_patches,
+    neg_patchs, meta, regenerated,
+):
+    """
+    Négatifs tirés image par image (SEED_PER_NEG_IMAGE, voir iter_image_neg_cuts), ajoutés à neg_patchs, meta et
+    regenerated.
+    :return: État des négatifs pour l'affichage (nombre d'images redécoupées).
+    """
+    # Les tirages d'une image négative ne dépendent que de son nom (graine), de son contenu et des bbox des positifs :
+    # une image ajoutée ou modifiée ne fait redécouper que ses propres patchs. Le nombre de positifs ne fixe que le
+    # quota de chaque image, dont les premiers tirages restent les mêmes si le quota change.
+    bboxes = params_digest({"labels": [inputs_train[f]["labels"] for f in sorted(bbox_train)]})
+    neg_params = params_digest({"MIN_PATCH_AREA": MIN_PATCH_AREA, "KEEP_DIFFICULT": KEEP_DIFFICULT})
+    neg_quotas = plan_neg_quotas(neg_paths, nb_pos_patches * NB_NEG_FACTOR)
+    neg_inputs = {
+        f_name: {"image": file_digest(os.path.join(IMAGES_FOLDER, "neg", f"{f_name}.jpg")), "bboxes": bboxes}
+        for f_name in neg_quotas
+    }
+
+    # Seules les images dont un patch n'est pas à jour sont lues et retirées
+    stale_neg_quotas = {
+        f_name: quota
+        for f_name, quota in neg_quotas.items()
+        if not all(
+            manifest.is_fresh(patch_name, neg_inputs[f_name], neg_params) and patch_name in previous_patchs
+            for patch_name in neg_patch_names(f_name, quota)
+        )
+    }
+    stale_neg_cuts = iter_image_neg_cuts(stale_neg_quotas, bbox_train)
+
+    # Découpe des images négatives et enregistrement (stale_neg_quotas est dans l'ordre de neg_quotas)
+    for f_name, quota in neg_quotas.items():
+        if f_name not in stale_neg_quotas: # patchs à jour, repris du jeu précédent
+            for patch_name in neg_patch_names(f_name, quota):
+                neg_patchs[patch_name] = previous_patchs[patch_name]
+                meta[patch_name] = previous_meta[patch_name]
+            continue
+
+        _, cuts = next(stale_neg_cuts)
+        for patch_name, patch_bbox, img_cut in cuts:
+            neg_patchs[patch_name] = img_cut
+            meta[patch_name] = (f"neg/{f_name}", patch_bbox)
+            if manifest.record(patch_name, neg_inputs[f_name], neg_params, img_cut):
+                regenerated.add(patch_name)
+    return f"{len(stale_neg_quotas)} images redécoupées"
+
+
+# Version générateur de splitter, pour la chaîne en mémoire (local_data/pipeline.py) : pas de manifeste ni d'écriture,
+# chaque image source est lue une seule fois
+def iter_splitter():
+    """
+    Mêmes patchs, dans le même ordre et avec les mêmes tirages aléatoires que splitter.
+    Les tirages des négatifs ne dépendent que des annotations : les deux générateurs sont indépendants.
+    :return: Générateurs des positifs et des négatifs, de (nom, label, patch, (image source, bbox)).
+    """
+    bbox_train, _, neg_paths = load_annotations()
+    pos_cuts = plan_pos_cuts(bbox_train)
+    nb_pos_patches = sum(len(cuts) for cuts in pos_cuts.values())
+    return _iter_pos_split(pos_cuts), _iter_neg_split(neg_paths, bbox_train, nb_pos_patches * NB_NEG_FACTOR)
+
+def _iter_pos_split(pos_cuts):
+    # Lecture des images positives en parallèle, au fil de la découpe
+    f_names = [f_name for f_name, cuts in pos_cuts.items() if cuts]
+    imgs_pos = iter_imread([os.path.join(IMAGES_FOLDER, "pos", f"{f}.jpg") for f in f_names], prefetch=STREAMING_PREFETCH)
+    for f_name, img in zip(f_names, imgs_pos):
+        for patch_name, patch_bbox in pos_cuts[f_name]:
+            yield patch_name, POS_LABEL, crop(img, patch_bbox), (f"pos/{f_name}", patch_bbox)
+
+def _iter_neg_split(neg_paths, bbox_train, nb_neg_target):
+    if SEED_PER_NEG_IMAGE:
+        neg_quotas = plan_neg_quotas(neg_paths, nb_neg_target)
+        cuts = (
+            (patch_name, f_name, patch_bbox, img_cut)
+            for f_name, image_cuts in iter_image_neg_cuts(neg_quotas, bbox_train)
+            for patch_name, patch_bbox, img_cut in image_cuts
+        )
+    else:
+        # De manière à ce que la génération aléatoire soit répétable
+        random.seed(0)
+        cuts = iter_neg_cuts(neg_paths, bbox_train, nb_neg_target)
+    for patch_name, f_name, patch_bbox, img_cut in cuts:
+        yield patch_name, NEG_LABEL, img_cut, (f"neg/{f_name}", patch_bbox)
+
+
+def load_annotations():
+    """
+    :return: bbox de chaque image positive, empreintes {"image", "labels"} de chaque image positive et noms des images négatives.
+    """
     # Recherche des fichiers de labels
     f_labels = [
         os.path.splitext(f)[0]
-        for f in os.listdir(os.path.join("local_data", "1_data_filtered", "train", "labels_csv"))
+        for f in os.listdir(LABELS_FOLDER)
         if f.endswith(".csv")
     ]
     print(f"f_labels: {f_labels[:5]} ... len:{len(f_labels)}\n")
 
-    img_pos_train = {}
-    img_neg_train = {}
     bbox_train = {}
+    inputs_train = {}
 
     # Extraction des données des labels et des images correspondantes
     for f in f_labels:
 
         # parsing grâce à np.loadtxt
-        bbox = np.loadtxt(os.path.join("local_data","1_data_filtered", "train", "labels_csv", f"{f}.csv"), delimiter=",")
+        label_path = os.path.join(LABELS_FOLDER, f"{f}.csv")
+        bbox = np.loadtxt(label_path, delimiter=",")
         
         # Plusieurs cas possibles : 
         
@@ -53,43 +249,32 @@ def splitter():
             bbox = [bbox]
 
 
-        # Extraction de l'image correspondante
-        try:
-            img_pos = plt.imread(
-                os.path.join("local_data", "1_data_filtered", "train", "images", "pos", f"{f}.jpg")
-            )
-            
-        except FileNotFoundError:
+        # Image correspondante : enregistrement des appairages que si le tout est cohérent
+        img_path = os.path.join(IMAGES_FOLDER, "pos", f"{f}.jpg")
+        if not os.path.exists(img_path):
             continue
 
-        # Enregistrement des appairages que si le tout est cohérent
-        img_pos_train[f"{f}"] = img_pos
         bbox_train[f"{f}"] = bbox
+        inputs_train[f"{f}"] = {"image": file_digest(img_path), "labels": file_digest(label_path)}
 
 
-    # Chargement des images négatives
-    neg_paths = [os.path.splitext(f)[0] for f in  os.listdir(os.path.join("local_data", "1_data_filtered", "train", "images", "neg")) if f.endswith(".jpg")]
-    for f in neg_paths:
-        try:
-            img_neg = plt.imread(
-                os.path.join("local_data", "1_data_filtered", "train", "images", "neg", f"{f}.jpg")
-            )
-            img_neg_train[f"{f}"] = img_neg
-
-        except FileNotFoundError:
-            continue
+    # Images négatives (lues seulement au moment des tirages)
+    neg_paths = [os.path.splitext(f)[0] for f in  os.listdir(os.path.join(IMAGES_FOLDER, "neg")) if f.endswith(".jpg")]
 
-    print(f"len img_pos_train : {len(img_pos_train)}")
     print(f"len bbox_train : {len(bbox_train)}")
-    print(f"len img_neg_train : {len(img_neg_train)}\n")
+    print(f"len neg_paths : {len(neg_paths)}\n")
 
+    return bbox_train, inputs_train, neg_paths
 
-    # Découpe des images positives, filtre et enregistrement
-    nb_pos_patches = 0
-    for f_name in img_pos_train.keys():
-        bbox_list = bbox_train[f_name]
-        img = img_pos_train[f_name]
 
+def plan_pos_cuts(bbox_train):
+    """
+    Filtre des bbox positives.
+    :return: Dictionnaire nom de l'image -> liste de (nom du patch, (upper_left_Y, upper_left_X, height, width)).
+    """
+    pos_cuts = {}
+    for f_name, bbox_list in bbox_train.items():
+        pos_cuts[f_name] = []
         for j, bbox in enumerate(bbox_list):
             upper_left_corner_Y = int(bbox[0])
             upper_left_corner_X = int(bbox[1])
@@ -104,32 +289,68 @@ def splitter():
             if is_difficult and not KEEP_DIFFICULT:
                 continue
 
-            nb_pos_patches +=1
-
-            lower_right_corner_Y = upper_left_corner_Y + height
-            lower_right_corner_X = upper_left_corner_X + width
-
-            img_cut = img[
-                upper_left_corner_Y:lower_right_corner_Y + 1,
-                upper_left_corner_X:lower_right_corner_X + 1,
-            ]
-
-            save_file = os.path.join("local_data", "2_patches", "pos",f"{f_name}_{j:02d}")
-            save_file += "_d" if is_difficult else ""
-            save_file += ".jpg"
-            plt.imsave(save_file, img_cut)
-
-    print()
-    print(f"Nombre de patchs positifs conservés : {nb_pos_patches}")
-
-    neg_f_names = list(img_neg_train.keys())
+            patch_name = f"{f_name}_{j:02d}"
+            patch_name += "_d" if is_difficult else ""
+            pos_cuts[f_name].append((patch_name, (upper_left_corner_Y, upper_left_corner_X, height, width)))
+    return pos_cuts
+
+
+def iter_neg_cuts(neg_f_names, bbox_train, nb_neg_target):
+    """
+    Découpe de patchs négatifs (uniquement sur les images complètement négatives), avec les bbox des positifs tirées au hasard.
+    Le générateur aléatoire doit avoir été initialisé (random.seed(0)) par l'appelant.
+    En mode STREAMING, tous les tirages sont faits d'abord (les découpes vides sont écartées d'après la taille des images,
+    lue dans leur en-tête), puis chaque image tirée est décodée une seule fois, découpée et libérée : mêmes tirages et
+    mêmes patchs, rendus dans le même ordre.
+    :return: Générateur de (nom du patch, nom de l'image, bbox, patch).
+    """
+    if not STREAMING:
+        img_neg_train = {} # images négatives lues à la demande, une seule fois chacune, gardées jusqu'à la fin des tirages
+        def get_img(f_name):
+            if f_name not in img_neg_train:
+                img_neg_train[f_name] = plt.imread(os.path.join(IMAGES_FOLDER, "neg", f"{f_name}.jpg"))
+            return img_neg_train[f_name]
+
+        for patch_name, f_name, patch_bbox in draw_neg_cuts(neg_f_names, bbox_train, nb_neg_target, lambda f_name: get_img(f_name).shape):
+            yield patch_name, f_name, patch_bbox, cut(get_img(f_name), patch_bbox)
+        return
+
+    neg_shapes = {} # taille de chaque image tirée, lue dans l'en-tête du fichier
+    def get_shape(f_name):
+        if f_name not in neg_shapes:
+            neg_shapes[f_name] = read_shape(os.path.join(IMAGES_FOLDER, "neg", f"{f_name}.jpg"))
+        return neg_shapes[f_name]
+
+    planned = list(draw_neg_cuts(neg_f_names, bbox_train, nb_neg_target, get_shape))
+
+    # Regroupement des découpes par image (dans l'ordre de premier tirage de chaque image)
+    cuts_by_img = {}
+    for k, (_, f_name, patch_bbox) in enumerate(planned):
+        cuts_by_img.setdefault(f_name, []).append((k, patch_bbox))
+
+    img_cuts = [None] * len(planned)
+    f_names = list(cuts_by_img)
+    imgs = iter_imread([os.path.join(IMAGES_FOLDER, "neg", f"{f}.jpg") for f in f_names], prefetch=STREAMING_PREFETCH)
+    for f_name, img in zip(f_names, imgs):
+        for k, patch_bbox in cuts_by_img[f_name]:
+            img_cuts[k] = crop(img, patch_bbox)
+
+    for (patch_name, f_name, patch_bbox), img_cut in zip(planned, img_cuts):
+        yield patch_name, f_name, patch_bbox, img_cut
+
+
+def draw_neg_cuts(neg_f_names, bbox_train, nb_neg_target, image_shape):
+    """
+    Tirages au hasard des patchs négatifs (image négative, puis bbox d'un positif), sans découper.
+    :param image_shape: Fonction nom de l'image -> (height, width, ...), pour écarter les découpes vides.
+    :return: Générateur de (nom du patch, nom de l'image, bbox).
+    """
     all_bboxs = list(bbox_train.values())
-    # Découpe de patchs négatifs (uniquement sur les images complètement négatives) et enregistrement
     nb_neg_patches = 0
-    while nb_neg_patches < nb_pos_patches * NB_NEG_FACTOR:
+    while nb_neg_patches < nb_neg_target:
 
         f_name = random.choice(neg_f_names)
-        img = img_neg_train[f_name]
+        img_shape = image_shape(f_name)
         random_bbox = random.choice(random.choice(all_bboxs))
 
         upper_left_corner_Y = int(random_bbox[0])
@@ -144,38 +365,115 @@ def splitter():
         if is_difficult and not KEEP_DIFFICULT:
             continue
 
+        patch_bbox = (upper_left_corner_Y, upper_left_corner_X, height, width)
+        if 0 in cut_shape(img_shape, patch_bbox):
+            continue # cas où l'image découpée ne continent rien (sûrement à cause d'un bbox sur un bord)
+
+        yield f"{f_name}_{nb_neg_patches:05d}", f_name, patch_bbox
+        nb_neg_patches +=1
+
 
-        lower_right_corner_Y = upper_left_corner_Y + height
-        lower_right_corner_X = upper_left_corner_X + width
+def plan_neg_quotas(neg_f_names, nb_neg_target):
+    """
+    Répartition des patchs négatifs entre les images négatives : nb_neg_target // nb images chacune, une de plus pour
+    les premières par ordre de nom (le quota d'une image ne bouge que d'un patch quand une image est ajoutée).
+    :return: Dictionnaire nom de l'image -> nombre de patchs à tirer, par ordre de nom (images sans patch écartées).
+    """
+    neg_f_names = sorted(neg_f_names)
+    if not neg_f_names:
+        return {}
+    base, extra = divmod(nb_neg_target, len(neg_f_names))
+    quotas = {f_name: base + (1 if k < extra else 0) for k, f_name in enumerate(neg_f_names)}
+    return {f_name: quota for f_name, quota in quotas.items() if quota > 0}
+
+
+def neg_patch_names(f_name, quota):
+    """
+    Noms des patchs négatifs d'une image, dans l'ordre de ses tirages.
+    """
+    return [f"{f_name}_{k:05d}" for k in range(quota)]
+
+
+def iter_image_neg_cuts(neg_quotas, bbox_train):
+    """
+    Découpe de patchs négatifs image par image (SEED_PER_NEG_IMAGE), avec les bbox des positifs tirées au hasard.
+    Chaque image est décodée une seule fois (en parallèle, voir iter_imread), découpée puis libérée en mode STREAMING.
+    :param neg_quotas: Dictionnaire nom de l'image -> nombre de patchs (voir plan_neg_quotas).
+    :return: Générateur de (nom de l'image, liste de (nom du patch, bbox, patch)), dans l'ordre de neg_quotas.
+    """
+    all_bboxs = [bbox_train[f_name] for f_name in sorted(bbox_train)] # ordre indépendant de os.listdir
+    f_names = list(neg_quotas)
+    paths = [os.path.join(IMAGES_FOLDER, "neg", f"{f}.jpg") for f in f_names]
+    imgs = iter_imread(paths, prefetch=STREAMING_PREFETCH) if STREAMING else iter(imread_many(paths))
+    for f_name, img in zip(f_names, imgs):
+        cuts = draw_image_neg_cuts(f_name, neg_quotas[f_name], all_bboxs, img.shape)
+        yield f_name, [(patch_name, patch_bbox, crop(img, patch_bbox)) for patch_name, patch_bbox in cuts]
+
+
+def draw_image_neg_cuts(f_name, quota, all_bboxs, img_shape):
+    """
+    Tirages au hasard des patchs négatifs d'une image (bbox d'un positif), sans découper.
+    Le générateur aléatoire est initialisé par le nom de l'image : mêmes tirages à entrées égales, quelles que soient
+    les autres images négatives.
+    :param all_bboxs: Listes des bbox de chaque image positive.
+    :param img_shape: (height, width, ...) de l'image, pour écarter les découpes vides.
+    :return: Liste de (nom du patch, bbox), au plus quota.
+    """
+    rng = random.Random(f_name)
+    patch_names = neg_patch_names(f_name, quota)
+    cuts = []
+    nb_tries = 0
+    while len(cuts) < quota:
+        if nb_tries == MAX_NEG_TRIES:
+            print(f"neg/{f_name}.jpg : aucune découpe valide en {MAX_NEG_TRIES} tirages, {len(cuts)}/{quota} patchs gardés")
+            break
+        nb_tries += 1
+
+        random_bbox = rng.choice(rng.choice(all_bboxs))
 
-        img_cut = img[
-            upper_left_corner_Y:lower_right_corner_Y + 1,
-            upper_left_corner_X:lower_right_corner_X + 1,
-        ]
+        upper_left_corner_Y = int(random_bbox[0])
+        upper_left_corner_X = int(random_bbox[1])
+        height = int(random_bbox[2])
+        width = int(random_bbox[3])
+        is_difficult = bool(random_bbox[4])
 
-        save_file = os.path.join("local_data", "2_patches", "neg",f"{f_name}_{nb_neg_patches:05d}.jpg")
-        try:
-            plt.imsave(save_file, img_cut)
-        except ValueError:
+        # Mêmes filtres sur les patchs positifs (pour garder la cohérence des tailles des patchs entre pos et neg)
+        if height*width < MIN_PATCH_AREA:
+            continue
+        if is_difficult and not KEEP_DIFFICULT:
+            continue
+
+        patch_bbox = (upper_left_corner_Y, upper_left_corner_X, height, width)
+        if 0 in cut_shape(img_shape, patch_bbox):
             continue # cas où l'image découpée ne continent rien (sûrement à cause d'un bbox sur un bord)
-        nb_neg_patches +=1
 
-    print()
-    print(f"Nombre de patchs négatifs conservés : {nb_neg_patches}")
+        cuts.append((patch_names[len(cuts)], patch_bbox))
+        nb_tries = 0
+    return cuts
+
+
+def cut(img, bbox):
+    upper_left_corner_Y, upper_left_corner_X, height, width = bbox
+    lower_right_corner_Y = upper_left_corner_Y + height
+    lower_right_corner_X = upper_left_corner_X + width
+
+    return img[
+        upper_left_corner_Y:lower_right_corner_Y + 1,
+        upper_left_corner_X:lower_right_corner_X + 1,
+    ]
 
+def cut_shape(img_shape, bbox):
+    # Forme de cut(img, bbox) pour une image de forme img_shape, sans l'image (mêmes règles que le découpage numpy)
+    upper_left_corner_Y, upper_left_corner_X, height, width = bbox
+    rows = range(img_shape[0])[upper_left_corner_Y:upper_left_corner_Y + height + 1]
+    cols = range(img_shape[1])[upper_left_corner_X:upper_left_corner_X + width + 1]
+    return (len(rows), len(cols)) + tuple(img_shape[2:])
 
-# Généré avec chatGPT
-def clear_folder(folder_path):
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)  # supprime le fichier ou le lien
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)  # supprime le dossier récursivement
-        except Exception as e:
-            print(f"Erreur lors de la suppression de {file_path} : {e}")
+def crop(img, bbox):
+    # En mode STREAMING, le patch est copié pour ne pas garder toute l'image en mémoire (une vue la référence)
+    img_cut = cut(img, bbox)
+    return img_cut.copy() if STREAMING else img_cut
 
 
 if __name__ == "__main__":
-    splitter()
\ No newline at end of file
+    splitter()
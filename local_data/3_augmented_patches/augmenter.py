@@ -1,22 +1,22 @@
 import os
-import numpy as np
-import matplotlib.pyplot as plt
-import random
-from functools import partial
-import shutil
-
-
+import sys
 
 import albumentations as A
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from local_data.build_manifest import BuildManifest, load_previous, params_digest, save_stage, update_patchs
+from local_data.packed_dataset import packed_path, read_packed
+
 TEST = False # booléen. Si True, il n'y a qu'un patch qui est traité, pour voir le résultat de la génération de l'augmentation. Si False, tous les patchs sont traités
+EXPORT_JPG = True # booléen. Si True, les patchs sont aussi enregistrés un par un en .jpg (en plus du format groupé local_data/3_augmented_patches/patches)
 
-def augmenter(patchs_base: dict):
+STAGE_FOLDER = os.path.join("local_data", "3_augmented_patches")
 
-    # Note : Finalement, pas besoin de faire des rotations à 90°, les patchs seront réorientés avant normalisation
+# Note : Finalement, pas besoin de faire des rotations à 90°, les patchs seront réorientés avant normalisation
 
-    # Ce qui a été retenu comme augmentations utiles (il faut aussi réfléchir à l'explosion du nombre de données qui deviennent longues à traiter)
-    transforms = {
+# Ce qui a été retenu comme augmentations utiles (il faut aussi réfléchir à l'explosion du nombre de données qui deviennent longues à traiter)
+# Ce sont des retournements : local_data/augmented_dataset.py (FLIP_AXES) les applique à la lecture sans les matérialiser
+TRANSFORMS = {
     "original": A.Compose([]),  # identité
     "horizontal": A.Compose([A.HorizontalFlip(p=1.0)]),
     "vertical": A.Compose([A.VerticalFlip(p=1.0)]),
@@ -25,87 +25,63 @@ def augmenter(patchs_base: dict):
         A.VerticalFlip(p=1.0)
     ]),
 }
-    
+
+def augmenter(patchs_base: dict):
+
     augmented_patchs = {}
 
     for patch_name, patch in patchs_base.items():
-        for transform_name, transform in transforms.items():
+        for transform_name, transform in TRANSFORMS.items():
             augmented_patchs[f"{patch_name}_{transform_name}"] = transform(image=patch)["image"]
 
     return augmented_patchs
 
 
+# Version générateur d'augmenter, pour la chaîne en mémoire (local_data/pipeline.py)
+def iter_augmenter(patches):
+    # patches : itérable de (nom, label, patch, meta)
+    for patch_name, label, patch, meta in patches:
+        for transform_name, transform in TRANSFORMS.items():
+            yield f"{patch_name}_{transform_name}", label, transform(image=patch)["image"], meta
+
+
+def augmented_names(patch_name):
+    return [f"{patch_name}_{transform_name}" for transform_name in TRANSFORMS]
+
+
+def augment_meta(meta_base: dict):
+    # Chaque patch augmenté garde l'image source et la bbox de son patch d'origine
+    return {
+        augmented_name: patch_meta
+        for patch_name, patch_meta in meta_base.items()
+        for augmented_name in augmented_names(patch_name)
+    }
+
+
 ##############################################################################################
 ########################### Utilitaires ######################################################
 ##############################################################################################
 
-# Généré avec chatGPT
-def clear_folder(folder_path):
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)  # supprime le fichier ou le lien
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)  # supprime le dossier récursivement
-        except Exception as e:
-            print(f"Erreur lors de la suppression de {file_path} : {e}")
-
 def load():
 
-    # Chargement des patchs positifs
-    pos_patch_fs = [f for f in  os.listdir(os.path.join("local_data", "2_patches", "pos")) if f.endswith(".jpg")]
-    pos_patchs_base = {}
-    for f in pos_patch_fs:
-        try:
-            patch = plt.imread(
-                os.path.join("local_data", "2_patches", "pos", f)
-            )
-            pos_patchs_base[os.path.splitext(f)[0]] = patch
-
-        except FileNotFoundError:
-            continue
-
-        if TEST: # seulement 1 patch est gardé pour tester le traitement
-            break
-        
+    # Chargement des patchs découpés (format groupé de l'étape 2, une seule lecture)
+    dataset = read_packed(packed_path(os.path.join("local_data", "2_patches")))
+    pos_patchs_base, neg_patchs_base, meta_base = dataset.to_dicts()
 
-    # Chargement des patchs négatifs
-    neg_patch_fs = [f for f in  os.listdir(os.path.join("local_data", "2_patches", "neg")) if f.endswith(".jpg")]
-    neg_patchs_base = {}
-    for f in neg_patch_fs:
-        try:
-            patch = plt.imread(
-                os.path.join("local_data", "2_patches", "neg", f)
-            )
-            neg_patchs_base[os.path.splitext(f)[0]] = patch
-
-        except FileNotFoundError:
-            continue
-
-        if TEST: # seulement 1 patch est gardé pour tester le traitement
-            break
+    if TEST: # seulement 1 patch est gardé pour tester le traitement
+        pos_patchs_base = dict(list(pos_patchs_base.items())[:1])
+        neg_patchs_base = dict(list(neg_patchs_base.items())[:1])
         
     print(f"len pos_patchs_base : {len(pos_patchs_base)}")
     print(f"len neg_patchs_base : {len(neg_patchs_base)}") 
     print()   
 
-    return pos_patchs_base, neg_patchs_base
-
-
-def save(pos_patchs: dict, neg_patchs: dict):
+    return pos_patchs_base, neg_patchs_base, meta_base
 
-    # Clear des dossiers avant mise à jour
-    clear_folder(os.path.join("local_data", "3_augmented_patches", "pos"))
-    clear_folder(os.path.join("local_data", "3_augmented_patches", "neg"))
 
-    for patch_name, patch in pos_patchs.items():
-        save_file = os.path.join("local_data", "3_augmented_patches", "pos", f"{patch_name}.jpg")
-        plt.imsave(save_file, patch)
+def save(pos_patchs: dict, neg_patchs: dict, meta: dict, manifest: BuildManifest, regenerated: set):
 
-    for patch_name, patch in neg_patchs.items():
-        save_file = os.path.join("local_data", "3_augmented_patches", "neg", f"{patch_name}.jpg")
-        plt.imsave(save_file, patch)
+    save_stage(STAGE_FOLDER, pos_patchs, neg_patchs, meta, manifest, regenerated, EXPORT_JPG)
 
     print(f"len pos_patchs : {len(pos_patchs)}")
     print(f"len neg_patchs : {len(neg_patchs)}")
@@ -113,10 +89,20 @@ def save(pos_patchs: dict, neg_patchs: dict):
 
 
 if __name__ == "__main__":
-    pos_patchs_base, neg_patchs_base = load()
-    pos_patchs = augmenter(pos_patchs_base)
-    neg_patchs = augmenter(neg_patchs_base)
-    save(pos_patchs, neg_patchs)
+    pos_patchs_base, neg_patchs_base, meta_base = load()
+
+    # Reconstruction incrémentale (voir local_data/build_manifest.py) : seuls les patchs découpés qui ont changé sont augmentés
+    manifest = BuildManifest(STAGE_FOLDER)
+    input_manifest = BuildManifest(os.path.join("local_data", "2_patches"))
+    previous_patchs, _ = load_previous(STAGE_FOLDER)
+    params = params_digest({"TRANSFORMS": list(TRANSFORMS)})
+    pos_patchs, pos_regenerated = update_patchs(
+        manifest, previous_patchs, pos_patchs_base, input_manifest, params, augmenter, augmented_names
+    )
+    neg_patchs, neg_regenerated = update_patchs(
+        manifest, previous_patchs, neg_patchs_base, input_manifest, params, augmenter, augmented_names
+    )
+    save(pos_patchs, neg_patchs, augment_meta(meta_base), manifest, pos_regenerated | neg_regenerated)
 
 
 
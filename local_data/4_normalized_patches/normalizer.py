@@ -1,23 +1,52 @@
 import numpy as np
 import os
-import shutil
-import matplotlib.pyplot as plt
-from skimage.transform import resize
-from skimage.color import rgb2gray
+import sys
+from functools import lru_cache
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from local_data.build_manifest import BuildManifest, load_previous, params_digest, save_stage, update_patchs
+from local_data.packed_dataset import packed_path, read_packed
+
+# scipy et skimage ne sont importés qu'à la première normalisation : la détection importe ce module pour lire
+# target_shape.txt sans payer leur import
 
 TARGET_SCALE = 128 # Paramètre d'échelle des patchs normalisés arbitraire
+EXPORT_JPG = True # booléen. Si True, les patchs sont aussi enregistrés un par un en .jpg (en plus du format groupé local_data/4_normalized_patches/patches)
+
+STAGE_FOLDER = os.path.join("local_data", "4_normalized_patches")
+STATS_FOLDER = os.path.dirname(os.path.abspath(__file__)) # target_shape.txt et stats.txt (lus et écrits), quel que soit le dossier courant
 
 def normalizer(patchs_base: dict):
     target_shape = get_target_shape()
     patchs_normalized = {}
     for patch_name, patch in patchs_base.items():
-        patchs_normalized[patch_name] = normalize_patch(target_shape, patch)
+        patchs_normalized[patch_name] = stretch_patches(normalize_patch(target_shape, patch))
     return patchs_normalized
 
+# Version générateur de normalizer, pour la chaîne en mémoire (local_data/pipeline.py)
+def iter_normalizer(patches, target_shape):
+    """
+    patches: itérable de (nom, label, patch, meta)
+    Les patchs consécutifs de même forme (les augmentations d'un même patch découpé) sont normalisés en un seul lot.
+    """
+    run = []
+    for item in patches:
+        if run and item[2].shape != run[0][2].shape:
+            yield from _normalize_run(run, target_shape)
+            run = []
+        run.append(item)
+    if run:
+        yield from _normalize_run(run, target_shape)
+
+def _normalize_run(run, target_shape):
+    normalized = stretch_patches(normalize_patches(target_shape, np.stack([patch for _, _, patch, _ in run])))
+    for (name, label, _, meta), patch in zip(run, normalized):
+        yield name, label, patch, meta
+
 
 def get_target_shape():
     shape_tuple = (TARGET_SCALE, TARGET_SCALE) # valeur par défaut
-    with open(os.path.join("local_data", "4_normalized_patches", "target_shape.txt"), "r", encoding="utf-8") as f:
+    with open(os.path.join(STATS_FOLDER, "target_shape.txt"), "r", encoding="utf-8") as f:
         line = f.readline().strip()
         # Extraire le contenu entre les parenthèses
         if line.startswith("target_shape="):
@@ -25,11 +54,30 @@ def get_target_shape():
             shape_tuple = eval(shape_str)
     return shape_tuple
 
+def get_stats():
+    """
+    Statistiques des bbox positives écrites par compute_target_shape (stats.txt), limites des fenêtres de détection.
+    :return: Dictionnaire avec min_ratio, max_ratio, moy_ratio, min_scale et max_scale.
+    """
+    stats = {}
+    with open(os.path.join(STATS_FOLDER, "stats.txt"), "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            value = float(value)
+            stats[key] = int(value) if value.is_integer() else value
+    return stats
+
 # Fonction qui peut être aussi appelée par l'algorithme de détection itératif (après avoir découpé une fenêtre)
 def normalize_patch(target_shape, patch):
     """
     patch: nd.array (height, width, 3) (3 car RGB)
     """
+    from skimage.color import rgb2gray
+    from skimage.transform import resize
+
     if patch.ndim == 3:
         patch = rgb2gray(patch)
     height = patch.shape[0]
@@ -39,6 +87,82 @@ def normalize_patch(target_shape, patch):
 
     return resize(patch, target_shape, anti_aliasing=True)
 
+# Version par lot de normalize_patch, pour tous les patchs de même forme (par exemple toutes les fenêtres d'une itération de détection)
+def normalize_patches(target_shape, stack):
+    """
+    stack: nd.array (n, height, width) (niveaux de gris) ou (n, height, width, 3) (RGB)
+    Le calcul se fait en float32 si stack est en float32, en float64 sinon.
+    Même résultat que normalize_patch sur chaque patch (à la précision flottante près) :
+    le redimensionnement de skimage (filtre gaussien d'anti-aliasing puis interpolation bilinéaire) est linéaire et séparable,
+    il s'écrit donc rows @ patch @ cols.T avec deux petites matrices calculées une seule fois par forme d'entrée.
+    """
+    from skimage.color import rgb2gray
+    from skimage.util import img_as_float
+
+    stack = np.asarray(stack)
+    if stack.ndim == 4:
+        stack = rgb2gray(stack) # une seule conversion pour tout le lot
+    stack = img_as_float(stack)
+    height = stack.shape[1]
+    width = stack.shape[2]
+    if width > height:
+        stack = np.rot90(stack, k=1, axes=(1, 2)) # vue, même rotation que rotate_90
+        height, width = width, height
+
+    # Matrices dans le type du lot (float32 ou float64) pour ne pas promouvoir le calcul
+    rows = get_resize_matrix(height, target_shape[0], stack.dtype.str)
+    cols = get_resize_matrix(width, target_shape[1], stack.dtype.str)
+    # Ordre des produits choisi pour minimiser le nombre d'opérations
+    if target_shape[0] * width <= height * target_shape[1]:
+        return np.matmul(np.matmul(rows, stack), cols.T)
+    return np.matmul(rows, np.matmul(stack, cols.T))
+
+@lru_cache(maxsize=1024) # ~500 tailles distinctes pour les patchs découpés du jeu d'entraînement
+def get_resize_matrix(input_size, output_size, dtype="<f8"):
+    """
+    Matrice (output_size, input_size) de l'opération 1D de resize(..., anti_aliasing=True) de skimage sur un axe :
+    filtre gaussien (sigma = (facteur - 1) / 2, bords en miroir) puis zoom bilinéaire (grid_mode).
+    Obtenue en appliquant ces opérations de scipy.ndimage, comme le fait skimage, aux vecteurs de la base canonique.
+    """
+    from scipy import ndimage as ndi
+
+    factor = input_size / output_size
+    sigma = max(0, (factor - 1) / 2)
+    matrix = np.eye(input_size)
+    if sigma > 0:
+        matrix = ndi.gaussian_filter1d(matrix, sigma, axis=0, mode="mirror")
+    matrix = ndi.zoom(matrix, (output_size / input_size, 1), order=1, mode="mirror", grid_mode=True)
+    matrix = matrix.astype(dtype)
+    matrix.flags.writeable = False # partagée par le cache
+    return matrix
+
+# Valeurs enregistrées pour l'entraînement (étape 4, local_data/pipeline.py et local_data/hard_negatives.py)
+def stretch_patches(stack):
+    """
+    stack: nd.array (height, width) ou (n, height, width) de patchs normalisés
+    Renvoie des niveaux de gris uint8 [0; 255], chaque patch étiré entre son minimum et son maximum : les pixels
+    qu'écrivait plt.imsave(..., cmap="gray") dans les .jpg de l'étape (avant la compression JPEG), et que lisaient les notebooks.
+    Un patch uniforme donne 0, comme avec plt.imsave.
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    low = stack.min(axis=(-2, -1), keepdims=True)
+    span = stack.max(axis=(-2, -1), keepdims=True) - low
+    # Même calcul que matplotlib (Normalize puis Colormap) : index floor(x * 256) dans la table des 256 gris
+    scaled = (stack - low) / np.where(span > 0, span, 1) * 256
+    return get_gray_bytes()[np.minimum(scaled, 255).astype(np.intp)]
+
+@lru_cache(maxsize=None)
+def get_gray_bytes():
+    """
+    Table (256,) uint8 de la colormap "gray" de matplotlib : ce n'est pas exactement np.arange(256), quelques niveaux
+    sont arrondis à la valeur inférieure.
+    """
+    import matplotlib
+
+    table = matplotlib.colormaps["gray"](np.arange(256), bytes=True)[:, 0]
+    table.flags.writeable = False # partagée par le cache
+    return table
+
 ##############################################################################################
 ########################### Utilitaires ######################################################
 ##############################################################################################
@@ -46,33 +170,22 @@ def normalize_patch(target_shape, patch):
 def rotate_90(image):
     return np.ascontiguousarray(np.rot90(image, k=1))
 
-# Généré avec chatGPT
-def clear_folder(folder_path):
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)  # supprime le fichier ou le lien
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)  # supprime le dossier récursivement
-        except Exception as e:
-            print(f"Erreur lors de la suppression de {file_path} : {e}")
-
 def load():
 
-    # Chargement des patchs positifs augmentés
-    pos_patch_fs = [f for f in  os.listdir(os.path.join("local_data", "3_augmented_patches", "pos")) if f.endswith(".jpg")]
-    pos_patchs_base = {}
-    for f in pos_patch_fs:
-        try:
-            patch = plt.imread(
-                os.path.join("local_data", "3_augmented_patches", "pos", f)
-            )
-            pos_patchs_base[os.path.splitext(f)[0]] = patch
+    # Chargement des patchs augmentés (format groupé de l'étape 3, une seule lecture)
+    dataset = read_packed(packed_path(os.path.join("local_data", "3_augmented_patches")))
+    pos_patchs_base, neg_patchs_base, meta_base = dataset.to_dicts()
+
+    compute_target_shape(pos_patchs_base)
+        
+    print(f"len pos_patchs_base : {len(pos_patchs_base)}")
+    print(f"len neg_patchs_base : {len(neg_patchs_base)}") 
+    print()   
+
+    return pos_patchs_base, neg_patchs_base, meta_base
 
-        except FileNotFoundError:
-            continue
 
+def compute_target_shape(pos_patchs_base: dict):
 
     # Calculs statistiques pour calculer la target_shape -> dans stats.txt et target_shape.txt
     # Uniquement avec les patchs positifs
@@ -99,7 +212,7 @@ def load():
     ratios = np.array(ratios)
     moy_ratio = np.mean(ratios)
 
-    with open(os.path.join("local_data", "4_normalized_patches", "stats.txt"), "w", encoding="utf-8") as f:
+    with open(os.path.join(STATS_FOLDER, "stats.txt"), "w", encoding="utf-8") as f:
         f.write(f"min_ratio={np.min(ratios)}\n")
         f.write(f"max_ratio={np.max(ratios)}\n")
         f.write(f"moy_ratio={moy_ratio}\n")
@@ -118,46 +231,18 @@ def load():
     target_width = target_width - target_width%8 # on force la largeur à être aussi un multiple de 8
 
     target_shape = (int(TARGET_SCALE), int(target_width)) # height, width
-    with open(os.path.join("local_data", "4_normalized_patches", "target_shape.txt"), "w", encoding="utf-8") as f:
+    with open(os.path.join(STATS_FOLDER, "target_shape.txt"), "w", encoding="utf-8") as f:
         f.write(f"target_shape={target_shape}")
 
     print(f"target_shape={target_shape}\n")
 
-        
-
-    # Chargement des patchs négatifs
-    neg_patch_fs = [f for f in  os.listdir(os.path.join("local_data", "3_augmented_patches", "neg")) if f.endswith(".jpg")]
-    neg_patchs_base = {}
-    for f in neg_patch_fs:
-        try:
-            patch = plt.imread(
-                os.path.join("local_data", "3_augmented_patches", "neg", f)
-            )
-            neg_patchs_base[os.path.splitext(f)[0]] = patch
-
-        except FileNotFoundError:
-            continue
-        
-    print(f"len pos_patchs_base : {len(pos_patchs_base)}")
-    print(f"len neg_patchs_base : {len(neg_patchs_base)}") 
-    print()   
-
-    return pos_patchs_base, neg_patchs_base
-
-
-def save(pos_patchs: dict, neg_patchs: dict):
+    return target_shape
 
-    # Clear des dossiers avant mise à jour
-    clear_folder(os.path.join("local_data", "4_normalized_patches", "pos"))
-    clear_folder(os.path.join("local_data", "4_normalized_patches", "neg"))
 
-    for patch_name, patch in pos_patchs.items():
-        save_file = os.path.join("local_data", "4_normalized_patches", "pos", f"{patch_name}.jpg")
-        plt.imsave(save_file, patch, cmap="gray")
+def save(pos_patchs: dict, neg_patchs: dict, meta: dict, manifest: BuildManifest, regenerated: set):
 
-    for patch_name, patch in neg_patchs.items():
-        save_file = os.path.join("local_data", "4_normalized_patches", "neg", f"{patch_name}.jpg")
-        plt.imsave(save_file, patch, cmap="gray")
+    # Un seul array (N, height, width) en niveaux de gris uint8 étirés (stretch_patches) : ni canaux RGB dupliqués, ni perte JPEG
+    save_stage(STAGE_FOLDER, pos_patchs, neg_patchs, meta, manifest, regenerated, EXPORT_JPG, np.uint8, cmap="gray")
 
     print(f"len pos_patchs : {len(pos_patchs)}")
     print(f"len neg_patchs : {len(neg_patchs)}")
@@ -165,7 +250,18 @@ def save(pos_patchs: dict, neg_patchs: dict):
 
 
 if __name__ == "__main__":
-    pos_patchs_base, neg_patchs_base = load()
-    pos_patchs = normalizer(pos_patchs_base)
-    neg_patchs = normalizer(neg_patchs_base)
-    save(pos_patchs, neg_patchs)
\ No newline at end of file
+    pos_patchs_base, neg_patchs_base, meta_base = load()
+
+    # Reconstruction incrémentale (voir local_data/build_manifest.py) : seuls les patchs augmentés qui ont changé sont normalisés,
+    # tous si target_shape change
+    manifest = BuildManifest(STAGE_FOLDER)
+    input_manifest = BuildManifest(os.path.join("local_data", "3_augmented_patches"))
+    previous_patchs, _ = load_previous(STAGE_FOLDER)
+    params = params_digest({"target_shape": get_target_shape(), "dtype": "uint8"})
+    pos_patchs, pos_regenerated = update_patchs(
+        manifest, previous_patchs, pos_patchs_base, input_manifest, params, normalizer, lambda name: [name]
+    )
+    neg_patchs, neg_regenerated = update_patchs(
+        manifest, previous_patchs, neg_patchs_base, input_manifest, params, normalizer, lambda name: [name]
+    )
+    save(pos_patchs, neg_patchs, meta_base, manifest, pos_regenerated | neg_regenerated)
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Jeu augmenté "virtuel" : les augmentations de augmenter.TRANSFORMS sont des retournements, elles ne sont donc pas
+enregistrées mais appliquées à la lecture (vues numpy, sans copie).
+
+Seuls les patchs de base sont stockés (4 fois moins de place sur disque et en mémoire) ; l'indice i du jeu augmenté
+désigne l'augmentation i % n_transforms du patch de base i // n_transforms, dans le même ordre et avec les mêmes noms
+que les patchs matérialisés par l'augmenteur ("<patch>_original", "<patch>_horizontal"...).
+Retourner puis normaliser un patch donne exactement le patch normalisé retourné (normalize_patches est linéaire et
+symétrique), aux axes près si le patch a été tourné de 90° par la normalisation.
+
+Chargement du jeu d'entraînement normalisé (augmenté virtuellement ou non : read_augmented rend un AugmentedDataset
+ou un PackedDataset, qui ont tous deux la méthode features), avec les features HOG en cache disque
+(utils/feature_store.py) :
+
+    dataset = read_augmented(os.path.join("local_data", "4_normalized_patches", "patches"))
+    X = dataset.features(np.arange(len(dataset)), HOG_extractor, hog_params={}, store=FeatureStore("HOG", {}))
+    y = dataset.labels
+"""
+
+import numpy as np
+
+from local_data.packed_dataset import POS_LABEL, extract_features, read_packed
+from utils.hog_pyramid import hog_flip_permutation
+
+# Axes du patch découpé retournés par chaque augmentation de augmenter.TRANSFORMS (mêmes noms, même ordre)
+FLIP_AXES = {
+    "original": (),
+    "horizontal": (1,),
+    "vertical": (0,),
+    "horizontal_vertical": (0, 1),
+}
+
+
+def augmentations_index(rotated, transforms=None):
+    """
+    Description des augmentations virtuelles d'un jeu de patchs de base, à passer à write_packed.
+    :param rotated: Pour chaque patch de base, True s'il a été tourné de 90° après la découpe (voir normalize_patch).
+    :param transforms: Noms des augmentations, parmi FLIP_AXES (par défaut toutes).
+    """
+    return {
+        "transforms": list(FLIP_AXES if transforms is None else transforms),
+        "rotated": [bool(r) for r in rotated],
+    }
+
+
+class AugmentedDataset:
+    """
+    Jeu augmenté virtuel sur un PackedDataset de patchs de base (voir la docstring du module).
+    Mêmes attributs et méthodes que PackedDataset, les patchs retournés étant des vues sur le memmap.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.transforms = base.augmentations["transforms"]
+        self.rotated = np.array(base.augmentations["rotated"], dtype=bool)
+        n_transforms = len(self.transforms)
+        self.names = [f"{name}_{transform}" for name in base.names for transform in self.transforms]
+        self.labels = np.repeat(base.labels, n_transforms)
+        self.sources = [source for source in base.sources for _ in range(n_transforms)]
+        self.bboxes = np.repeat(base.bboxes, n_transforms, axis=0)
+
+    def __len__(self):
+        return len(self.base) * len(self.transforms)
+
+    def __getitem__(self, i):
+        """
+        Patch augmenté i, vue retournée sur le patch de base (sans copie).
+        """
+        return np.flip(self.base[i // len(self.transforms)], self.flip_axes(i))
+
+    def flip_axes(self, i):
+        """
+        Axes du patch de base stocké à retourner pour obtenir le patch augmenté i.
+        """
+        base_index, transform_index = divmod(i, len(self.transforms))
+        axes = FLIP_AXES[self.transforms[transform_index]]
+        if self.rotated[base_index]:
+            # Après rot90, l'axe 0 du patch découpé est l'axe 1 du patch stocké et inversement
+            axes = tuple(sorted(1 - axis for axis in axes))
+        return axes
+
+    def is_stacked(self):
+        return self.base.is_stacked()
+
+    def meta(self, i):
+        return self.base.meta(i // len(self.transforms))
+
+    def to_dicts(self):
+        """
+        Voir PackedDataset.to_dicts (les patchs sont des vues).
+        """
+        pos_patchs = {}
+        neg_patchs = {}
+        meta = {}
+        for i, name in enumerate(self.names):
+            if self.labels[i] == POS_LABEL:
+                pos_patchs[name] = self[i]
+            else:
+                neg_patchs[name] = self[i]
+            meta[name] = self.meta(i)
+        return pos_patchs, neg_patchs, meta
+
+    def batch(self, indices):
+        """
+        Patchs augmentés indices, copiés dans un array (n, height, width).
+        """
+        return np.stack([self[i] for i in indices])
+
+    def features(self, indices, extractor, hog_params=None, approximate=False, store=None):
+        """
+        Features des patchs augmentés indices.
+        :param extractor: Fonction (array de patchs) -> array (n_patchs, n_features), comme HOG_extractor.
+        :param hog_params: Si extractor est un HOG (skimage.feature.hog avec ces paramètres, {} pour les valeurs par
+        défaut), les features des patchs retournés sont déduites de celles des patchs de base par permutation
+        (voir hog_flip_permutation) : extractor n'est appelé qu'une fois par patch de base. Si None, extractor est
+        appelé sur chaque patch augmenté.
+        :param approximate: Si True, la permutation est aussi utilisée pour les retournements d'un seul axe, où elle
+        n'est qu'approchée ; sinon leurs features sont calculées sur les patchs retournés.
+        :param store: FeatureStore de extractor (voir extract_features) : les features des patchs de base (et des
+        patchs retournés calculés) sont lues dans le cache, seuls les patchs absents sont passés à extractor.
+        :return: Array (len(indices), n_features).
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return np.empty((0, 0))
+        n_transforms = len(self.transforms)
+        axes = [self.flip_axes(i) for i in indices]
+
+        remapped = [
+            k for k, flip in enumerate(axes)
+            if flip == () or (hog_params is not None and (len(flip) == 2 or approximate))
+        ]
+        remapped_set = set(remapped)
+        computed = [k for k in range(len(indices)) if k not in remapped_set]
+
+        results = []
+        if remapped:
+            base_indices = np.unique(indices[remapped] // n_transforms)
+            base_patches = [self.base[b] for b in base_indices]
+            if store is None:
+                base_patches = np.stack(base_patches)
+            base_features = extract_features(base_patches, extractor, store)
+            base_rows = {b: row for row, b in enumerate(base_indices)}
+            permutations = {}
+            rows = np.empty((len(remapped), base_features.shape[1]), dtype=base_features.dtype)
+            for row, k in enumerate(remapped):
+                features = base_features[base_rows[indices[k] // n_transforms]]
+                if axes[k]:
+                    if axes[k] not in permutations:
+                        permutations[axes[k]] = hog_flip_permutation(self.base[0].shape, axes[k], hog_params)
+                    features = features[permutations[axes[k]]]
+                rows[row] = features
+            results.append((remapped, rows))
+        if computed:
+            computed_patches = self.batch(indices[computed])
+            results.append((computed, extract_features(computed_patches, extractor, store)))
+
+        n_features = results[0][1].shape[1]
+        out = np.empty((len(indices), n_features), dtype=results[0][1].dtype)
+        for positions, rows in results:
+            out[positions] = rows
+        return out
+
+
+def read_augmented(path):
+    """
+    Comme read_packed, mais un jeu augmenté virtuellement est lu comme un AugmentedDataset.
+    :param path: Chemin sans extension (voir packed_path).
+    :return: AugmentedDataset ou PackedDataset (patchs déjà augmentés).
+    """
+    dataset = read_packed(path)
+    if dataset.augmentations is None:
+        return dataset
+    return AugmentedDataset(dataset)
@@ -0,0 +1,206 @@
+"""
+Manifeste de construction d'une étape de préparation des données, pour ne régénérer que ce qui a changé.
+
+Pour chaque patch produit, le manifeste (<étape>/manifest.json) garde :
+- inputs : les empreintes de ce dont il dépend (image source, CSV de labels, patch de l'étape précédente...),
+- params : l'empreinte des paramètres de l'étape qui le concernent,
+- digest : l'empreinte de son contenu, reprise comme entrée par l'étape suivante.
+Un patch est à jour si ses entrées et ses paramètres n'ont pas changé et s'il est encore dans le jeu groupé de
+l'étape : il est alors repris tel quel. Les patchs qui ne sont plus produits sont retirés (fichiers .jpg compris).
+Supprimer manifest.json force la reconstruction complète de l'étape.
+"""
+
+import hashlib
+import json
+import os
+
+from local_data.image_io import imsave_many
+from local_data.packed_dataset import packed_path, read_packed, write_patch_dicts
+from utils.feature_store import array_digest
+
+MANIFEST_NAME = "manifest.json"
+
+
+def params_digest(params):
+    """
+    Empreinte d'un dictionnaire de paramètres (sérialisé en JSON, repr pour le reste).
+    """
+    params_json = json.dumps(params, sort_keys=True, default=repr)
+    return hashlib.blake2b(params_json.encode(), digest_size=16).hexdigest()
+
+
+class BuildManifest:
+    """
+    Manifeste d'une étape (voir la docstring du module).
+    """
+
+    def __init__(self, stage_folder):
+        self.stage_folder = stage_folder
+        self.path = os.path.join(stage_folder, MANIFEST_NAME)
+        self.artifacts = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.artifacts = json.load(f)["artifacts"]
+
+    def is_fresh(self, name, inputs, params):
+        """
+        True si le patch name a déjà été produit à partir des mêmes entrées et paramètres.
+        """
+        artifact = self.artifacts.get(name)
+        return artifact is not None and artifact["inputs"] == inputs and artifact["params"] == params
+
+    def record(self, name, inputs, params, patch):
+        """
+        Enregistre les dépendances d'un patch (re)généré et l'empreinte de son contenu.
+        :return: True si le contenu du patch a changé (ou s'il est nouveau).
+        """
+        digest = array_digest(patch)
+        changed = self.digest(name) != digest
+        self.artifacts[name] = {"inputs": inputs, "params": params, "digest": digest}
+        return changed
+
+    def digest(self, name):
+        """
+        Empreinte du contenu du patch name (None s'il n'est pas connu).
+        """
+        artifact = self.artifacts.get(name)
+        return None if artifact is None else artifact["digest"]
+
+    def remove_orphans(self, names, jpg_folders=()):
+        """
+        Oublie les patchs qui ne sont pas dans names et supprime les .jpg de jpg_folders qui ne sont pas dans names
+        (y compris ceux produits avant le manifeste).
+        :return: Nombre de patchs retirés du manifeste.
+        """
+        names = set(names)
+        orphans = [name for name in self.artifacts if name not in names]
+        for name in orphans:
+            del self.artifacts[name]
+        for folder in jpg_folders:
+            for f in os.listdir(folder):
+                if f.endswith(".jpg") and os.path.splitext(f)[0] not in names:
+                    os.remove(os.path.join(folder, f))
+        return len(orphans)
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"artifacts": self.artifacts}, f)
+
+
+def load_previous(stage_folder):
+    """
+    Patchs du dernier jeu groupé de l'étape, pour reprendre ceux qui sont à jour.
+    :return: Dictionnaires nom -> patch (vues sur le memmap, ou patchs décompressés) et nom -> (image source, bbox),
+    vides si l'étape n'a jamais été construite au format groupé.
+    """
+    path = packed_path(stage_folder)
+    if not (os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")):
+        return {}, {}
+    dataset = read_packed(path)
+    patchs = {name: dataset[i] for i, name in enumerate(dataset.names)}
+    meta = {name: dataset.meta(i) for i, name in enumerate(dataset.names)}
+    return patchs, meta
+
+
+def packed_names(stage_folder):
+    """
+    Noms des patchs du dernier jeu groupé de l'étape (None s'il n'existe pas).
+    """
+    index_path = f"{packed_path(stage_folder)}.json"
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)["names"]
+
+
+def remove_stale_jpgs(stage_folder, up_to_date=()):
+    """
+    Supprime les .jpg des dossiers pos et neg de l'étape dont le nom n'est pas dans up_to_date.
+    :param up_to_date: Noms des patchs dont le .jpg est encore celui du jeu groupé.
+    :return: Nombre de .jpg supprimés.
+    """
+    up_to_date = set(up_to_date)
+    nb_removed = 0
+    for label in ("pos", "neg"):
+        folder = os.path.join(stage_folder, label)
+        if not os.path.isdir(folder):
+            continue
+        for f in os.listdir(folder):
+            if f.endswith(".jpg") and os.path.splitext(f)[0] not in up_to_date:
+                os.remove(os.path.join(folder, f))
+                nb_removed += 1
+    return nb_removed
+
+
+def missing_jpgs(folder, names):
+    """
+    Noms parmi names dont le .jpg n'existe pas dans folder (ex : export réactivé après des constructions sans .jpg).
+    """
+    return {name for name in names if not os.path.exists(os.path.join(folder, f"{name}.jpg"))}
+
+
+
+def update_patchs(manifest, previous_patchs, patchs_base, input_manifest, params, process, output_names):
+    """
+    Applique une étape patch par patch (augmentation, normalisation) en ne recalculant que les patchs périmés.
+    :param manifest: Manifeste de l'étape.
+    :param previous_patchs: Patchs du dernier jeu de l'étape (voir load_previous).
+    :param patchs_base: Dictionnaire nom -> patch de l'étape précédente.
+    :param input_manifest: Manifeste de l'étape précédente (empreintes des patchs d'entrée).
+    :param params: Empreinte des paramètres de l'étape (voir params_digest).
+    :param process: Fonction dict -> dict de l'étape (ex : augmenter), appelée sur les seuls patchs d'entrée périmés.
+    :param output_names: Fonction nom d'entrée -> noms des patchs produits.
+    :return: Dictionnaire nom -> patch dans l'ordre de patchs_base et ensemble des noms dont le contenu a changé.
+    """
+    inputs = {}
+    stale = {}
+    for name, patch in patchs_base.items():
+        digest = input_manifest.digest(name) or array_digest(patch)
+        inputs[name] = {"patch": digest}
+        if not all(
+            manifest.is_fresh(output_name, inputs[name], params) and output_name in previous_patchs
+            for output_name in output_names(name)
+        ):
+            stale[name] = patch
+
+    processed = process(stale) if stale else {}
+    patchs = {}
+    regenerated = set()
+    for name in patchs_base:
+        for output_name in output_names(name):
+            if name in stale:
+                patchs[output_name] = processed[output_name]
+                if manifest.record(output_name, inputs[name], params, processed[output_name]):
+                    regenerated.add(output_name)
+            else:
+                patchs[output_name] = previous_patchs[output_name]
+    return patchs, regenerated
+
+
+def save_stage(stage_folder, pos_patchs, neg_patchs, meta, manifest, regenerated, export_jpg, dtype=None, **kwargs):
+    """
+    Enregistre le jeu groupé et le manifeste d'une étape, supprime les patchs qui ne sont plus produits et, si
+    export_jpg, écrit les .jpg des patchs modifiés ou manquants (kwargs passés à plt.imsave).
+    :param regenerated: Noms des patchs dont le contenu a changé.
+    """
+    names = list(pos_patchs) + list(neg_patchs)
+    # Le jeu groupé n'est réécrit que s'il a changé
+    if regenerated or names != packed_names(stage_folder):
+        write_patch_dicts(packed_path(stage_folder), pos_patchs, neg_patchs, meta, dtype)
+
+    jpg_folders = [os.path.join(stage_folder, "pos"), os.path.join(stage_folder, "neg")] if export_jpg else []
+    nb_orphans = manifest.remove_orphans(names, jpg_folders)
+    manifest.save()
+    print(f"Patchs modifiés : {len(regenerated)} | patchs supprimés : {nb_orphans}")
+    if not export_jpg:
+        # Les .jpg des patchs modifiés ou supprimés ne correspondent plus au jeu groupé : ils sont supprimés pour
+        # que les notebooks (qui lisent les .jpg) n'entraînent pas sur des patchs périmés
+        nb_stale = remove_stale_jpgs(stage_folder, set(names) - set(regenerated))
+        if nb_stale:
+            print(f".jpg périmés supprimés : {nb_stale} (EXPORT_JPG pour les réécrire)")
+
+    if export_jpg:
+        for label, patchs in (("pos", pos_patchs), ("neg", neg_patchs)):
+            folder = os.path.join(stage_folder, label)
+            names = [name for name in patchs if name in regenerated] + sorted(missing_jpgs(folder, patchs) - regenerated)
+            imsave_many([os.path.join(folder, f"{name}.jpg") for name in names], [patchs[name] for name in names], **kwargs)
@@ -0,0 +1,250 @@
+"""
+Bootstrapping des négatifs ("hard negative mining", Dalal & Triggs).
+
+Les négatifs tirés au hasard par le splitter laissent passer beaucoup de fenêtres au-dessus de confidence_threshold,
+qui vont ensuite à la NMS. À chaque tour :
+1. le classifieur est entraîné sur le jeu normalisé (local_data/4_normalized_patches/patches) et les négatifs
+   difficiles déjà trouvés,
+2. detect_ecocup est lancé sur les images d'entraînement : les fenêtres au-dessus du seuil qui ne recouvrent aucune
+   annotation (IoU < MAX_GT_IOU) sont des faux positifs,
+3. ces fenêtres sont normalisées et ajoutées aux négatifs.
+Le nombre de fenêtres candidates (au-dessus du seuil) par image est affiché à chaque tour : c'est lui qui doit baisser.
+
+Les négatifs difficiles sont enregistrés au format groupé à côté du jeu normalisé
+(local_data/4_normalized_patches/hard_negatives), pour ne pas être effacés par une reconstruction des étapes.
+Les features HOG du jeu normalisé et des négatifs difficiles sont gardées en cache disque (utils/feature_store.py,
+USE_FEATURE_STORE) : d'une exécution à l'autre, seuls les patchs nouveaux ou modifiés sont recalculés.
+
+Lancement depuis la racine du dépôt :
+
+    python local_data/hard_negatives.py
+"""
+
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+from skimage.feature import hog
+from sklearn.svm import SVC
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from local_data.augmented_dataset import read_augmented
+from local_data.image_io import iter_imread
+from local_data.packed_dataset import NEG_LABEL, POS_LABEL, extract_features, packed_path, read_packed, write_packed
+from utils.detection import detect_ecocup, get_iou_matrix, non_maxima_suppression_grid, preprocess_image
+from utils.feature_store import FeatureStore
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+# Paramètres
+NB_ROUNDS = 3               # nombre de tours (entraînement, recherche des faux positifs)
+MAX_GT_IOU = 0.3            # IoU maximale avec une annotation pour qu'une fenêtre détectée soit un faux positif
+MAX_PER_IMAGE = 20          # nombre maximal de négatifs difficiles ajoutés par image et par tour (les mieux notés)
+INCLUDE_POS_IMAGES = True   # booléen. Si True, les faux positifs sont aussi cherchés dans les images positives, hors annotations
+MINING_PREFETCH = 2         # images décodées en avance pendant la recherche sur la courante (voir iter_imread)
+USE_FEATURE_STORE = True    # booléen. Si True, les features HOG des patchs sont lues dans le cache disque (local_data/features_cache) et seuls les patchs absents sont calculés
+DETECTION_PARAMS = {        # paramètres de detect_ecocup (les limites des fenêtres viennent de stats.txt)
+    "px_step": 35,
+    "scales_nb": 10,
+    "ratios_nb": 5,
+    "confidence_threshold": 0.5,
+    "mode": "hog_pyramid",
+    "hog_params": {},       # mêmes paramètres que HOG_extractor (valeurs par défaut)
+}
+
+STAGE_FOLDER = os.path.join("local_data", "4_normalized_patches")
+HARD_NEGATIVES_NAME = "hard_negatives" # nom du jeu groupé des négatifs difficiles dans STAGE_FOLDER
+
+
+def HOG_extractor(patchs):
+    # Même extracteur que dans les notebooks (HOG par défaut de skimage)
+    if len(patchs) == 0:
+        return np.empty((0, 0))
+    first_features = hog(patchs[0])
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch)
+    return features
+
+
+def feature_store():
+    """
+    Cache des features de HOG_extractor (None si USE_FEATURE_STORE est False), partagé avec utils/model_bundle.py.
+    """
+    return FeatureStore("HOG", DETECTION_PARAMS["hog_params"]) if USE_FEATURE_STORE else None
+
+
+def train_classifier(X, y):
+    # Même classifieur que dans les notebooks (probability=True pour predict_proba)
+    classifier = SVC(kernel="poly", probability=True)
+    classifier.fit(X, y)
+    return classifier
+
+
+def hard_negatives_path():
+    return os.path.join(STAGE_FOLDER, HARD_NEGATIVES_NAME)
+
+
+def load_hard_negatives():
+    """
+    :return: PackedDataset des négatifs difficiles déjà trouvés, None s'il n'y en a pas.
+    """
+    path = hard_negatives_path()
+    if not os.path.exists(f"{path}.json"):
+        return None
+    return read_packed(path)
+
+
+def load_mining_images():
+    """
+    Images d'entraînement où chercher les faux positifs, avec leurs annotations. Les images ne sont pas lues ici :
+    chaque tour les décode une à une (voir mine_round), seules les découpes retenues restent en mémoire.
+    :return: Liste de (source "pos/<nom>" ou "neg/<nom>", chemin de l'image, array (n, 4) des annotations
+    (upper_left_x, upper_left_y, lower_right_x, lower_right_y), vide pour une image négative).
+    """
+    bbox_train, _, neg_f_names = splitter.load_annotations()
+    sources = [f"neg/{f}" for f in neg_f_names]
+    gt_windows = [np.empty((0, 4)) for _ in neg_f_names]
+    if INCLUDE_POS_IMAGES:
+        for f_name, bbox_list in bbox_train.items():
+            # Toutes les annotations, difficiles comprises : un gobelet difficile n'est pas un négatif
+            bbox = np.asarray(bbox_list, dtype=np.float64).reshape(-1, 5)
+            sources.append(f"pos/{f_name}")
+            gt_windows.append(np.stack([bbox[:, 0], bbox[:, 1], bbox[:, 0] + bbox[:, 2], bbox[:, 1] + bbox[:, 3]], axis=1))
+
+    paths = [os.path.join(splitter.IMAGES_FOLDER, f"{source}.jpg") for source in sources]
+    return [(source, path, gt) for source, path, gt in zip(sources, paths, gt_windows) if os.path.exists(path)]
+
+
+def mine_image(classifier, img, gt_windows, previous_windows, detection_params):
+    """
+    Faux positifs de detect_ecocup sur une image.
+    :param gt_windows: Array (n, 4) des annotations de l'image.
+    :param previous_windows: Array (m, 4) des négatifs difficiles déjà pris dans cette image (pas repris deux fois).
+    :return: Fenêtres int32 (k, 4) gardées (au plus MAX_PER_IMAGE, par score décroissant) et nombre de fenêtres
+    candidates (au-dessus du seuil) avant NMS.
+    """
+    windows, scores = detect_ecocup(img, classifier, HOG_extractor, **detection_params)
+    if len(windows) == 0:
+        return np.empty((0, 4), dtype=np.int32), 0
+
+    # Une fenêtre par groupe de détections qui se recouvrent, par score décroissant
+    kept_windows = non_maxima_suppression_grid(windows, scores, score_decision_criteria=detection_params["confidence_threshold"])
+    kept_windows = np.asarray(kept_windows).reshape(-1, 4)
+
+    for reference in (gt_windows, previous_windows):
+        if len(reference) > 0 and len(kept_windows) > 0:
+            kept_windows = kept_windows[get_iou_matrix(kept_windows, reference).max(axis=1) < MAX_GT_IOU]
+    return kept_windows[:MAX_PER_IMAGE].astype(np.int32), len(windows)
+
+
+def mine_round(classifier, mining_images, mined_windows, round_index, detection_params):
+    """
+    Un tour de recherche des faux positifs sur toutes les images, lues au fur et à mesure (au plus MINING_PREFETCH
+    images décodées en avance).
+    :param mining_images: Liste de (source, chemin de l'image, annotations), voir load_mining_images.
+    :param mined_windows: Dictionnaire source -> array (m, 4) des négatifs difficiles déjà pris (mis à jour).
+    :return: Patchs normalisés (uint8, comme ceux de l'étape 4), noms, sources et bbox (upper_left_Y, upper_left_X, height, width) des nouveaux
+    négatifs difficiles, et nombre total de fenêtres candidates.
+    """
+    target_shape = normalizer.get_target_shape()
+    patches, names, sources, bboxes = [], [], [], []
+    nb_candidates = 0
+    imgs = iter_imread([path for _, path, _ in mining_images], prefetch=MINING_PREFETCH)
+    for (source, _, gt_windows), img in zip(mining_images, imgs):
+        if img is None:
+            continue
+        previous = mined_windows.get(source, np.empty((0, 4), dtype=np.int32))
+        new_windows, nb_image_candidates = mine_image(classifier, img, gt_windows, previous, detection_params)
+        nb_candidates += nb_image_candidates
+        mined_windows[source] = np.concatenate([previous, new_windows])
+
+        img_gray = preprocess_image(img)
+        for k, (x0, y0, x1, y1) in enumerate(new_windows):
+            # normalize_patch rend un nouvel array : l'image n'est plus référencée après ce tour de boucle.
+            # Mêmes valeurs que les patchs de l'étape 4 (stretch_patches)
+            patches.append(normalizer.stretch_patches(normalizer.normalize_patch(target_shape, img_gray[x0:x1, y0:y1])))
+            names.append(f"hn{round_index}_{source.replace('/', '_')}_{k:02d}")
+            sources.append(source)
+            bboxes.append((x0, y0, x1 - x0, y1 - y0))
+    return patches, names, sources, bboxes, nb_candidates
+
+
+def hard_negative_mining(nb_rounds=NB_ROUNDS, detection_params=None):
+    """
+    Boucle de bootstrapping (voir la docstring du module). Les négatifs difficiles s'ajoutent à ceux des exécutions
+    précédentes (supprimer local_data/4_normalized_patches/hard_negatives.* pour repartir de zéro).
+    :return: Classifieur entraîné avec tous les négatifs difficiles.
+    """
+    detection_params = dict(DETECTION_PARAMS if detection_params is None else detection_params)
+    stats = normalizer.get_stats()
+    for key in ("min_ratio", "max_ratio", "min_scale", "max_scale"):
+        detection_params.setdefault(key, stats[key])
+
+    # Features du jeu normalisé calculées une seule fois (les augmentations virtuelles par permutation du HOG)
+    start = time.time()
+    dataset = read_augmented(packed_path(STAGE_FOLDER))
+    store = feature_store()
+    X_base = dataset.features(np.arange(len(dataset)), HOG_extractor, hog_params={}, store=store)
+    y_base = np.where(dataset.labels == POS_LABEL, 1, 0)
+    print(f"Features du jeu normalisé : {X_base.shape} ({time.time() - start} s)")
+
+    hard = load_hard_negatives()
+    patches, names, sources, bboxes = [], [], [], []
+    if hard is not None:
+        patches = [hard[i] for i in range(len(hard))]
+        names, sources, bboxes = list(hard.names), list(hard.sources), [tuple(b) for b in hard.bboxes]
+    mined_windows = {}
+    for source, (x0, y0, height, width) in zip(sources, bboxes):
+        window = np.array([[x0, y0, x0 + height, y0 + width]], dtype=np.int32)
+        mined_windows[source] = np.concatenate([mined_windows.get(source, np.empty((0, 4), dtype=np.int32)), window])
+    if patches:
+        X_hard = extract_features(np.asarray(patches), HOG_extractor, store)
+    else:
+        X_hard = np.empty((0, X_base.shape[1]), dtype=X_base.dtype)
+
+    mining_images = load_mining_images()
+    print(f"Images de recherche : {len(mining_images)}")
+
+    round_offset = 1 + max((int(name.split("_")[0][2:]) for name in names), default=0)
+    for round_index in range(round_offset, round_offset + nb_rounds):
+        start = time.time()
+        classifier = train_classifier(
+            np.concatenate([X_base, X_hard]), np.concatenate([y_base, np.zeros(len(X_hard), dtype=y_base.dtype)])
+        )
+        print(f"Tour {round_index} : entraînement sur {len(X_base) + len(X_hard)} patchs ({time.time() - start} s)")
+
+        start = time.time()
+        new_patches, new_names, new_sources, new_bboxes, nb_candidates = mine_round(
+            classifier, mining_images, mined_windows, round_index, detection_params
+        )
+        print(
+            f"Tour {round_index} : {nb_candidates} fenêtres candidates ({nb_candidates / len(mining_images):.1f} par image), "
+            f"{len(new_patches)} négatifs difficiles ajoutés ({time.time() - start} s)"
+        )
+        if not new_patches:
+            break
+
+        patches += new_patches
+        names += new_names
+        sources += new_sources
+        bboxes += new_bboxes
+        X_new = extract_features(np.asarray(new_patches), HOG_extractor, store)
+        X_hard = np.concatenate([X_hard, X_new.astype(X_hard.dtype)])
+        # Enregistré à chaque tour : une exécution interrompue garde les tours terminés
+        write_packed(hard_negatives_path(), patches, names, [NEG_LABEL] * len(patches), sources, bboxes, np.uint8)
+    else:
+        # Tous les tours ont ajouté des négatifs : dernier entraînement avec ceux du dernier tour
+        classifier = train_classifier(
+            np.concatenate([X_base, X_hard]), np.concatenate([y_base, np.zeros(len(X_hard), dtype=y_base.dtype)])
+        )
+
+    print(f"Négatifs difficiles au total : {len(patches)}")
+    return classifier
+
+
+if __name__ == "__main__":
+    hard_negative_mining()
@@ -0,0 +1,89 @@
+"""
+Lecture et écriture d'images en parallèle pour les étapes de préparation des données (splitter, augmenter,
+normalizer).
+
+Le décodage et l'encodage JPEG (PIL, via plt.imread / plt.imsave) relâchent le GIL : un pool de threads suffit
+pour occuper tous les coeurs, sans copier les images entre processus.
+Les résultats sont toujours rendus dans l'ordre des entrées (Executor.map) : le parcours des images, et donc les
+tirages aléatoires faits ensuite (random.seed(0), ou une graine par image négative avec SEED_PER_NEG_IMAGE du
+splitter), restent les mêmes qu'en séquentiel.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.parallel import get_n_jobs
+
+N_WORKERS = None  # nombre de threads d'entrée/sortie (None : nombre de coeurs)
+
+
+def parallel_map(func, items, n_workers=None):
+    """
+    Applique func à chaque élément de items avec un pool de threads.
+    :param n_workers: Nombre de threads (par défaut N_WORKERS).
+    :return: Liste des résultats, dans l'ordre de items.
+    """
+    items = list(items)
+    n_workers = get_n_jobs(N_WORKERS if n_workers is None else n_workers)
+    n_workers = min(n_workers, max(len(items), 1))
+    if n_workers == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def _imread_or_none(path):
+    import matplotlib.pyplot as plt  # importé à la première lecture (coûteux, inutile pour qui n'en fait pas)
+
+    try:
+        return plt.imread(path)
+    except FileNotFoundError:
+        return None
+
+
+def imread_many(paths, n_workers=None):
+    """
+    Lit les images de paths en parallèle.
+    :return: Liste des images dans l'ordre de paths (None pour un fichier introuvable).
+    """
+    return parallel_map(_imread_or_none, paths, n_workers)
+
+
+def iter_imread(paths, n_workers=None, prefetch=None):
+    """
+    Comme imread_many, mais les images sont rendues au fur et à mesure, sans les garder toutes en mémoire.
+    :param prefetch: Nombre de lectures en avance (par défaut 2 * n_workers). Au plus prefetch images décodées sont en
+    attente, plus celle que l'appelant vient de recevoir : prefetch=1 borne la mémoire à deux images (la lecture de la
+    suivante se fait pendant le traitement de la courante).
+    :return: Générateur des images dans l'ordre de paths (None pour un fichier introuvable).
+    """
+    paths = iter(paths)
+    n_workers = get_n_jobs(N_WORKERS if n_workers is None else n_workers)
+    prefetch = 2 * n_workers if prefetch is None else max(int(prefetch), 1)
+    with ThreadPoolExecutor(max_workers=min(n_workers, prefetch)) as executor:
+        pending = deque(executor.submit(_imread_or_none, path) for _, path in zip(range(prefetch), paths))
+        while pending:
+            img = pending.popleft().result()
+            for path in paths:
+                pending.append(executor.submit(_imread_or_none, path))
+                break
+            yield img
+
+
+def read_shape(path):
+    """
+    (height, width) d'une image, lue dans l'en-tête du fichier (sans décoder les pixels).
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return img.height, img.width
+
+
+def imsave_many(paths, images, n_workers=None, **kwargs):
+    """
+    Enregistre images[i] dans paths[i] en parallèle (kwargs passés à plt.imsave, ex : cmap="gray").
+    """
+    import matplotlib.pyplot as plt
+
+    parallel_map(lambda item: plt.imsave(item[0], item[1], **kwargs), zip(paths, images), n_workers)
@@ -0,0 +1,251 @@
+"""
+Format de stockage groupé des patchs d'une étape (2_patches, 3_augmented_patches, 4_normalized_patches).
+
+Un jeu de patchs est enregistré en deux fichiers :
+- <chemin>.npy : les pixels de tous les patchs, lisibles en une seule fois par np.load(..., mmap_mode="r").
+  Si tous les patchs ont la même forme (patchs normalisés), c'est un array (N, H, W) ; sinon (patchs découpés,
+  de tailles différentes) un buffer 1D où les patchs sont mis bout à bout, sans remplissage. Les patchs entiers
+  (uint8) du buffer 1D sont compressés un par un (différences horizontales puis zlib, ~2.5 fois plus petits) :
+  les patchs découpés en couleur pèsent sinon une vingtaine de fois leurs .jpg.
+- <chemin>.json : l'index, avec pour chaque patch son nom, son label (1 : positif, 0 : négatif), l'image source,
+  la bbox d'origine (upper_left_Y, upper_left_X, height, width) et, pour le buffer 1D, sa position, sa taille
+  (compressée) et sa forme.
+  Pour un jeu augmenté "virtuel" (local_data/augmented_dataset.py), l'index décrit aussi les augmentations, qui ne
+  sont appliquées qu'à la lecture.
+
+Chargement de tout le jeu d'entraînement normalisé :
+
+    dataset = read_packed(os.path.join("local_data", "4_normalized_patches", "patches"))
+    X = dataset.data  # (N, 128, 72) uint8, memmap
+    y = dataset.labels
+"""
+
+import json
+import os
+import zlib
+
+import numpy as np
+
+PACKED_NAME = "patches"  # nom des fichiers <PACKED_NAME>.npy et <PACKED_NAME>.json dans le dossier d'une étape
+
+POS_LABEL = 1
+NEG_LABEL = 0
+
+COMPRESSION = "zlib-delta" # compression des patchs entiers du buffer 1D (voir compress_patch)
+ZLIB_LEVEL = 1 # niveau de zlib : 6 ne gagne que ~10 % de place pour un temps d'écriture 4 fois plus long
+
+
+class PackedDataset:
+    """
+    Jeu de patchs lu par read_packed. Les pixels restent sur disque (memmap en lecture seule).
+    """
+
+    def __init__(self, data, index):
+        self.data = data
+        self.names = index["names"]
+        self.labels = np.array(index["labels"], dtype=np.int8)
+        self.sources = index["sources"]
+        self.bboxes = np.array(index["bboxes"], dtype=np.int32).reshape(-1, 4)
+        self.offsets = None if index["offsets"] is None else np.array(index["offsets"], dtype=np.int64)
+        self.shapes = None if index["shapes"] is None else [tuple(shape) for shape in index["shapes"]]
+        self.compression = index.get("compression") # None : patchs non compressés
+        self.sizes = None if self.compression is None else np.array(index["sizes"], dtype=np.int64)
+        self.dtype = np.dtype(index["dtype"]) if self.compression is not None else data.dtype
+        self.augmentations = index.get("augmentations") # None : patchs déjà augmentés (ou sans augmentation)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        """
+        Patch i, vue sur le memmap (sans copie) ou, si le jeu est compressé, patch décompressé.
+        """
+        if self.offsets is None:
+            return self.data[i]
+        shape = self.shapes[i]
+        if self.compression is not None:
+            return decompress_patch(self.data[self.offsets[i]:self.offsets[i] + self.sizes[i]], shape, self.dtype)
+        return self.data[self.offsets[i]:self.offsets[i] + int(np.prod(shape))].reshape(shape)
+
+    def is_stacked(self):
+        """
+        True si data est un array (N, H, W) (tous les patchs ont la même forme).
+        """
+        return self.offsets is None
+
+    def meta(self, i):
+        """
+        (image source, bbox) du patch i.
+        """
+        return self.sources[i], tuple(int(v) for v in self.bboxes[i])
+
+    def batch(self, indices):
+        """
+        Patchs indices, copiés dans un array (n, height, width) (liste d'arrays si les patchs n'ont pas la même forme).
+        """
+        if self.is_stacked():
+            return self.data[np.asarray(indices, dtype=np.int64)]
+        return [self[i] for i in indices]
+
+    def features(self, indices, extractor, hog_params=None, approximate=False, store=None):
+        """
+        Features des patchs indices. Même signature que AugmentedDataset.features, pour que les appelants n'aient pas
+        à savoir si le jeu est augmenté virtuellement ou non (voir read_augmented) : les patchs sont déjà augmentés,
+        hog_params et approximate ne servent donc à rien ici.
+        :param extractor: Fonction (array de patchs) -> array (n_patchs, n_features), comme HOG_extractor.
+        :param store: FeatureStore de extractor (voir extract_features), None pour tout calculer.
+        :return: Array (len(indices), n_features), memmap en lecture seule si store est donné.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return np.empty((0, 0))
+        if store is not None:
+            # Vues sur le memmap : seuls les patchs absents du cache sont copiés pour l'extracteur
+            return extract_features([self[i] for i in indices], extractor, store)
+        return extract_features(self.batch(indices), extractor)
+
+    def to_dicts(self):
+        """
+        Patchs positifs et négatifs sous forme de dictionnaires nom -> patch (format des fonctions des étapes),
+        et dictionnaire nom -> (image source, bbox).
+        """
+        pos_patchs = {}
+        neg_patchs = {}
+        meta = {}
+        for i, name in enumerate(self.names):
+            if self.labels[i] == POS_LABEL:
+                pos_patchs[name] = self[i]
+            else:
+                neg_patchs[name] = self[i]
+            meta[name] = self.meta(i)
+        return pos_patchs, neg_patchs, meta
+
+
+def extract_features(patches, extractor, store=None):
+    """
+    Features de patchs, calculées par extractor ou lues dans store.
+    :param store: utils.feature_store.FeatureStore de extractor (même extracteur et mêmes paramètres) : les patchs
+    sont identifiés par leur contenu, seuls ceux absents du cache sont calculés, et le résultat est un memmap en lecture
+    seule (sans copie aux chargements suivants dans le même ordre). None pour tout calculer.
+    :return: Array (n_patchs, n_features).
+    """
+    if store is None:
+        return np.asarray(extractor(patches))
+    return store.features_for_patches(patches, extractor)
+
+
+def packed_path(stage_folder):
+    """
+    Chemin (sans extension) du jeu groupé d'une étape.
+    """
+    return os.path.join(stage_folder, PACKED_NAME)
+
+
+def read_packed(path):
+    """
+    :param path: Chemin sans extension (voir packed_path).
+    :return: PackedDataset.
+    """
+    with open(f"{path}.json", "r", encoding="utf-8") as f:
+        index = json.load(f)
+    data = np.load(f"{path}.npy", mmap_mode="r")
+    return PackedDataset(data, index)
+
+
+def write_packed(path, patches, names, labels, sources=None, bboxes=None, dtype=None, augmentations=None):
+    """
+    Enregistre des patchs au format groupé.
+    :param path: Chemin sans extension (voir packed_path).
+    :param patches: Liste des patchs (arrays).
+    :param names: Noms des patchs.
+    :param labels: Labels des patchs (POS_LABEL ou NEG_LABEL).
+    :param sources: Image source de chaque patch (None si inconnue).
+    :param bboxes: Bbox d'origine (upper_left_Y, upper_left_X, height, width) de chaque patch (-1 si inconnue).
+    :param dtype: Type de stockage (par défaut celui du premier patch), ex : np.uint8 ou np.float32.
+    :param augmentations: Augmentations virtuelles des patchs (voir local_data/augmented_dataset.py), None sinon.
+    Les patchs peuvent être des vues sur l'ancien jeu du même chemin : le nouveau est écrit à côté puis le remplace.
+    Les patchs de formes différentes et de type entier sont compressés (voir compress_patch).
+    """
+    n = len(patches)
+    if sources is None:
+        sources = [None] * n
+    if bboxes is None:
+        bboxes = [(-1, -1, -1, -1)] * n
+    if dtype is None:
+        dtype = patches[0].dtype if n > 0 else np.uint8
+
+    shapes = [tuple(int(v) for v in patch.shape) for patch in patches]
+    stacked = n > 0 and all(shape == shapes[0] for shape in shapes)
+    compression = None
+    sizes = None
+    if stacked:
+        data = np.lib.format.open_memmap(f"{path}.tmp.npy", mode="w+", dtype=dtype, shape=(n, *shapes[0]))
+        for i, patch in enumerate(patches):
+            data[i] = patch
+        offsets = None
+    elif np.issubdtype(dtype, np.integer):
+        compression = COMPRESSION
+        chunks = [compress_patch(np.asarray(patch, dtype=dtype)) for patch in patches]
+        sizes = [len(chunk) for chunk in chunks]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        data = np.lib.format.open_memmap(f"{path}.tmp.npy", mode="w+", dtype=np.uint8, shape=(int(offsets[-1]),))
+        for i, chunk in enumerate(chunks):
+            data[offsets[i]:offsets[i + 1]] = np.frombuffer(chunk, dtype=np.uint8)
+        offsets = offsets[:-1].tolist()
+    else:
+        lengths = [int(np.prod(shape)) for shape in shapes]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        data = np.lib.format.open_memmap(f"{path}.tmp.npy", mode="w+", dtype=dtype, shape=(int(offsets[-1]),))
+        for i, patch in enumerate(patches):
+            data[offsets[i]:offsets[i + 1]] = np.asarray(patch).ravel()
+        offsets = offsets[:-1].tolist()
+    data.flush()
+    del data
+
+    index = {
+        "names": list(names),
+        "labels": [int(label) for label in labels],
+        "sources": list(sources),
+        "bboxes": [[int(v) for v in bbox] for bbox in bboxes],
+        "offsets": offsets,
+        "shapes": None if stacked else shapes,
+        "augmentations": augmentations,
+        "compression": compression,
+        "sizes": sizes,
+        "dtype": np.dtype(dtype).str,
+    }
+    with open(f"{path}.tmp.json", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(f"{path}.tmp.npy", f"{path}.npy")
+    os.replace(f"{path}.tmp.json", f"{path}.json")
+
+
+def compress_patch(patch):
+    """
+    Patch entier compressé : différences entre pixels voisins d'une même ligne (modulo 2^bits, les zones unies
+    deviennent des suites de 0), puis zlib.
+    """
+    delta = np.diff(patch, axis=1, prepend=np.zeros_like(patch[:, :1]))
+    return zlib.compress(np.ascontiguousarray(delta).tobytes(), ZLIB_LEVEL)
+
+
+def decompress_patch(buffer, shape, dtype):
+    """
+    Inverse de compress_patch.
+    """
+    delta = np.frombuffer(zlib.decompress(buffer), dtype=dtype).reshape(shape)
+    return np.cumsum(delta, axis=1, dtype=dtype)
+
+
+def write_patch_dicts(path, pos_patchs: dict, neg_patchs: dict, meta=None, dtype=None):
+    """
+    Enregistre au format groupé les dictionnaires nom -> patch d'une étape.
+    :param meta: Dictionnaire nom -> (image source, bbox), voir PackedDataset.to_dicts.
+    """
+    meta = meta or {}
+    names = list(pos_patchs.keys()) + list(neg_patchs.keys())
+    patches = list(pos_patchs.values()) + list(neg_patchs.values())
+    labels = [POS_LABEL] * len(pos_patchs) + [NEG_LABEL] * len(neg_patchs)
+    sources = [meta.get(name, (None, None))[0] for name in names]
+    bboxes = [meta.get(name, (None, None))[1] or (-1, -1, -1, -1) for name in names]
+    write_packed(path, patches, names, labels, sources, bboxes, dtype)
@@ -0,0 +1,143 @@
+"""
+Construction complète du jeu d'entraînement en mémoire : splitter -> augmenter -> normalizer enchaînés comme
+générateurs, dans un seul processus.
+
+Chaque image source est lue une seule fois ; les patchs découpés et augmentés ne passent plus par le disque
+(ni encodage JPEG, ni relecture) et seul le jeu groupé normalisé (local_data/4_normalized_patches/patches) est écrit.
+Les patchs produits sont les mêmes que ceux des étapes lancées séparément (à la précision flottante près : la
+normalisation se fait par lots, voir normalize_patches).
+Avec LAZY_AUGMENT, seuls les patchs découpés sont normalisés et enregistrés : les retournements de l'augmenteur sont
+appliqués à la lecture (voir local_data/augmented_dataset.py, read_augmented).
+Sans EXPORT_JPG, les .jpg des étapes réécrites sont supprimés : ils ne correspondent plus au jeu groupé, et les
+notebooks qui les lisent ne doivent pas entraîner silencieusement sur d'anciens patchs.
+
+Lancement depuis la racine du dépôt :
+
+    python local_data/pipeline.py
+"""
+
+import importlib
+import itertools
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from local_data.augmented_dataset import augmentations_index, read_augmented
+from local_data.build_manifest import MANIFEST_NAME, remove_stale_jpgs
+from local_data.image_io import imsave_many
+from local_data.packed_dataset import NEG_LABEL, POS_LABEL, packed_path, write_packed
+
+import numpy as np
+
+splitter = importlib.import_module("local_data.2_patches.splitter")
+augmenter = importlib.import_module("local_data.3_augmented_patches.augmenter")
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+WRITE_STAGES = False  # booléen. Si True, les jeux groupés des étapes 2 et 3 sont aussi écrits (débogage)
+EXPORT_JPG = False  # booléen. Si True, les patchs normalisés sont aussi enregistrés un par un en .jpg (lus par les notebooks). Sinon les .jpg des étapes réécrites, périmés, sont supprimés
+LAZY_AUGMENT = True  # booléen. Si True, les augmentations ne sont pas matérialisées (jeu 4 fois plus petit), voir local_data/augmented_dataset.py
+
+
+def pipeline():
+    start = time.time()
+
+    stage_items = {"2_patches": [], "3_augmented_patches": []} # patchs gardés pour WRITE_STAGES
+
+    # Positifs d'abord (peu nombreux) : target_shape se calcule sur leurs seules formes, avant de normaliser quoi que ce soit
+    pos_split, neg_split = splitter.iter_splitter()
+    pos_split = list(pos_split)
+
+    # Les augmentations ne changent pas la forme des patchs : mêmes statistiques que sur les patchs augmentés
+    target_shape = normalizer.compute_target_shape({
+        augmented_name: patch
+        for name, _, patch, _ in pos_split
+        for augmented_name in augmenter.augmented_names(name)
+    })
+
+    split = itertools.chain(pos_split, neg_split)
+    if WRITE_STAGES:
+        split = _keep(split, stage_items["2_patches"])
+    rotated = [] # patchs découpés tournés de 90° par la normalisation (LAZY_AUGMENT)
+    if LAZY_AUGMENT:
+        augmented = _record_rotation(split, rotated)
+    else:
+        augmented = augmenter.iter_augmenter(split)
+        if WRITE_STAGES:
+            augmented = _keep(augmented, stage_items["3_augmented_patches"])
+    normalized = normalizer.iter_normalizer(augmented, target_shape)
+
+    names, labels, patches, sources, bboxes = [], [], [], [], []
+    for name, label, patch, (source, bbox) in normalized:
+        names.append(name)
+        labels.append(label)
+        patches.append(patch)
+        sources.append(source)
+        bboxes.append(bbox)
+    print(f"Patchs normalisés : {len(patches)} ({time.time() - start} s)")
+
+    stage_folder = os.path.join("local_data", "4_normalized_patches")
+    augmentations = augmentations_index(rotated) if LAZY_AUGMENT else None
+    write_packed(packed_path(stage_folder), patches, names, labels, sources, bboxes, np.uint8, augmentations)
+    _forget_manifest(stage_folder)
+    if EXPORT_JPG:
+        # Relu avec read_augmented : les .jpg sont ceux des patchs augmentés dans les deux cas
+        dataset = read_augmented(packed_path(stage_folder))
+        _remove_stale_jpgs(stage_folder, dataset.names)
+        for label_folder, label_value in (("pos", POS_LABEL), ("neg", NEG_LABEL)):
+            indices = np.flatnonzero(dataset.labels == label_value)
+            paths = [os.path.join(stage_folder, label_folder, f"{dataset.names[i]}.jpg") for i in indices]
+            imsave_many(paths, [dataset[i] for i in indices], cmap="gray")
+    else:
+        _remove_stale_jpgs(stage_folder)
+
+    for stage, items in stage_items.items():
+        if items:
+            stage_folder = os.path.join("local_data", stage)
+            write_packed(
+                packed_path(stage_folder),
+                [patch for _, _, patch, _ in items],
+                [name for name, _, _, _ in items],
+                [label for _, label, _, _ in items],
+                [source for _, _, _, (source, _) in items],
+                [bbox for _, _, _, (_, bbox) in items],
+            )
+            _forget_manifest(stage_folder)
+            _remove_stale_jpgs(stage_folder)
+
+    print(f"Temps total : {time.time() - start} s")
+
+
+def _keep(items, kept):
+    # Garde une référence sur chaque élément qui passe (pour l'écrire à la fin)
+    for item in items:
+        kept.append(item)
+        yield item
+
+
+def _record_rotation(items, rotated):
+    # Même règle que normalize_patch : les patchs plus larges que hauts sont tournés de 90°
+    for item in items:
+        patch = item[2]
+        rotated.append(patch.shape[1] > patch.shape[0])
+        yield item
+
+
+def _remove_stale_jpgs(stage_folder, names=()):
+    # Le jeu groupé de l'étape vient d'être réécrit : ses anciens .jpg (sauf ceux de names, réécrits) ne correspondent
+    # plus forcément aux patchs, ils sont supprimés pour que les notebooks ne les lisent pas
+    nb_removed = remove_stale_jpgs(stage_folder, names)
+    if nb_removed:
+        print(f"{stage_folder} : {nb_removed} .jpg périmés supprimés (EXPORT_JPG pour les réécrire)")
+
+
+def _forget_manifest(stage_folder):
+    # Le jeu groupé de l'étape vient d'être réécrit hors du manifeste : la prochaine exécution de l'étape seule
+    # la reconstruira entièrement
+    manifest_path = os.path.join(stage_folder, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+if __name__ == "__main__":
+    pipeline()
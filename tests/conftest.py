@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les tests se lancent depuis la racine du dépôt (python -m pytest tests), comme les scripts et les benchmarks
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
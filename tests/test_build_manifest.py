@@ -0,0 +1,70 @@
+"""
+Reconstruction incrémentale d'une étape (BuildManifest, update_patchs, save_stage, load_previous) : seuls les patchs
+dont l'entrée ou les paramètres ont changé sont recalculés.
+"""
+
+import numpy as np
+
+from local_data.build_manifest import BuildManifest, load_previous, params_digest, save_stage, update_patchs
+from local_data.packed_dataset import read_packed
+
+
+def flip_names(name):
+    return [f"{name}_original", f"{name}_flip"]
+
+
+class CountingStage:
+    # Étape factice (dict -> dict, comme augmenter) qui compte les patchs d'entrée traités
+    def __init__(self):
+        self.processed = []
+
+    def __call__(self, patchs_base):
+        self.processed += list(patchs_base)
+        patchs = {}
+        for name, patch in patchs_base.items():
+            patchs[f"{name}_original"] = patch
+            patchs[f"{name}_flip"] = np.flip(patch, 1)
+        return patchs
+
+
+def run_stage(stage_folder, input_folder, patchs_base, params):
+    # Même enchaînement que le __main__ de augmenter.py (patchs positifs seulement)
+    manifest = BuildManifest(stage_folder)
+    input_manifest = BuildManifest(input_folder)
+    previous_patchs, _ = load_previous(stage_folder)
+    stage = CountingStage()
+    patchs, regenerated = update_patchs(
+        manifest, previous_patchs, patchs_base, input_manifest, params_digest(params), stage, flip_names
+    )
+    save_stage(stage_folder, patchs, {}, {}, manifest, regenerated, False)
+    return stage.processed, regenerated
+
+
+def test_incremental_rebuild(tmp_path):
+    stage_folder = str(tmp_path / "stage")
+    input_folder = str(tmp_path / "input") # sans manifeste : les entrées sont identifiées par leur contenu
+    (tmp_path / "stage").mkdir()
+    rng = np.random.default_rng(0)
+    patchs_base = {name: rng.integers(0, 256, (8, 5 + k), dtype=np.uint8) for k, name in enumerate("abc")}
+
+    processed, regenerated = run_stage(stage_folder, input_folder, patchs_base, {"p": 1})
+    assert processed == ["a", "b", "c"]
+    assert regenerated == {name for base in "abc" for name in flip_names(base)}
+
+    # Rien n'a changé : tout est repris du jeu groupé
+    processed, regenerated = run_stage(stage_folder, input_folder, patchs_base, {"p": 1})
+    assert processed == [] and regenerated == set()
+
+    # Une entrée modifiée, une supprimée : seule la première est recalculée, les patchs de la seconde sont retirés
+    patchs_base["b"] = patchs_base["b"] + 1
+    del patchs_base["c"]
+    processed, regenerated = run_stage(stage_folder, input_folder, patchs_base, {"p": 1})
+    assert processed == ["b"] and regenerated == set(flip_names("b"))
+    dataset = read_packed(f"{stage_folder}/patches")
+    assert dataset.names == flip_names("a") + flip_names("b")
+    np.testing.assert_array_equal(dataset[3], np.flip(patchs_base["b"], 1))
+    assert set(BuildManifest(stage_folder).artifacts) == set(dataset.names)
+
+    # Paramètres modifiés : tout est recalculé, mais les patchs au contenu identique ne comptent pas comme modifiés
+    processed, regenerated = run_stage(stage_folder, input_folder, patchs_base, {"p": 2})
+    assert processed == ["a", "b"] and regenerated == set()
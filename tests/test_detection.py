@@ -0,0 +1,84 @@
+"""
+Équivalences des versions optimisées de la détection avec les versions historiques : fenêtres glissantes
+(strided_sliding_window / sliding_window), IoU vectorisée (get_iou_matrix / get_iou) et NMS
+(non_maxima_suppression_v2 et non_maxima_suppression_grid / boucle historique sur get_iou).
+"""
+
+import numpy as np
+import pytest
+
+from utils.detection import (
+    get_iou,
+    get_iou_matrix,
+    non_maxima_suppression_grid,
+    non_maxima_suppression_v2,
+    sliding_window,
+    strided_sliding_window,
+)
+
+
+def legacy_nms(windows_list, scores, iou_decision_criteria=0.5, score_decision_criteria=0.5):
+    # non_maxima_suppression_v2 d'origine : une IoU get_iou par paire de fenêtres
+    valid_indices = np.where(scores >= score_decision_criteria)[0]
+    windows_list = windows_list[valid_indices]
+    scores = scores[valid_indices]
+    order = np.argsort(scores)[::-1]
+    windows_list = windows_list[order]
+    scores = scores[order]
+
+    best_windows = []
+    best_scores = []
+    while len(windows_list) > 0:
+        best_window = windows_list[0]
+        best_windows.append(best_window)
+        best_scores.append(scores[0])
+        windows_list = windows_list[1:]
+        scores = scores[1:]
+        iou_scores = np.array([get_iou(best_window, window) for window in windows_list])
+        valid_indices = np.where(iou_scores < iou_decision_criteria)[0]
+        windows_list = windows_list[valid_indices]
+        scores = scores[valid_indices]
+    return best_windows, best_scores
+
+
+def random_windows(rng, n, image_size=600):
+    upper_left = rng.integers(0, image_size, size=(n, 2))
+    sizes = rng.integers(10, 200, size=(n, 2))
+    return np.stack([upper_left, upper_left + sizes], axis=1) # format ((upper_left), (lower_right))
+
+
+@pytest.mark.parametrize("shape", [(50, 70), (50, 70, 3)])
+@pytest.mark.parametrize("h, w, x_step, y_step", [(20, 10, 7, 5), (10, 20, 3, 4), (50, 70, 1, 1), (60, 10, 5, 5)])
+def test_strided_sliding_window_matches_sliding_window(shape, h, w, x_step, y_step):
+    img = np.random.default_rng(0).random(shape)
+    img_parts, parts_coords = sliding_window(img, h, w, x_step, y_step)
+    windows, coords = strided_sliding_window(img, h, w, x_step, y_step)
+
+    assert coords.shape == (len(parts_coords), 4)
+    np.testing.assert_array_equal(coords, np.array(parts_coords, dtype=np.int32).reshape(-1, 4))
+    if parts_coords:
+        n_y = windows.shape[1]
+        for k, part in enumerate(img_parts):
+            np.testing.assert_array_equal(windows[k // n_y, k % n_y], part)
+
+
+def test_get_iou_matrix_matches_get_iou():
+    rng = np.random.default_rng(1)
+    windows_a = random_windows(rng, 30, image_size=200)
+    windows_b = random_windows(rng, 40, image_size=200)
+    expected = np.array([[get_iou(a, b) for b in windows_b] for a in windows_a])
+    np.testing.assert_allclose(get_iou_matrix(windows_a, windows_b), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("nms", [non_maxima_suppression_v2, non_maxima_suppression_grid])
+@pytest.mark.parametrize("iou_decision_criteria", [0.0, 0.3, 0.5])
+def test_nms_matches_legacy(nms, iou_decision_criteria):
+    rng = np.random.default_rng(2)
+    windows = random_windows(rng, 300)
+    scores = rng.random(300)
+
+    expected_windows, expected_scores = legacy_nms(windows, scores, iou_decision_criteria)
+    kept_windows, kept_scores = nms(windows, scores, iou_decision_criteria, output_score=True)
+
+    np.testing.assert_array_equal(np.array(kept_windows), np.array(expected_windows))
+    np.testing.assert_array_equal(np.array(kept_scores), np.array(expected_scores))
@@ -0,0 +1,37 @@
+"""
+Permutation des features HOG des patchs retournés (hog_flip_permutation), utilisée par les augmentations virtuelles.
+"""
+
+import numpy as np
+from skimage.feature import hog
+
+from utils.hog_pyramid import hog_flip_permutation, window_orientations
+
+TARGET_SHAPE = (128, 72)
+
+
+def smooth_patch(seed):
+    # Patch sans gradient exactement nul : la permutation n'est approchée que pour ces gradients
+    rng = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(0, 1, TARGET_SHAPE[1]), np.linspace(0, 1, TARGET_SHAPE[0]))
+    return np.sin(7 * x + 3 * y + rng.random()) + 0.5 * np.cos(5 * y * x + rng.random()) + 0.1 * rng.random(TARGET_SHAPE)
+
+
+def test_hog_flip_permutation_exact_for_180_rotation():
+    patch = smooth_patch(0)
+    permutation = hog_flip_permutation(TARGET_SHAPE, (0, 1), {})
+    np.testing.assert_allclose(hog(np.flip(patch, (0, 1))), hog(patch)[permutation], rtol=0, atol=1e-6) # aux arrondis près
+
+
+def test_hog_flip_permutation_close_for_single_axis():
+    patch = smooth_patch(1)
+    for axes in ((0,), (1,)):
+        permutation = hog_flip_permutation(TARGET_SHAPE, axes, {})
+        flipped = hog(np.flip(patch, axes))
+        assert np.abs(flipped - hog(patch)[permutation]).mean() < 0.01 * np.abs(flipped).mean()
+
+
+def test_window_orientations_follow_normalize_patch_rotation():
+    assert window_orientations(40, 40) == ((40, 40), [False])
+    assert window_orientations(60, 30) == ((60, 30), [False, True])
+    assert window_orientations(30, 60) == ((60, 30), [True, False])
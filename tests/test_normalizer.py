@@ -0,0 +1,45 @@
+"""
+Équivalences de la normalisation : normalize_patches (matrices de redimensionnement, par lot) contre normalize_patch
+(resize de skimage, patch par patch), et stretch_patches contre les pixels écrits par plt.imsave(..., cmap="gray").
+"""
+
+import importlib
+
+import numpy as np
+import pytest
+
+normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+TARGET_SHAPE = (32, 16)
+
+
+@pytest.mark.parametrize("shape", [(3, 70, 40, 3), (3, 70, 40), (2, 40, 70, 3), (2, 33, 33), (2, 20, 12)])
+def test_normalize_patches_matches_normalize_patch(shape):
+    stack = np.random.default_rng(0).integers(0, 256, size=shape, dtype=np.uint8)
+    expected = np.array([normalizer.normalize_patch(TARGET_SHAPE, patch) for patch in stack])
+    batched = normalizer.normalize_patches(TARGET_SHAPE, stack)
+    assert batched.shape == expected.shape
+    np.testing.assert_allclose(batched, expected, rtol=0, atol=1e-10)
+
+
+def test_normalize_patches_keeps_float32():
+    stack = np.random.default_rng(1).random((2, 70, 40)).astype(np.float32)
+    batched = normalizer.normalize_patches(TARGET_SHAPE, stack)
+    assert batched.dtype == np.float32
+    expected = np.array([normalizer.normalize_patch(TARGET_SHAPE, patch.astype(np.float64)) for patch in stack])
+    np.testing.assert_allclose(batched, expected, rtol=0, atol=1e-5)
+
+
+def test_stretch_patches_matches_imsave():
+    from matplotlib.cm import ScalarMappable
+
+    rng = np.random.default_rng(2)
+    patches = [normalizer.normalize_patch(TARGET_SHAPE, rng.random((70, 40))) for _ in range(20)]
+    for patch in patches:
+        # Ce que fait plt.imsave(..., cmap="gray") avant l'encodage de l'image
+        expected = ScalarMappable(cmap="gray").to_rgba(patch, bytes=True)[..., 0]
+        np.testing.assert_array_equal(normalizer.stretch_patches(patch), expected)
+    np.testing.assert_array_equal(
+        normalizer.stretch_patches(np.array(patches)), np.array([normalizer.stretch_patches(p) for p in patches])
+    )
+    assert not normalizer.stretch_patches(np.full(TARGET_SHAPE, 0.3)).any()
@@ -0,0 +1,86 @@
+"""
+Aller-retour du format groupé (write_packed / read_packed) : patchs, index et compression des patchs de tailles
+différentes, et augmentations virtuelles (read_augmented).
+"""
+
+import numpy as np
+import pytest
+
+from local_data.augmented_dataset import augmentations_index, read_augmented
+from local_data.packed_dataset import NEG_LABEL, POS_LABEL, read_packed, write_packed, write_patch_dicts
+
+
+def write_and_read(tmp_path, patches, dtype=None):
+    path = str(tmp_path / "patches")
+    names = [f"patch_{i}" for i in range(len(patches))]
+    labels = [POS_LABEL if i % 2 else NEG_LABEL for i in range(len(patches))]
+    sources = [f"pos/{i:04d}" for i in range(len(patches))]
+    bboxes = [(i, 2 * i, 10 + i, 20 + i) for i in range(len(patches))]
+    write_packed(path, patches, names, labels, sources, bboxes, dtype)
+    dataset = read_packed(path)
+    assert dataset.names == names
+    np.testing.assert_array_equal(dataset.labels, labels)
+    assert [dataset.meta(i) for i in range(len(dataset))] == list(zip(sources, bboxes))
+    return dataset
+
+
+def test_stacked_round_trip(tmp_path):
+    patches = list(np.random.default_rng(0).random((5, 12, 8)).astype(np.float32))
+    dataset = write_and_read(tmp_path, patches)
+    assert dataset.is_stacked() and dataset.compression is None
+    np.testing.assert_array_equal(dataset.data, np.array(patches))
+    np.testing.assert_array_equal(dataset.batch([3, 1]), np.array(patches)[[3, 1]])
+
+
+@pytest.mark.parametrize("channels", [(), (3,)])
+def test_ragged_uint8_round_trip_is_compressed(tmp_path, channels):
+    rng = np.random.default_rng(1)
+    patches = [rng.integers(0, 256, size=(h, w) + channels, dtype=np.uint8) for h, w in ((10, 7), (4, 9), (30, 2))]
+    patches.append(np.zeros((20, 20) + channels, dtype=np.uint8))
+    dataset = write_and_read(tmp_path, patches)
+    assert not dataset.is_stacked() and dataset.compression is not None
+    assert dataset.data.nbytes < sum(patch.nbytes for patch in patches)
+    for i, patch in enumerate(patches):
+        assert dataset[i].dtype == np.uint8
+        np.testing.assert_array_equal(dataset[i], patch)
+
+
+def test_ragged_float_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    patches = [rng.random((h, w)) for h, w in ((10, 7), (4, 9))]
+    dataset = write_and_read(tmp_path, patches)
+    assert dataset.compression is None
+    for i, patch in enumerate(patches):
+        np.testing.assert_array_equal(dataset[i], patch)
+
+
+def test_patch_dicts_round_trip(tmp_path):
+    rng = np.random.default_rng(3)
+    pos_patchs = {"a": rng.integers(0, 256, (5, 4), dtype=np.uint8)}
+    neg_patchs = {"b": rng.integers(0, 256, (3, 6), dtype=np.uint8), "c": rng.integers(0, 256, (2, 2), dtype=np.uint8)}
+    meta = {"a": ("pos/0000", (1, 2, 5, 4)), "c": ("neg/0001", (0, 0, 2, 2))}
+    path = str(tmp_path / "patches")
+    write_patch_dicts(path, pos_patchs, neg_patchs, meta)
+
+    read_pos, read_neg, read_meta = read_packed(path).to_dicts()
+    assert list(read_pos) == ["a"] and list(read_neg) == ["b", "c"]
+    for name, patch in {**pos_patchs, **neg_patchs}.items():
+        np.testing.assert_array_equal({**read_pos, **read_neg}[name], patch)
+    assert read_meta == {"a": meta["a"], "b": (None, (-1, -1, -1, -1)), "c": meta["c"]}
+
+
+def test_virtual_augmentations(tmp_path):
+    rng = np.random.default_rng(4)
+    patches = list(rng.random((2, 6, 4)))
+    path = str(tmp_path / "patches")
+    # Le second patch a été tourné de 90° par la normalisation : ses axes sont échangés
+    write_packed(path, patches, ["p0", "p1"], [POS_LABEL, NEG_LABEL], augmentations=augmentations_index([False, True]))
+    dataset = read_augmented(path)
+
+    assert len(dataset) == 8
+    assert dataset.names[:4] == ["p0_original", "p0_horizontal", "p0_vertical", "p0_horizontal_vertical"]
+    np.testing.assert_array_equal(dataset[1], np.flip(patches[0], 1))
+    np.testing.assert_array_equal(dataset[2], np.flip(patches[0], 0))
+    np.testing.assert_array_equal(dataset[5], np.flip(patches[1], 0))
+    np.testing.assert_array_equal(dataset[7], np.flip(patches[1], (0, 1)))
+    np.testing.assert_array_equal(dataset.labels, [POS_LABEL] * 4 + [NEG_LABEL] * 4)
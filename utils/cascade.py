@@ -0,0 +1,191 @@
+"""
+Classifieur en cascade pour la détection (Viola & Jones).
+
+Presque toutes les fenêtres testées par detect_ecocup sont du fond évident : plutôt que de leur faire payer le HOG
+complet et le predict_proba du SVC, une ou plusieurs étapes peu coûteuses les rejettent d'abord. Seules les fenêtres
+qui passent toutes les étapes vont au classifieur final ; les autres ont une probabilité de 0.
+
+Une étape (CascadeStage) est un classifieur et un seuil, sur :
+- des features peu coûteuses calculées sur les patchs normalisés (ex : gradient_blocks), mode "window" ;
+- ou les features du classifieur final (features_func=None), par exemple un modèle linéaire sur le HOG devant un SVC
+  polynomial ; seul type d'étape possible en mode "hog_pyramid".
+Le seuil de chaque étape est choisi pour garder une fraction donnée des positifs (train_cascade_stage), sur des scores
+obtenus par validation croisée : sur ses propres données d'entraînement, un modèle linéaire sur le HOG sépare presque
+parfaitement les deux classes et le seuil serait beaucoup trop optimiste. Le rappel de la cascade est donc environ le
+produit de ceux des étapes.
+"""
+
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import GroupKFold, StratifiedKFold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+BLOCK_SIZE = 8 # côté (en pixels) des blocs de gradient_blocks
+CV_FOLDS = 3   # nombre de plis de la validation croisée qui fixe les seuils
+
+
+def _block_means(stack, factor):
+    n, height, width = stack.shape
+    height -= height % factor
+    width -= width % factor
+    blocks = stack[:, :height, :width].reshape(n, height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(2, 4)).reshape(n, -1)
+
+
+def gradient_blocks(patches, factor=BLOCK_SIZE):
+    """
+    Features peu coûteuses (~0.3 ms par patch 128x72, contre ~2.5 ms pour le HOG) : moyenne par blocs de
+    factor x factor de la valeur absolue des gradients (différences centrées) verticaux et horizontaux, indépendante
+    du contraste du patch.
+    Les pixels moyennés seuls ne séparent presque pas les gobelets du fond (contraste et éclairage variables).
+    :param patches: Array (n, height, width) de patchs normalisés.
+    :return: Array (n, 2 * (height // factor) * (width // factor)).
+    """
+    patches = np.asarray(patches, dtype=np.float32)
+    # Divisés par l'étendue de chaque patch : mêmes features pour les patchs d'entraînement (étirés en uint8 par
+    # stretch_patches, voir le normalizer) et pour les fenêtres de détection (valeurs de normalize_patch)
+    span = patches.max(axis=(1, 2), keepdims=True) - patches.min(axis=(1, 2), keepdims=True)
+    patches = patches / np.where(span > 0, span, 1)
+    gradient_rows = np.zeros_like(patches)
+    gradient_cols = np.zeros_like(patches)
+    gradient_rows[:, 1:-1] = np.abs(patches[:, 2:] - patches[:, :-2])
+    gradient_cols[:, :, 1:-1] = np.abs(patches[:, :, 2:] - patches[:, :, :-2])
+    return np.concatenate([_block_means(gradient_rows, factor), _block_means(gradient_cols, factor)], axis=1)
+
+
+def stage_scores(classifier, X):
+    """
+    Score d'une étape : probabilité de la classe positive si le classifieur la donne, decision_function sinon.
+    """
+    if hasattr(classifier, "predict_proba"):
+        return classifier.predict_proba(X)[:, 1]
+    return classifier.decision_function(X)
+
+
+class CascadeStage:
+    """
+    Étape de rejet : les fenêtres dont le score (stage_scores) est sous threshold sont rejetées.
+    """
+
+    def __init__(self, classifier, threshold, features_func=None, name=None):
+        """
+        :param classifier: Classifieur entraîné (predict_proba ou decision_function).
+        :param threshold: Score minimal pour passer l'étape.
+        :param features_func: Fonction (patchs normalisés) -> features, None pour les features du classifieur final.
+        :param name: Nom affiché dans les statistiques.
+        """
+        self.classifier = classifier
+        self.threshold = threshold
+        self.features_func = features_func
+        self.name = name or (features_func.__name__ if features_func is not None else "features finales")
+
+
+class Cascade:
+    """
+    Suite d'étapes de rejet devant le classifieur final (voir la docstring du module).
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def new_stats(self):
+        """
+        Statistiques vides, une ligne par étape puis une pour le classifieur final :
+        (fenêtres en entrée, fenêtres rejetées, temps en secondes).
+        """
+        return np.zeros((len(self.stages) + 1, 3))
+
+    def predict_proba(self, classifier, patches=None, features=None, features_func=None, dtype=np.float64, stats=None):
+        """
+        Probabilité de la classe "gobelet" de chaque fenêtre, 0 pour celles rejetées par une étape.
+        :param classifier: Classifieur final.
+        :param patches: Array (n, height, width) des fenêtres normalisées (mode "window").
+        :param features: Features finales de toutes les fenêtres, si elles sont déjà calculées (mode "hog_pyramid").
+        :param features_func: Fonction (patchs normalisés) -> features finales, appelée sur les seules fenêtres restantes.
+        :param dtype: Type flottant des features passées aux classifieurs.
+        :param stats: Statistiques (voir new_stats) complétées sur place, ou None.
+        :return: Array (n,).
+        """
+        n = len(patches) if features is None else len(features)
+        probas = np.zeros(n)
+        alive = np.arange(n)
+        alive_features = features # features finales des fenêtres restantes, si déjà calculées
+
+        for k, stage in enumerate(self.stages):
+            if len(alive) == 0:
+                break
+            start = time.time()
+            if stage.features_func is not None:
+                if patches is None:
+                    raise ValueError(f"L'étape {stage.name} a besoin des patchs normalisés (mode \"window\")")
+                X = stage.features_func(patches[alive])
+            else:
+                if alive_features is None:
+                    alive_features = features_func(patches[alive])
+                X = alive_features
+            keep = stage_scores(stage.classifier, np.asarray(X).astype(dtype, copy=False)) >= stage.threshold
+            if stats is not None:
+                stats[k] += (len(alive), len(alive) - np.count_nonzero(keep), time.time() - start)
+            alive = alive[keep]
+            if alive_features is not None:
+                alive_features = alive_features[keep]
+
+        if len(alive) > 0:
+            start = time.time()
+            if alive_features is None:
+                alive_features = features_func(patches[alive])
+            probas[alive] = classifier.predict_proba(np.asarray(alive_features).astype(dtype, copy=False))[:, 1]
+            if stats is not None:
+                stats[-1] += (len(alive), 0, time.time() - start)
+        return probas
+
+    def print_stats(self, stats):
+        """
+        Affiche le taux de rejet et le temps de chaque étape.
+        """
+        names = [stage.name for stage in self.stages] + ["classifieur final"]
+        total = stats[0, 0] if len(stats) > 0 else 0
+        print("Cascade :")
+        for name, (n_in, n_rejected, seconds) in zip(names, stats):
+            rate = n_rejected / n_in if n_in > 0 else 0
+            print(f"\t{name} : {int(n_in)} fenêtres, {int(n_rejected)} rejetées ({100 * rate:.1f} %), {seconds:.3f} s")
+        if total > 0:
+            print(f"\tFenêtres jusqu'au classifieur final : {int(stats[-1, 0])} sur {int(total)} ({100 * stats[-1, 0] / total:.1f} %)")
+
+
+def train_cascade_stage(X, y, recall=0.99, classifier=None, features_func=None, name=None, groups=None):
+    """
+    Entraîne une étape de rejet et choisit son seuil pour garder au moins recall des positifs, sur les scores de
+    validation croisée (CV_FOLDS plis) ; le classifieur est ensuite entraîné sur toutes les données.
+    :param X: Features d'entraînement de l'étape (features_func appliquée aux patchs, ou features finales).
+    :param y: Labels (1 : positif, 0 : négatif).
+    :param recall: Fraction des positifs qui doit passer l'étape.
+    :param classifier: Classifieur à entraîner (par défaut une régression logistique sur les features standardisées).
+    :param features_func: Voir CascadeStage.
+    :param groups: Groupe de chaque patch pour la validation croisée, ou None. Les augmentations d'un même patch
+    doivent être dans le même groupe (ex : indices // 4 pour un AugmentedDataset), sinon le score d'un patch est
+    calculé par un modèle entraîné sur ses retournements.
+    :return: CascadeStage.
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    if classifier is None:
+        classifier = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, class_weight="balanced"))
+
+    scores = np.empty(len(y))
+    folds = GroupKFold(CV_FOLDS).split(X, y, groups) if groups is not None else StratifiedKFold(CV_FOLDS).split(X, y)
+    for train, test in folds:
+        scores[test] = stage_scores(clone(classifier).fit(X[train], y[train]), X[test])
+    classifier.fit(X, y)
+
+    threshold = np.quantile(scores[y == 1], 1 - recall, method="lower")
+    stage = CascadeStage(classifier, threshold, features_func, name)
+    print(
+        f"Étape {stage.name} : seuil {threshold:.4f}, {100 * np.mean(scores[y == 1] >= threshold):.1f} % des positifs gardés, "
+        f"{100 * np.mean(scores[y == 0] < threshold):.1f} % des négatifs rejetés (validation croisée)"
+    )
+    return stage
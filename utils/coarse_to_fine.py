@@ -0,0 +1,126 @@
+"""
+Recherche "coarse-to-fine" de detect_ecocup (search="coarse_to_fine").
+
+Le balayage exhaustif teste toutes les formes (h, w) de la grille scales_nb x ratios_nb à toutes les positions (pas
+px_step), alors que la plupart des fenêtres tombent sur du fond. La recherche se fait ici en deux temps :
+1. balayage grossier : une échelle et un ratio sur grid_factor de la grille (plus les derniers), pas
+   px_step * step_factor, toute l'image ; les fenêtres au-dessus de promising_threshold (plus bas que
+   confidence_threshold) sont "prometteuses" ;
+2. affinage : pour chaque fenêtre prometteuse, les formes voisines de la grille complète (à moins de grid_factor
+   indices d'échelle et de ratio) sont testées au pas px_step, dans une région de l'image autour de la fenêtre
+   (positions à moins d'un demi-pas grossier, celles que le balayage grossier a sautées). Les régions qui se
+   recouvrent assez sont fusionnées (voir merge_regions).
+Les régions sont alignées sur la grille de positions du balayage exhaustif : les fenêtres affinées sont des fenêtres
+du balayage exhaustif (en mode "window"). Pour une forme du balayage grossier, les positions de la grille grossière
+(déjà évaluées) ne sont pas réévaluées par l'affinage (voir coarse_positions_mask).
+"""
+
+import numpy as np
+
+PROMISING_THRESHOLD = 0.2   # score minimal d'une fenêtre du balayage grossier pour être affinée
+COARSE_STEP_FACTOR = 2      # pas du balayage grossier : px_step * COARSE_STEP_FACTOR
+COARSE_GRID_FACTOR = 2      # balayage grossier sur une échelle et un ratio sur COARSE_GRID_FACTOR
+
+
+def get_search_params(search_params=None):
+    """
+    Complète les paramètres de la recherche coarse-to-fine donnés avec les valeurs par défaut.
+    """
+    params = {
+        "promising_threshold": PROMISING_THRESHOLD,
+        "step_factor": COARSE_STEP_FACTOR,
+        "grid_factor": COARSE_GRID_FACTOR,
+    }
+    if search_params:
+        params.update(search_params)
+    return params
+
+
+def coarse_indices(n, grid_factor):
+    """
+    Indices gardés par le balayage grossier sur un axe de n valeurs : un sur grid_factor, et le dernier.
+    """
+    return sorted(set(range(0, n, grid_factor)) | {n - 1})
+
+
+def coarse_grid(scales_nb, ratios_nb, grid_factor):
+    """
+    Itérations du balayage grossier, en indices de la grille complète de detect_ecocup (ratio r, échelle s : indice
+    r * scales_nb + s).
+    """
+    return [
+        r * scales_nb + s for r in coarse_indices(ratios_nb, grid_factor) for s in coarse_indices(scales_nb, grid_factor)
+    ]
+
+
+def neighbour_iterations(index, scales_nb, ratios_nb, grid_factor):
+    """
+    Itérations de la grille complète voisines d'une itération du balayage grossier : indices d'échelle et de ratio à
+    moins de grid_factor (toutes les formes entre deux formes voisines du balayage grossier).
+    """
+    r, s = divmod(index, scales_nb)
+    ratios = range(max(0, r - grid_factor + 1), min(ratios_nb, r + grid_factor))
+    scales = range(max(0, s - grid_factor + 1), min(scales_nb, s + grid_factor))
+    return [r2 * scales_nb + s2 for r2 in ratios for s2 in scales]
+
+
+def refinement_region(window, h, w, img_shape, px_step, radius):
+    """
+    Région de l'image où chercher les fenêtres (h, w) et (w, h) dont le centre est à moins de radius (en hauteur et
+    en largeur) de celui de window. Son coin supérieur gauche est un multiple de px_step (grille du balayage
+    exhaustif).
+    :param window: Coordonnées (upper_left_x, upper_left_y, lower_right_x, lower_right_y) de la fenêtre prometteuse.
+    :return: Région (x0, y0, x1, y1).
+    """
+    center_x = (window[0] + window[2]) / 2
+    center_y = (window[1] + window[3]) / 2
+    half = max(h, w) / 2 + radius
+    x0 = max(0, int(center_x - half) // px_step * px_step)
+    y0 = max(0, int(center_y - half) // px_step * px_step)
+    x1 = min(img_shape[0], int(np.ceil(center_x + half)))
+    y1 = min(img_shape[1], int(np.ceil(center_y + half)))
+    return x0, y0, x1, y1
+
+
+def coarse_positions_mask(windows_coords, coarse_step, offset):
+    """
+    Fenêtres dont le coin supérieur gauche, dans l'image, est sur la grille du balayage grossier (multiple de
+    coarse_step) : pour une forme du balayage grossier, elles ont déjà été évaluées par lui.
+    :param windows_coords: Coordonnées (n, 4) dans la région.
+    :param offset: Coin supérieur gauche (x0, y0) de la région dans l'image.
+    :return: Masque booléen (n,).
+    """
+    x = windows_coords[:, 0] + offset[0]
+    y = windows_coords[:, 1] + offset[1]
+    return (x % coarse_step == 0) & (y % coarse_step == 0)
+
+
+def region_area(region):
+    return (region[2] - region[0]) * (region[3] - region[1])
+
+
+def merge_regions(regions):
+    """
+    Fusionne les régions tant que la boîte englobante de deux régions n'est pas plus grande que leurs deux surfaces
+    réunies : elle ne fait alors évaluer aucune fenêtre de plus que les deux régions séparées, et évite d'évaluer
+    deux fois leur intersection. Les régions qui ne se recouvrent que peu restent séparées (fusionnées, elles
+    feraient évaluer toute leur boîte englobante).
+    :param regions: Liste de (x0, y0, x1, y1).
+    :return: Liste de (x0, y0, x1, y1).
+    """
+    merged = []
+    for region in sorted(set(regions)):
+        changed = True
+        while changed:
+            changed = False
+            for other in merged:
+                union = (
+                    min(region[0], other[0]), min(region[1], other[1]), max(region[2], other[2]), max(region[3], other[3])
+                )
+                if region_area(union) <= region_area(region) + region_area(other):
+                    merged.remove(other)
+                    region = union
+                    changed = True
+                    break
+        merged.append(region)
+    return merged
@@ -1,16 +1,88 @@
-from skimage.util import img_as_float
-from skimage.transform import resize
-from skimage.color import rgb2gray
+"""
+Détection des ecocups par fenêtre glissante.
+
+Les dépendances lourdes (skimage, scipy, sklearn via les modes "hog_pyramid" et "linear", le normalizer et la lecture
+de target_shape.txt) ne sont importées qu'à leur première utilisation : importer ce module ne coûte presque que numpy,
+ce qui compte pour les workers d'inférence de courte durée (voir benchmarks/bench_import.py).
+"""
+
 import numpy as np
 
 import time
 import importlib
-from functools import partial
+from collections import deque
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils.coarse_to_fine import (
+    coarse_grid, coarse_positions_mask, get_search_params, merge_regions, neighbour_iterations, refinement_region,
+)
+from utils.integral import IntegralImage
+from utils.parallel import EXECUTORS, attach_shared, get_n_jobs, release_shared, share_array
 
 module_name = "local_data.4_normalized_patches.normalizer"
-normalizer = importlib.import_module(module_name)
-target_shape = normalizer.get_target_shape()
-normalize_patch = partial(normalizer.normalize_patch, target_shape)
+
+
+def get_normalizer():
+    """
+    Module du normalizer, importé au premier appel.
+    """
+    return importlib.import_module(module_name)
+
+
+@lru_cache(maxsize=None)
+def get_target_shape():
+    """
+    Shape des patchs normalisés utilisée par défaut par la détection : celle de target_shape.txt (lue une seule fois).
+    Pour un autre classifieur, passer target_shape à detect_ecocup (voir utils.model_bundle).
+    """
+    return tuple(int(n) for n in get_normalizer().get_target_shape())
+
+
+def normalize_patch(patch, target_shape=None):
+    # target_shape : shape des patchs normalisés (par défaut get_target_shape())
+    return get_normalizer().normalize_patch(_resolve_target_shape(target_shape), patch)
+
+
+def normalize_patches(stack, target_shape=None):
+    return get_normalizer().normalize_patches(_resolve_target_shape(target_shape), stack)
+
+
+def _resolve_target_shape(target_shape):
+    return get_target_shape() if target_shape is None else tuple(int(n) for n in target_shape)
+
+
+def __getattr__(name):
+    # Anciens attributs du module, calculés à la demande
+    if name == "target_shape":
+        return get_target_shape()
+    if name == "normalizer":
+        return get_normalizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+FLOAT_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+
+def preprocess_image(img, dtype=np.float64):
+    """
+    Étape de prétraitement de la détection : conversion unique de l'image en niveaux de gris flottants,
+    plutôt qu'une conversion par fenêtre découpée.
+    :param img: Image (2D niveaux de gris, ou 3D RGB), entière ou flottante.
+    :param dtype: np.float32 ou np.float64, type flottant de toute la chaîne de détection.
+    :return: Image 2D de type dtype, dans [0, 1] (pas de copie si elle l'est déjà).
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in FLOAT_DTYPES:
+        raise ValueError(f"Type flottant non supporté : {dtype} (possibles : float32, float64)")
+
+    from skimage.color import rgb2gray
+    from skimage.util import img_as_float32, img_as_float64
+
+    # Conversion en flottant avant rgb2gray, pour que la conversion de couleur se fasse déjà dans le bon type
+    img = img_as_float32(img) if dtype == np.float32 else img_as_float64(img)
+    if img.ndim == 3:
+        img = rgb2gray(img)
+    return img
 
 
 def sliding_window(img, h, w, x_step, y_step):
@@ -37,6 +109,45 @@ def sliding_window(img, h, w, x_step, y_step):
     return img_parts, parts_coords
 
 
+def strided_sliding_window(img, h, w, x_step, y_step):
+    """
+    Version sans copie de sliding_window : les fenêtres sont des vues (stride tricks) sur l'image.
+    Aucune liste Python n'est construite, le coût en allocations ne dépend pas du nombre de fenêtres.
+    :param img: Image (2D, ou 3D avec les canaux en dernier) sur laquelle appliquer la fenêtre glissante.
+    :param h: Hauteur de la fenêtre.
+    :param w: Largeur de la fenêtre.
+    :param x_step: Pas de la fenêtre en hauteur.
+    :param y_step: Pas de la fenêtre en largeur.
+    :return: Vue en lecture seule de forme (n_x, n_y, h, w[, canaux]) des fenêtres, et array int32 (n_x * n_y, 4)
+    des coordonnées (upper_left_x, upper_left_y, lower_right_x, lower_right_y), dans l'ordre de parcours de sliding_window.
+    Les fenêtres ne peuvent pas être aplaties en (n_windows, h, w) sans copie (la grille n'est pas régulière en mémoire),
+    on garde donc la grille 2D des positions : windows[i, j] correspond à coords[i * n_y + j].
+    """
+    h = int(h)
+    w = int(w)
+    x_starts = np.arange(0, img.shape[0] - h + 1, x_step, dtype=np.int32)
+    y_starts = np.arange(0, img.shape[1] - w + 1, y_step, dtype=np.int32)
+
+    if len(x_starts) == 0 or len(y_starts) == 0:
+        windows = np.empty((0, 0, h, w) + img.shape[2:], dtype=img.dtype)
+        return windows, np.empty((0, 4), dtype=np.int32)
+
+    # (H - h + 1, W - w + 1, [canaux,] h, w) puis sous-échantillonnage selon le pas : toujours une vue
+    windows = np.lib.stride_tricks.sliding_window_view(img, (h, w), axis=(0, 1))
+    windows = windows[::x_step, ::y_step]
+    if img.ndim == 3:
+        windows = np.moveaxis(windows, 2, -1)
+
+    # Coordonnées dans le même ordre que le parcours ligne par ligne de la grille
+    upper_left_x, upper_left_y = np.meshgrid(x_starts, y_starts, indexing="ij")
+    coords = np.empty((upper_left_x.size, 4), dtype=np.int32)
+    coords[:, 0] = upper_left_x.ravel()
+    coords[:, 1] = upper_left_y.ravel()
+    coords[:, 2] = coords[:, 0] + h
+    coords[:, 3] = coords[:, 1] + w
+    return windows, coords
+
+
 def get_iou(window1, window2):
     """
     Cet algorithme permet de calculer l'Intersection over Union (IoU), soit aire de recouvrement, entre deux fenetres.
@@ -75,6 +186,63 @@ def get_iou(window1, window2):
     return inter_area / union_area if union_area > 0 else 0
 
 
+def get_iou_batch(window, windows):
+    """
+    Version vectorisée de get_iou : IoU entre une fenetre et N fenetres.
+    :param window: Fenetre de référence. Format (upper_left_x, upper_left_y, lower_right_x, lower_right_y) ou ((upper_left), (lower_right)).
+    :param windows: Array (N, 4) (ou (N, 2, 2)) des fenetres à comparer.
+    :return: Array (N,) des IoU.
+    """
+    window = np.asarray(window).reshape(4)
+    windows = np.asarray(windows).reshape(-1, 4)
+    return get_iou_matrix(window[None, :], windows)[0]
+
+
+def get_iou_matrix(windows_a, windows_b):
+    """
+    IoU deux à deux entre deux ensembles de fenetres, mêmes conventions que get_iou.
+    :param windows_a: Array (N, 4) (ou (N, 2, 2)) de fenetres.
+    :param windows_b: Array (M, 4) (ou (M, 2, 2)) de fenetres.
+    :return: Array (N, M) des IoU.
+    """
+    windows_a = np.asarray(windows_a, dtype=np.float64).reshape(-1, 4)
+    windows_b = np.asarray(windows_b, dtype=np.float64).reshape(-1, 4)
+
+    areas_a = (windows_a[:, 2] - windows_a[:, 0]) * (windows_a[:, 3] - windows_a[:, 1])
+    areas_b = (windows_b[:, 2] - windows_b[:, 0]) * (windows_b[:, 3] - windows_b[:, 1])
+
+    inter_width = np.maximum(
+        0, np.minimum(windows_a[:, None, 2], windows_b[None, :, 2]) - np.maximum(windows_a[:, None, 0], windows_b[None, :, 0])
+    )
+    inter_height = np.maximum(
+        0, np.minimum(windows_a[:, None, 3], windows_b[None, :, 3]) - np.maximum(windows_a[:, None, 1], windows_b[None, :, 1])
+    )
+
+    inter_area = inter_height * inter_width
+    union_area = areas_a[:, None] + areas_b[None, :] - inter_area
+
+    iou = np.zeros_like(union_area)
+    np.divide(inter_area, union_area, out=iou, where=union_area > 0)
+    return iou
+
+
+def window_recall(reference_windows, windows, iou_threshold=0.5):
+    """
+    Fraction des fenetres de référence retrouvées : recouvertes par au moins une fenetre avec une IoU >= iou_threshold.
+    Par exemple les annotations d'une image, ou les détections (après NMS) du balayage exhaustif pour mesurer la
+    recherche coarse-to-fine sur des images sans annotations.
+    :param reference_windows: Array (N, 4) (ou (N, 2, 2)) des fenetres à retrouver.
+    :param windows: Array (M, 4) (ou (M, 2, 2)) des fenetres trouvées.
+    :return: (nombre de fenetres de référence retrouvées, N).
+    """
+    reference_windows = np.asarray(reference_windows).reshape(-1, 4)
+    windows = np.asarray(windows).reshape(-1, 4)
+    if len(reference_windows) == 0 or len(windows) == 0:
+        return 0, len(reference_windows)
+    found = get_iou_matrix(reference_windows, windows).max(axis=1) >= iou_threshold
+    return int(found.sum()), len(reference_windows)
+
+
 # def group_windows_by_iou(windows_list, decision_criteria=0.5):
 #     """
 #     Cet algorithme permet de grouper les fenetres qui se recouvrent en fonction de l'Intersection over Union (IoU).
@@ -123,9 +291,16 @@ def non_maxima_suppression_v2(
 ):
     """
     Cet algorithme permet de supprimer les fenetres qui se recouvrent trop, en gardant la fenetre avec le score le plus haut.
+    Les IoU sont calculées par get_iou_batch (une fenetre contre toutes les candidates restantes à chaque tour).
+    :param windows_list: Array (N, 2, 2) (format ((upper_left), (lower_right))) ou (N, 4) des fenetres.
+    :param scores: Array (N,) des scores de confiance.
+    :param iou_decision_criteria: Seuil d'IoU à partir duquel une fenetre est supprimée.
+    :param score_decision_criteria: Score minimal pour qu'une fenetre soit considérée.
+    :param output_score: Si True, retourne aussi les scores des fenetres gardées.
+    :return: Liste des fenetres gardées (et liste de leurs scores si output_score).
     """
-    best_windows = []
-    best_scores = []
+    windows_list = np.asarray(windows_list)
+    scores = np.asarray(scores)
 
     # Filtrer les fenetres par rapprort au seuil de score
     valid_indices = np.where(scores >= score_decision_criteria)[0]
@@ -137,106 +312,316 @@ def non_maxima_suppression_v2(
     windows_list = windows_list[order]
     scores = scores[order]
 
-    while len(windows_list) > 0:
-        best_window = windows_list[0]
-        best_windows.append(best_window)
-        best_scores.append(scores[0])
+    boxes = windows_list.reshape(-1, 4)
+    remaining = np.arange(len(boxes))
+    keep = []
 
-        # Supprimer la meilleure fenetre de la liste
-        windows_list = windows_list[1:]
-        scores = scores[1:]
+    while len(remaining) > 0:
+        best = remaining[0]
+        keep.append(best)
+        remaining = remaining[1:]
 
         # Supprimer les fenetres qui se recouvrent trop avec la meilleure fenetre
-        iou_scores = np.array([get_iou(best_window, window) for window in windows_list])
-        valid_indices = np.where(iou_scores < iou_decision_criteria)[0]
-        windows_list = windows_list[valid_indices]
-        scores = scores[valid_indices]
-    
+        iou_scores = get_iou_batch(boxes[best], boxes[remaining])
+        remaining = remaining[iou_scores < iou_decision_criteria]
+
+    best_windows = list(windows_list[keep])
+    best_scores = list(scores[keep])
+
+    if output_score:
+        return best_windows, best_scores
+
+    return best_windows
+
+
+def non_maxima_suppression_grid(
+    windows_list, scores, iou_decision_criteria=0.5, score_decision_criteria=0.5, output_score=False
+):
+    """
+    Même algorithme (et même résultat) que non_maxima_suppression_v2, mais chaque fenetre gardée n'est comparée
+    qu'aux fenetres voisines, retrouvées grâce à un index spatial en grille.
+    Les fenetres sont rangées par classe de taille (puissance de 2 de leur plus grand côté) : pour chaque classe,
+    une grille uniforme de cellules de cette taille, chaque fenetre étant placée dans la cellule de son coin supérieur gauche.
+    Une fenetre ne peut alors recouvrir une autre que si elle est dans les cellules voisines de celle-ci.
+    Le temps d'exécution devient quasi linéaire en nombre de fenetres candidates.
+    :param windows_list: Array (N, 2, 2) (format ((upper_left), (lower_right))) ou (N, 4) des fenetres.
+    :param scores: Array (N,) des scores de confiance.
+    :param iou_decision_criteria: Seuil d'IoU à partir duquel une fenetre est supprimée.
+    :param score_decision_criteria: Score minimal pour qu'une fenetre soit considérée.
+    :param output_score: Si True, retourne aussi les scores des fenetres gardées.
+    :return: Liste des fenetres gardées (et liste de leurs scores si output_score).
+    """
+    if iou_decision_criteria <= 0:
+        # Toute paire de fenetres (même disjointes) dépasse le seuil : l'index spatial ne sert à rien
+        return non_maxima_suppression_v2(
+            windows_list, scores, iou_decision_criteria, score_decision_criteria, output_score
+        )
+
+    windows_list = np.asarray(windows_list)
+    scores = np.asarray(scores)
+
+    # Filtrer les fenetres par rapprort au seuil de score
+    valid_indices = np.where(scores >= score_decision_criteria)[0]
+    windows_list = windows_list[valid_indices]
+    scores = scores[valid_indices]
+
+    # Ordonner les fenetres par score
+    order = np.argsort(scores)[::-1]
+    windows_list = windows_list[order]
+    scores = scores[order]
+
+    boxes = windows_list.reshape(-1, 4).astype(np.float64)
+    grid = _build_windows_grid(boxes)
+
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for best in range(len(boxes)):
+        if suppressed[best]:
+            continue
+        keep.append(best)
+
+        # Seules les fenetres moins bien classées et pas encore supprimées sont comparées
+        neighbours = _query_windows_grid(grid, boxes[best])
+        neighbours = neighbours[neighbours > best]
+        neighbours = neighbours[~suppressed[neighbours]]
+
+        iou_scores = get_iou_batch(boxes[best], boxes[neighbours])
+        suppressed[neighbours[iou_scores >= iou_decision_criteria]] = True
+
+    best_windows = list(windows_list[keep])
+    best_scores = list(scores[keep])
+
     if output_score:
         return best_windows, best_scores
-    
+
     return best_windows
 
 
+def _build_windows_grid(boxes):
+    """
+    Construit l'index spatial de non_maxima_suppression_grid.
+    :param boxes: Array (N, 4) des fenetres.
+    :return: Dictionnaire {taille de cellule: {(cellule_x, cellule_y): array des indices des fenetres}}.
+    """
+    if len(boxes) == 0:
+        return {}
+
+    extents = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    # Taille de cellule : plus petite puissance de 2 supérieure ou égale au plus grand côté de la fenetre
+    levels = np.ceil(np.log2(np.maximum(extents, 1))).astype(np.int64)
+    cell_sizes = 2.0 ** levels
+    cells_x = np.floor(boxes[:, 0] / cell_sizes).astype(np.int64)
+    cells_y = np.floor(boxes[:, 1] / cell_sizes).astype(np.int64)
+
+    # Tri par (niveau, cellule) puis découpage en groupes contigus
+    sort_idx = np.lexsort((cells_y, cells_x, levels))
+    keys = np.stack([levels[sort_idx], cells_x[sort_idx], cells_y[sort_idx]], axis=1)
+    group_starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    groups = np.split(sort_idx, group_starts)
+    starts = np.concatenate([[0], group_starts])
+
+    grid = {}
+    for start, group in zip(starts, groups):
+        level, cell_x, cell_y = keys[start]
+        grid.setdefault(2.0 ** level, {})[(int(cell_x), int(cell_y))] = group
+    return grid
+
+
+def _query_windows_grid(grid, box):
+    """
+    Retourne les indices de toutes les fenetres de l'index qui peuvent intersecter box.
+    """
+    found = []
+    for cell_size, cells in grid.items():
+        # Une fenetre de cette classe intersecte box seulement si son coin supérieur gauche
+        # est à moins d'une cellule avant box (son côté est plus petit que la cellule)
+        first_x = int(np.floor(box[0] / cell_size)) - 1
+        last_x = int(np.floor(box[2] / cell_size))
+        first_y = int(np.floor(box[1] / cell_size)) - 1
+        last_y = int(np.floor(box[3] / cell_size))
+        for cell_x in range(first_x, last_x + 1):
+            for cell_y in range(first_y, last_y + 1):
+                group = cells.get((cell_x, cell_y))
+                if group is not None:
+                    found.append(group)
+    if not found:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(found)
+
+
 # ------------------ FONCTION PRINCIPALE DE DETECTION ------------------#
 # Fonction à tuner
 
 
-from skimage.transform import resize
-from skimage.util import img_as_float
-import numpy as np
+DETECTION_MODES = ("window", "hog_pyramid", "linear")
+SEARCH_MODES = ("exhaustive", "coarse_to_fine")
+PREDICT_BATCH_SIZE = 256  # fenêtres par appel au classifieur dans detect_batch : assez pour amortir le coût fixe d'un
+                          # appel (~0.3 ms), assez peu pour que les features restent en cache (256 x 7938 float64)
 
 
-def detect_ecocup(img, classifier, features_func, min_ratio, max_ratio, min_scale, max_scale, px_step, scales_nb, ratios_nb, confidence_threshold):
+def detect_ecocup(
+    img,
+    classifier,
+    features_func,
+    min_ratio,
+    max_ratio,
+    min_scale,
+    max_scale,
+    px_step,
+    scales_nb,
+    ratios_nb,
+    confidence_threshold,
+    mode="window",
+    hog_params=None,
+    executor=None,
+    n_jobs=None,
+    batch_size=None,
+    dtype=np.float64,
+    pyramid=False,
+    cascade=None,
+    prefilter=None,
+    search="exhaustive",
+    search_params=None,
+    target_shape=None,
+    exact=False,
+):
     """
     Détecte les gobelets en plastique dans une image à l'aide d'un classifieur et d'une fenêtre glissante.
     :param img: Image sur laquelle appliquer la détection.
     :param classifier: Classificateur entraîné.
-    :param img_target_shape: Shape cible pour la classification.
+    :param features_func: Fonction d'extraction des features sur une liste de patchs normalisés (mode "window").
+    :param mode: "window" : chaque fenêtre est découpée, normalisée puis passée à features_func.
+    "hog_pyramid" : l'image est redimensionnée une fois par échelle et son HOG calculé une seule fois,
+    les descripteurs des fenêtres en sont des tranches (voir utils.hog_pyramid). features_func n'est pas utilisée.
+    "linear" : comme "hog_pyramid", mais pour un classifieur linéaire (LogisticRegression, éventuellement après un
+    StandardScaler) : les scores de toutes les fenêtres d'une échelle sont la corrélation des poids avec la grille HOG,
+    en un seul appel (voir utils.linear_detector), sans descripteurs par fenêtre ni predict_proba. features_func,
+    batch_size et cascade ne sont pas utilisés.
+    :param hog_params: Paramètres de skimage.feature.hog utilisés à l'entraînement (modes "hog_pyramid" et "linear").
+    :param executor: None (séquentiel), "thread" ou "process" : les itérations (h, w) sont réparties sur un pool
+    de n_jobs workers. En "process", l'image est transmise une seule fois par mémoire partagée, et classifier et
+    features_func une seule fois par worker (ils doivent être picklables si le start method n'est pas fork).
+    Les résultats sont fusionnés dans l'ordre des itérations, ils sont donc identiques au mode séquentiel.
+    :param n_jobs: Nombre de workers (par défaut, le nombre de coeurs).
+    :param batch_size: Si donné, les fenêtres de chaque itération sont traitées par lots d'au plus batch_size
+    (normalisation et features dans des buffers préalloués, prédiction, seuil) au lieu d'être toutes matérialisées :
+    le pic mémoire dépend alors de batch_size et non plus de la taille de l'image.
+    :param dtype: Type flottant de la chaîne de détection (np.float64 par défaut, ou np.float32) : l'image est
+    convertie une seule fois en niveaux de gris de ce type (preprocess_image), et la normalisation, les features
+    et l'entrée du classifieur restent dans ce type (features_func doit conserver le type de ses patchs, comme hog).
+    :param pyramid: Mode "window" : si True, les fenêtres sont découpées dans une pyramide d'images (utils.pyramid),
+    construite une fois par image et mise en cache (les balayages de paramètres successifs sur une même image la
+    réutilisent). Une ImagePyramid déjà construite sur l'image prétraitée peut aussi être donnée.
+    :param cascade: utils.cascade.Cascade : étapes peu coûteuses qui rejettent la plupart des fenêtres avant
+    features_func et classifier (probabilité 0 pour les fenêtres rejetées). Le taux de rejet et le temps de chaque
+    étape sont affichés à la fin.
+    :param prefilter: utils.integral.WindowPrefilter : les fenêtres plates ou sans texture sont rejetées à partir des
+    images intégrales de l'image (construites une fois, en temps constant par fenêtre), avant toute découpe,
+    normalisation ou extraction de features. Le taux de rejet est affiché à la fin.
+    :param search: "exhaustive" : toutes les formes (h, w) de la grille scales_nb x ratios_nb à toutes les positions.
+    "coarse_to_fine" : balayage grossier (grille de formes clairsemée, grand pas) puis affinage autour des seules
+    fenêtres prometteuses (voir utils.coarse_to_fine). L'executor ne s'applique qu'au balayage grossier, le
+    préfiltre et la pyramide aussi (l'affinage se fait sur des régions de l'image).
+    :param search_params: Paramètres de la recherche coarse-to-fine (voir get_search_params).
+    Le nombre de fenêtres évaluées est affiché à la fin, quelle que soit la recherche.
+    :param target_shape: Shape des patchs normalisés de l'entraînement du classifieur (par défaut get_target_shape()).
+    :param exact: Mode "window" : si True, chaque fenêtre est normalisée par normalize_patch (resize de skimage, calcul
+    historique, fenêtre par fenêtre). Par défaut, les fenêtres de même forme sont normalisées en un seul produit
+    matriciel (normalize_patches) : même opération, mais les arrondis flottants diffèrent et une fenêtre dont le
+    score est tout près de confidence_threshold peut passer d'un côté à l'autre du seuil (voir
+    benchmarks/bench_exact_normalize.py pour l'écart mesuré avec un vrai classifieur).
     :return: Liste des coordonnées des gobelets détectés.
     """
+    if mode not in DETECTION_MODES:
+        raise ValueError(f"Mode de détection inconnu : {mode} (possibles : {DETECTION_MODES})")
+    if executor is not None and executor not in EXECUTORS:
+        raise ValueError(f"Executor inconnu : {executor} (possibles : {EXECUTORS})")
+    if search not in SEARCH_MODES:
+        raise ValueError(f"Recherche inconnue : {search} (possibles : {SEARCH_MODES})")
+    if mode == "linear" and cascade is not None:
+        raise ValueError("Le mode \"linear\" n'a pas de cascade : le classifieur linéaire est déjà une étape peu coûteuse")
 
     start = time.time()
     global_start = start
+    target_shape = _resolve_target_shape(target_shape)
 
-    # Générations des limites de fenêtres à tester
-    ratios = np.linspace(min_ratio, max_ratio, ratios_nb)
-    scales = np.linspace(min_scale, max_scale, scales_nb)
+    img = preprocess_image(img, dtype)
+    if pyramid is True:
+        from utils.pyramid import get_pyramid
 
-    # Croisement des couples
-    ratios, scales = np.meshgrid(ratios,scales, indexing="ij")
+        start_pyramid = time.time()
+        pyramid = get_pyramid(img)
+        print(f"Pyramide : {len(pyramid)} niveaux ({time.time() - start_pyramid} s)")
+    elif pyramid is False:
+        pyramid = None
+    template = _linear_template(classifier, hog_params, target_shape) if mode == "linear" else None
+    integral = None
+    if prefilter is not None:
+        start_integral = time.time()
+        integral = IntegralImage(img)
+        print(f"Images intégrales : {time.time() - start_integral} s")
+
+    heights, widths = window_shapes(min_ratio, max_ratio, min_scale, max_scale, scales_nb, ratios_nb)
 
-    ratios = ratios.flatten()
-    heights = scales.flatten().astype("uint16")
-    widths = (ratios*heights).astype("uint16")
-    
     all_windows = []
     all_scores = []
 
+    iteration_params = {
+        "classifier": classifier,
+        "features_func": features_func,
+        "px_step": px_step,
+        "confidence_threshold": confidence_threshold,
+        "mode": mode,
+        "hog_params": hog_params,
+        "batch_size": batch_size,
+        "dtype": np.dtype(dtype),
+        "pyramid": pyramid,
+        "cascade": cascade,
+        "prefilter": prefilter,
+        "integral": integral,
+        "template": template,
+        "target_shape": target_shape,
+        "exact": exact,
+    }
+
     print(f"Temps setup : {time.time() - start}")
     print(f"Nombre d'itérations : {scales_nb * ratios_nb}")
-    for i in range(scales_nb * ratios_nb):
-        h = heights[i]
-        w = widths[i]
-        print(f"\n\tItération {i+1} : h={h:04d} | w={w:04d}")
-
-        start = time.time()        
-        img_parts, windows_coords = sliding_window(img, h, w, px_step, px_step)
-        # Même chose avec le rectangle retourné
-        img_parts_2, windows_coords_2 = sliding_window(img, w, h, px_step, px_step)
-
-        img_parts = (img_parts + img_parts_2)
-        windows_coords = np.array(windows_coords + windows_coords_2)
-        print(f"\tTemps sliding_window x2 ({len(img_parts)} généré): {time.time() - start}")
-
-        if len(img_parts) == 0:
-            print(f"\tAbandon de l'itération")
-            continue
+    if search == "coarse_to_fine":
+        results = _coarse_to_fine_iterations(
+            img, heights, widths, scales_nb, ratios_nb, iteration_params, get_search_params(search_params),
+            executor, n_jobs,
+        )
+    elif executor is None:
+        results = (
+            _detect_iteration(img, heights[i], widths[i], **iteration_params) for i in range(scales_nb * ratios_nb)
+        )
+    else:
+        print(f"Répartition sur {get_n_jobs(n_jobs)} workers ({executor})")
+        results = _parallel_iterations(img, heights, widths, iteration_params, executor, n_jobs)
 
-        start = time.time()
-        normalized_parts = [
-            normalize_patch(img_part) for img_part in img_parts
-        ]
-        print(f"\tTemps de traitement pour {len(img_parts)} : {time.time() - start}")
-
-        start = time.time()
-        features = features_func(normalized_parts) # np.array
-        print(f"\tTemps d'extraction de features pour {len(img_parts)} : {time.time() - start}")
-
-        start = time.time()
-        # preds = classifier.predict(features) # pour moi inutile si on calcule déjà les probas ?
-        probas = classifier.predict_proba(features)[:, 1]  # proba classe "gobelet" # np.array
-        print(f"\tTemps de prédiction pour {len(img_parts)} : {time.time() - start}")
+    # Fusion dans l'ordre des itérations (les executors rendent les résultats dans l'ordre de soumission)
+    stats = _new_stats(cascade, prefilter)
+    n_evaluated = 0
+    for i, (kept_coords, kept_scores, n_windows, best, iteration_stats) in enumerate(results):
+        for key in iteration_stats:
+            stats[key] += iteration_stats[key]
+        n_evaluated += n_windows
+        if n_windows == 0 or best is None:
+            continue
 
-        keep_idx = np.where(probas >= confidence_threshold)[0]
-        all_windows += list(windows_coords[keep_idx])
-        all_scores += list(probas[keep_idx])
-        print(f"\tFenêtres gardées : {len(keep_idx)} sur {len(img_parts)} (p>={confidence_threshold})")
-        if len(probas) > 0:
-            print(f"\tMeilleur score de l'itération : {np.max(probas)} pour {windows_coords[np.argmax(probas)]}")
+        # Format historique ((upper_left), (lower_right)) attendu par non_maxima_suppression_v2
+        all_windows += list(kept_coords.reshape(-1, 2, 2))
+        all_scores += list(kept_scores)
+        print(f"\tItération {i+1} : fenêtres gardées : {len(kept_scores)} sur {n_windows} (p>={confidence_threshold})")
+        print(f"\tMeilleur score de l'itération : {best[0]} pour {best[1].reshape(2, 2)}")
         print(f"\tTemps cumulé : {time.time() - global_start}")
 
     print()
+    print(f"Fenêtres évaluées : {n_evaluated}")
+    if prefilter is not None:
+        prefilter.print_stats(stats["prefilter"])
+    if cascade is not None:
+        cascade.print_stats(stats["cascade"])
     if not all_windows:
         return np.array([]), np.array([])
 
@@ -247,3 +632,666 @@ def detect_ecocup(img, classifier, features_func, min_ratio, max_ratio, min_scal
     print(f"Temps total de détection : {time.time() - global_start}")
 
     return all_windows, all_scores
+
+
+def detect_batch(
+    images,
+    classifier,
+    features_func,
+    min_ratio,
+    max_ratio,
+    min_scale,
+    max_scale,
+    px_step,
+    scales_nb,
+    ratios_nb,
+    confidence_threshold,
+    mode="window",
+    hog_params=None,
+    predict_batch_size=PREDICT_BATCH_SIZE,
+    dtype=np.float64,
+    pyramid=False,
+    cascade=None,
+    prefilter=None,
+    target_shape=None,
+    exact=False,
+):
+    """
+    detect_ecocup sur plusieurs images, avec des appels au classifieur de taille constante : les entrées du
+    classifieur (features, ou patchs normalisés avec une cascade) des itérations successives de toutes les images
+    sont accumulées puis classées par lots de predict_batch_size fenêtres (au lieu d'un appel par itération et par
+    image, de quelques fenêtres à plusieurs milliers), puis les scores sont redistribués par image et par itération.
+    Les petites itérations (grandes fenêtres, petites images) sont regroupées pour amortir le coût fixe de chaque
+    appel, les grandes sont découpées pour que chaque lot reste en cache.
+    Les images sont lues au fur et à mesure (images peut être un générateur, ex : les images d'un dossier) et le
+    résultat d'une image est rendu dès que toutes ses fenêtres sont classées : la mémoire dépend de
+    predict_batch_size, pas du nombre d'images.
+    :param images: Itérable d'images (2D niveaux de gris, ou 3D RGB), entières ou flottantes.
+    :param predict_batch_size: Nombre de fenêtres par appel au classifieur.
+    Les autres paramètres sont ceux de detect_ecocup (sans executor ni batch_size, recherche exhaustive). En mode
+    "linear", il n'y a pas de predict_proba : les images sont traitées l'une après l'autre.
+    :return: Générateur de (fenêtres, scores) par image, dans l'ordre des images, comme le retour de detect_ecocup.
+    """
+    if mode not in DETECTION_MODES:
+        raise ValueError(f"Mode de détection inconnu : {mode} (possibles : {DETECTION_MODES})")
+    if mode == "linear" and cascade is not None:
+        raise ValueError("Le mode \"linear\" n'a pas de cascade : le classifieur linéaire est déjà une étape peu coûteuse")
+
+    global_start = time.time()
+    target_shape = _resolve_target_shape(target_shape)
+    heights, widths = window_shapes(min_ratio, max_ratio, min_scale, max_scale, scales_nb, ratios_nb)
+    template = _linear_template(classifier, hog_params, target_shape) if mode == "linear" else None
+    dtype = np.dtype(dtype)
+    stats = _new_stats(cascade, prefilter)
+    if pyramid:
+        from utils.pyramid import get_pyramid
+
+    unfinished = deque() # images pas encore rendues, dans l'ordre
+    pending = []         # (image, coordonnées, entrées du classifieur) des itérations en attente de predict_proba
+    n_pending = 0
+    n_images = 0
+    n_evaluated = 0
+    n_calls = 0
+    predict_seconds = 0.0
+
+    for img in images:
+        img = preprocess_image(img, dtype)
+        image_pyramid = get_pyramid(img) if pyramid else None
+        integral = IntegralImage(img) if prefilter is not None else None
+        image = {"index": n_images, "windows": [], "scores": [], "n_windows": 0, "pending": 0, "complete": False}
+        unfinished.append(image)
+        n_images += 1
+
+        for h, w in zip(heights, widths):
+            h = int(h)
+            w = int(w)
+            if mode == "linear":
+                kept_coords, kept_scores, n_windows, _, iteration_stats = _linear_iteration(
+                    img, h, w, template, px_step, confidence_threshold, prefilter, integral
+                )
+                for key in iteration_stats:
+                    stats[key] += iteration_stats[key]
+                image["windows"].append(kept_coords)
+                image["scores"].append(kept_scores)
+                image["n_windows"] += n_windows
+                continue
+
+            windows_coords, inputs, n_windows = _iteration_inputs(
+                img, h, w, features_func, px_step, mode, hog_params, image_pyramid, cascade, prefilter, integral, stats,
+                target_shape=target_shape, exact=exact,
+            )
+            image["n_windows"] += n_windows
+            if len(windows_coords) == 0:
+                continue
+            pending.append((image, windows_coords, inputs))
+            image["pending"] += 1
+            n_pending += len(windows_coords)
+
+            if n_pending >= predict_batch_size:
+                start = time.time()
+                n_calls += _predict_pending(
+                    pending, classifier, features_func, confidence_threshold, mode, dtype, cascade, stats,
+                    predict_batch_size,
+                )
+                predict_seconds += time.time() - start
+                pending = []
+                n_pending = 0
+
+        image["complete"] = True
+        n_evaluated += image["n_windows"]
+        while unfinished and unfinished[0]["complete"] and unfinished[0]["pending"] == 0:
+            yield _batch_image_result(unfinished.popleft())
+
+    if pending:
+        start = time.time()
+        n_calls += _predict_pending(
+            pending, classifier, features_func, confidence_threshold, mode, dtype, cascade, stats, predict_batch_size
+        )
+        predict_seconds += time.time() - start
+    while unfinished:
+        yield _batch_image_result(unfinished.popleft())
+
+    seconds = time.time() - global_start
+    print()
+    print(
+        f"Détection par lots : {n_images} images, {n_evaluated} fenêtres en {seconds:.1f} s "
+        f"({n_images / max(seconds, 1e-9):.2f} images/s, {n_evaluated / max(seconds, 1e-9):.0f} fenêtres/s)"
+    )
+    if mode != "linear":
+        print(f"Classifieur : {n_calls} appels, {predict_seconds:.1f} s")
+    if prefilter is not None:
+        prefilter.print_stats(stats["prefilter"])
+    if cascade is not None:
+        cascade.print_stats(stats["cascade"])
+
+
+def _predict_pending(
+    pending, classifier, features_func, confidence_threshold, mode, dtype, cascade, stats, predict_batch_size
+):
+    """
+    Classe les entrées accumulées par detect_batch par lots de predict_batch_size fenêtres et range les fenêtres
+    gardées de chaque itération dans son image. Un lot est une tranche (vue) des entrées d'une itération, ou la
+    concaténation des tranches de plusieurs petites itérations.
+    :param pending: Liste de (image, coordonnées (n, 4), entrées (n, ...)).
+    :return: Nombre d'appels au classifieur.
+    """
+    offsets = np.concatenate([[0], np.cumsum([len(windows_coords) for _, windows_coords, _ in pending])])
+    probas = np.empty(offsets[-1])
+    n_calls = 0
+    for batch_start in range(0, offsets[-1], predict_batch_size):
+        batch_stop = min(batch_start + predict_batch_size, offsets[-1])
+        first = np.searchsorted(offsets, batch_start, side="right") - 1
+        last = np.searchsorted(offsets, batch_stop, side="left")
+        parts = [
+            pending[k][2][max(batch_start, offsets[k]) - offsets[k] : min(batch_stop, offsets[k + 1]) - offsets[k]]
+            for k in range(first, last)
+        ]
+        inputs = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        probas[batch_start:batch_stop] = _predict_proba(classifier, inputs, features_func, mode, dtype, cascade, stats)
+        n_calls += 1
+
+    for (image, windows_coords, _), iteration_probas in zip(pending, np.split(probas, offsets[1:-1])):
+        keep_idx = np.where(iteration_probas >= confidence_threshold)[0]
+        image["windows"].append(windows_coords[keep_idx])
+        image["scores"].append(iteration_probas[keep_idx])
+        image["pending"] -= 1
+    return n_calls
+
+
+def _batch_image_result(image):
+    """
+    Résultat d'une image de detect_batch, au format de detect_ecocup.
+    """
+    n_kept = sum(len(scores) for scores in image["scores"])
+    print(f"Image {image['index']} : fenêtres gardées : {n_kept} sur {image['n_windows']}")
+    if n_kept == 0:
+        return np.array([]), np.array([])
+    # Format historique ((upper_left), (lower_right)) attendu par non_maxima_suppression_v2
+    return np.concatenate(image["windows"]).reshape(-1, 2, 2), np.concatenate(image["scores"])
+
+
+def window_shapes(min_ratio, max_ratio, min_scale, max_scale, scales_nb, ratios_nb):
+    """
+    Formes (h, w) des itérations de detect_ecocup : croisement de ratios_nb ratios et scales_nb échelles
+    (itération r * scales_nb + s pour le ratio r et l'échelle s).
+    :return: Hauteurs et largeurs, arrays uint16 (scales_nb * ratios_nb,).
+    """
+    # Générations des limites de fenêtres à tester
+    ratios = np.linspace(min_ratio, max_ratio, ratios_nb)
+    scales = np.linspace(min_scale, max_scale, scales_nb)
+
+    # Croisement des couples
+    ratios, scales = np.meshgrid(ratios,scales, indexing="ij")
+
+    ratios = ratios.flatten()
+    heights = scales.flatten().astype("uint16")
+    widths = (ratios*heights).astype("uint16")
+    return heights, widths
+
+
+def _coarse_to_fine_iterations(
+    img, heights, widths, scales_nb, ratios_nb, iteration_params, search_params, executor=None, n_jobs=None
+):
+    """
+    Recherche coarse-to-fine (voir utils.coarse_to_fine) : itérations du balayage grossier puis itérations d'affinage
+    (une par forme et par région), mêmes résultats que _detect_iteration avec les coordonnées dans l'image. Une fenêtre
+    n'est évaluée (et rendue) qu'une fois : l'affinage d'une forme du balayage grossier saute ses positions.
+    Seules les fenêtres au-dessus de confidence_threshold sont rendues, celles au-dessus de promising_threshold
+    servant à choisir les régions à affiner.
+    """
+    px_step = iteration_params["px_step"]
+    confidence_threshold = iteration_params["confidence_threshold"]
+    grid_factor = search_params["grid_factor"]
+    coarse_step = px_step * search_params["step_factor"]
+
+    coarse = coarse_grid(scales_nb, ratios_nb, grid_factor)
+    coarse_params = dict(
+        iteration_params, px_step=coarse_step,
+        confidence_threshold=min(confidence_threshold, search_params["promising_threshold"]),
+    )
+    print(f"Balayage grossier : {len(coarse)} itérations sur {scales_nb * ratios_nb}, pas de {coarse_step} px")
+    if executor is None:
+        coarse_results = (_detect_iteration(img, heights[i], widths[i], **coarse_params) for i in coarse)
+    else:
+        coarse_results = _parallel_iterations(img, heights[coarse], widths[coarse], coarse_params, executor, n_jobs)
+
+    regions = {} # itération de la grille complète -> régions à affiner
+    for i, (kept_coords, kept_scores, n_windows, best, stats) in zip(coarse, coarse_results):
+        promising = kept_coords[kept_scores >= search_params["promising_threshold"]]
+        for j in neighbour_iterations(i, scales_nb, ratios_nb, grid_factor):
+            regions.setdefault(j, []).extend(
+                refinement_region(window, heights[j], widths[j], img.shape, px_step, coarse_step / 2) for window in promising
+            )
+        confident = kept_scores >= confidence_threshold
+        yield kept_coords[confident], kept_scores[confident], n_windows, best, stats
+
+    # L'image des régions n'est plus celle des coordonnées de la pyramide et des images intégrales
+    refine_params = dict(iteration_params, pyramid=None, prefilter=None, integral=None)
+    coarse_set = set(coarse)
+    n_regions = 0
+    for j in sorted(regions):
+        for x0, y0, x1, y1 in merge_regions(regions[j]):
+            n_regions += 1
+            skip = partial(coarse_positions_mask, coarse_step=coarse_step, offset=(x0, y0)) if j in coarse_set else None
+            kept_coords, kept_scores, n_windows, best, stats = _detect_iteration(
+                img[x0:x1, y0:y1], heights[j], widths[j], **refine_params, skip=skip
+            )
+            offset = np.array([x0, y0, x0, y0], dtype=np.int32)
+            if best is not None:
+                best = (best[0], best[1] + offset)
+            yield kept_coords + offset, kept_scores, n_windows, best, stats
+    print(f"Affinage : {n_regions} régions, sur {len(regions)} formes de la grille complète")
+
+
+def _new_stats(cascade, prefilter):
+    """
+    Statistiques vides d'une itération (sommées dans detect_ecocup) : "prefilter" et "cascade" s'ils sont utilisés.
+    """
+    stats = {}
+    if prefilter is not None:
+        stats["prefilter"] = prefilter.new_stats()
+    if cascade is not None:
+        stats["cascade"] = cascade.new_stats()
+    return stats
+
+
+def _detect_iteration(
+    img, h, w, classifier, features_func, px_step, confidence_threshold, mode, hog_params, batch_size=None,
+    dtype=np.float64, pyramid=None, cascade=None, prefilter=None, integral=None, template=None, skip=None,
+    target_shape=None, exact=False,
+):
+    """
+    Une itération de detect_ecocup : toutes les fenêtres (h, w) et (w, h) de l'image.
+    Seules les fenêtres au-dessus du seuil sont retournées, pour limiter la mémoire (et les transferts entre processus).
+    :param skip: Fonction (coordonnées (n, 4)) -> masque booléen (n,) des fenêtres à ne pas évaluer (déjà évaluées),
+    ni compter, ou None.
+    :param target_shape: Shape des patchs normalisés (par défaut get_target_shape()).
+    :param exact: Voir detect_ecocup.
+    :return: Coordonnées int32 (n_kept, 4) et scores (n_kept,) des fenêtres gardées, nombre de fenêtres testées,
+    (meilleur score, coordonnées de la meilleure fenêtre, None si toutes ont été rejetées par le préfiltre)
+    et statistiques (voir _new_stats).
+    """
+    h = int(h)
+    w = int(w)
+    print(f"\n\tItération : h={h:04d} | w={w:04d}")
+
+    if mode == "linear":
+        return _linear_iteration(img, h, w, template, px_step, confidence_threshold, prefilter, integral, skip)
+    if batch_size is not None:
+        return _detect_iteration_batches(
+            img, h, w, classifier, features_func, px_step, confidence_threshold, mode, hog_params, batch_size, dtype,
+            pyramid, cascade, prefilter, integral, skip, target_shape, exact,
+        )
+
+    stats = _new_stats(cascade, prefilter)
+    windows_coords, inputs, n_windows = _iteration_inputs(
+        img, h, w, features_func, px_step, mode, hog_params, pyramid, cascade, prefilter, integral, stats, skip,
+        target_shape, exact,
+    )
+
+    if n_windows == 0:
+        print(f"\tAbandon de l'itération")
+        return windows_coords, np.empty(0), 0, None, stats
+    if len(windows_coords) == 0:
+        return windows_coords, np.empty(0), n_windows, None, stats
+
+    start = time.time()
+    probas = _predict_proba(classifier, inputs, features_func, mode, dtype, cascade, stats)
+    print(f"\tTemps de prédiction pour {n_windows} : {time.time() - start}")
+
+    keep_idx = np.where(probas >= confidence_threshold)[0]
+    best_idx = np.argmax(probas)
+    return windows_coords[keep_idx], probas[keep_idx], n_windows, (probas[best_idx], windows_coords[best_idx]), stats
+
+
+def _iteration_inputs(
+    img, h, w, features_func, px_step, mode, hog_params, pyramid=None, cascade=None, prefilter=None, integral=None,
+    stats=None, skip=None, target_shape=None, exact=False,
+):
+    """
+    Fenêtres (h, w) et (w, h) d'une itération et entrées du classifieur : leurs features, ou leurs patchs normalisés
+    si une cascade doit d'abord les filtrer (mode "window", voir _predict_proba).
+    :param stats: Statistiques de l'itération (voir _new_stats), complétées sur place par le préfiltre.
+    :param skip: Voir _detect_iteration.
+    :param target_shape: Shape des patchs normalisés (par défaut get_target_shape()).
+    :param exact: Voir detect_ecocup.
+    :return: Coordonnées int32 (n, 4) et entrées (n, ...) des fenêtres gardées par le préfiltre, et nombre de fenêtres
+    générées (rejetées par le préfiltre ou non, hors fenêtres sautées).
+    """
+    keep = None if prefilter is None else partial(prefilter.filter, integral, stats=stats["prefilter"])
+    if skip is not None:
+        keep = partial(_keep_not_skipped, skip, keep)
+    n_rejected = 0 if prefilter is None else stats["prefilter"][1]
+    if mode == "hog_pyramid":
+        windows_coords, inputs = _hog_pyramid_features(img, h, w, px_step, hog_params, target_shape)
+        if keep is not None and len(windows_coords) > 0:
+            # Le HOG est calculé par échelle sur toute l'image : seul le classifieur est évité
+            mask = keep(windows_coords)
+            windows_coords, inputs = windows_coords[mask], inputs[mask]
+    elif cascade is not None:
+        # Les features ne sont calculées que pour les fenêtres qui passent les étapes de la cascade
+        windows_coords, inputs = _window_patches(img, h, w, px_step, pyramid, keep, target_shape, exact)
+    else:
+        windows_coords, inputs = _window_features(img, h, w, px_step, features_func, pyramid, keep, target_shape, exact)
+    n_windows = len(windows_coords)
+    if prefilter is not None:
+        n_windows += int(stats["prefilter"][1] - n_rejected) # fenêtres générées, rejetées ou non
+    return windows_coords, inputs, n_windows
+
+
+def _keep_not_skipped(skip, keep, windows_coords):
+    """
+    Masque des fenêtres qui ne sont pas sautées (skip) et passent keep (le préfiltre, ou None).
+    """
+    mask = ~skip(windows_coords)
+    if keep is not None and np.any(mask):
+        mask[mask] = keep(windows_coords[mask])
+    return mask
+
+
+def _predict_proba(classifier, inputs, features_func, mode, dtype=np.float64, cascade=None, stats=None):
+    """
+    Probabilités de la classe "gobelet" des fenêtres, à partir des entrées de _iteration_inputs.
+    :param stats: Statistiques (voir _new_stats) complétées sur place par la cascade.
+    :return: Array (n,).
+    """
+    if cascade is None:
+        features = np.asarray(inputs).astype(dtype, copy=False)
+        # preds = classifier.predict(features) # pour moi inutile si on calcule déjà les probas ?
+        return classifier.predict_proba(features)[:, 1]  # proba classe "gobelet" # np.array
+    cascade_stats = None if stats is None else stats["cascade"]
+    if mode == "hog_pyramid":
+        return cascade.predict_proba(classifier, None, inputs, features_func, dtype, cascade_stats)
+    return cascade.predict_proba(classifier, inputs, None, features_func, dtype, cascade_stats)
+
+
+def _linear_template(classifier, hog_params, target_shape=None):
+    from utils.linear_detector import LinearTemplate
+
+    return LinearTemplate(classifier, _resolve_target_shape(target_shape), hog_params)
+
+
+def _linear_iteration(img, h, w, template, px_step, confidence_threshold, prefilter=None, integral=None, skip=None):
+    """
+    Mode "linear" de _detect_iteration : probabilités de toutes les fenêtres par corrélation du gabarit (même retour).
+    """
+    from utils.linear_detector import linear_window_scores_both_orientations
+
+    start = time.time()
+    probas, windows_coords = linear_window_scores_both_orientations(img, h, w, template, px_step)
+    if skip is not None and len(windows_coords) > 0:
+        # La corrélation donne toutes les positions d'un coup : les fenêtres sautées ne sont juste pas rendues
+        mask = ~skip(windows_coords)
+        probas, windows_coords = probas[mask], windows_coords[mask]
+    n_windows = len(windows_coords)
+    print(f"\tTemps de corrélation pour {n_windows} : {time.time() - start}")
+
+    stats = _new_stats(None, prefilter)
+    if prefilter is not None and n_windows > 0:
+        mask = prefilter.filter(integral, windows_coords, stats["prefilter"])
+        probas, windows_coords = probas[mask], windows_coords[mask]
+
+    if n_windows == 0:
+        print(f"\tAbandon de l'itération")
+        return windows_coords, np.empty(0), 0, None, stats
+    if len(windows_coords) == 0:
+        return windows_coords, np.empty(0), n_windows, None, stats
+
+    keep_idx = np.where(probas >= confidence_threshold)[0]
+    best_idx = np.argmax(probas)
+    return windows_coords[keep_idx], probas[keep_idx], n_windows, (probas[best_idx], windows_coords[best_idx]), stats
+
+
+def _detect_iteration_batches(
+    img, h, w, classifier, features_func, px_step, confidence_threshold, mode, hog_params, batch_size,
+    dtype=np.float64, pyramid=None, cascade=None, prefilter=None, integral=None, skip=None, target_shape=None,
+    exact=False,
+):
+    """
+    Version par lots de _detect_iteration : les fenêtres sont générées, normalisées, décrites et classées
+    par lots d'au plus batch_size, dans des buffers alloués une seule fois. Seules les fenêtres au-dessus du seuil
+    sont conservées entre deux lots.
+    """
+    start = time.time()
+    target_shape = _resolve_target_shape(target_shape)
+    if mode == "hog_pyramid":
+        batches = iter_hog_pyramid_batches(img, h, w, px_step, batch_size, hog_params, target_shape)
+    else:
+        batches = iter_window_batches(img, h, w, px_step, batch_size, pyramid, target_shape)
+
+    n_windows = 0
+    kept_coords = []
+    kept_scores = []
+    best = (-np.inf, None)
+    buffer = None
+    stats = _new_stats(cascade, prefilter)
+
+    for batch, batch_coords in batches:
+        if skip is not None:
+            mask = ~skip(batch_coords)
+            batch = [window for window, kept in zip(batch, mask) if kept]
+            batch_coords = batch_coords[mask]
+            if not batch:
+                continue
+        if prefilter is not None:
+            mask = prefilter.filter(integral, batch_coords, stats["prefilter"])
+            n_windows += len(mask) - np.count_nonzero(mask)
+            batch = [window for window, kept in zip(batch, mask) if kept]
+            batch_coords = batch_coords[mask]
+            if not batch:
+                continue
+        n = len(batch)
+        if mode == "hog_pyramid":
+            if buffer is None:
+                buffer = np.empty((batch_size, batch[0].size), dtype=dtype)
+            # Copie de chaque descripteur (vue sur la grille HOG) directement dans le buffer
+            for k, descriptor in enumerate(batch):
+                buffer[k].reshape(descriptor.shape)[...] = descriptor
+            features = buffer[:n]
+        else:
+            if buffer is None:
+                buffer = np.empty((batch_size,) + target_shape, dtype=dtype)
+            # Un lot vient d'une seule grille : toutes ses fenêtres ont la même forme, normalisées en un seul appel
+            buffer[:n] = _normalize_windows(np.stack(batch), target_shape, exact)
+            features = None if cascade is not None else np.asarray(features_func(buffer[:n])).astype(dtype, copy=False)
+
+        if cascade is None:
+            probas = classifier.predict_proba(features)[:, 1]  # proba classe "gobelet"
+        else:
+            patches = buffer[:n] if mode != "hog_pyramid" else None
+            probas = cascade.predict_proba(classifier, patches, features, features_func, dtype, stats["cascade"])
+        n_windows += n
+
+        keep_idx = np.where(probas >= confidence_threshold)[0]
+        kept_coords.append(batch_coords[keep_idx])
+        kept_scores.append(probas[keep_idx])
+        best_idx = np.argmax(probas)
+        if probas[best_idx] > best[0]:
+            best = (probas[best_idx], batch_coords[best_idx])
+
+    print(f"\tTemps de traitement par lots de {batch_size} pour {n_windows} : {time.time() - start}")
+
+    if n_windows == 0:
+        print(f"\tAbandon de l'itération")
+        return np.empty((0, 4), dtype=np.int32), np.empty(0), 0, None, stats
+    if not kept_coords:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0), n_windows, None, stats
+    return np.concatenate(kept_coords), np.concatenate(kept_scores), n_windows, best, stats
+
+
+def iter_window_batches(img, h, w, px_step, batch_size, pyramid=None, target_shape=None):
+    """
+    Parcourt les fenêtres (h, w) puis (w, h) de l'image par lots d'au plus batch_size fenêtres, sans copie.
+    :return: Générateur de couples (liste de vues sur les fenêtres du lot, coordonnées int32 (n, 4) du lot).
+    """
+    for windows, windows_coords in _iter_window_grids(img, h, w, px_step, pyramid, target_shape):
+        yield from _iter_grid_batches(windows, windows_coords, batch_size)
+
+
+def _iter_window_grids(img, h, w, px_step, pyramid=None, target_shape=None):
+    """
+    Grilles des fenêtres (h, w) puis (w, h) (voir strided_sliding_window), avec leurs coordonnées dans l'image.
+    Avec une pyramide (utils.pyramid), les fenêtres sont découpées dans le plus petit niveau où elles restent
+    au moins aussi grandes que target_shape, leur taille et le pas étant réduits d'autant.
+    """
+    level = 0 if pyramid is None else pyramid.select_level(h, w, _resolve_target_shape(target_shape))
+    for window_h, window_w in ((h, w), (w, h)):
+        if level == 0:
+            yield strided_sliding_window(img, window_h, window_w, px_step, px_step)
+            continue
+
+        level_h, level_w, step_x, step_y = pyramid.level_window(level, window_h, window_w, px_step, px_step)
+        windows, level_coords = strided_sliding_window(pyramid.levels[level], level_h, level_w, step_x, step_y)
+        yield windows, pyramid.coords_to_image(level, level_coords, window_h, window_w)
+
+
+def iter_hog_pyramid_batches(img, h, w, px_step, batch_size, hog_params=None, target_shape=None):
+    """
+    Parcourt les descripteurs HOG (mode "hog_pyramid") des fenêtres (h, w) et (w, h) par lots d'au plus batch_size.
+    :return: Générateur de couples (liste de vues sur les descripteurs du lot, coordonnées int32 (n, 4) du lot).
+    """
+    from utils.hog_pyramid import iter_hog_pyramid_orientations
+
+    target_shape = _resolve_target_shape(target_shape)
+    for grid, windows_coords in iter_hog_pyramid_orientations(img, h, w, target_shape, px_step, hog_params):
+        yield from _iter_grid_batches(grid, windows_coords, batch_size)
+
+
+def _iter_grid_batches(grid, windows_coords, batch_size):
+    # grid[i, j] correspond à windows_coords[i * n_y + j] (voir strided_sliding_window)
+    n_y = grid.shape[1] if grid.ndim > 1 else 0
+    for batch_start in range(0, len(windows_coords), batch_size):
+        batch_stop = min(batch_start + batch_size, len(windows_coords))
+        batch = [grid[k // n_y, k % n_y] for k in range(batch_start, batch_stop)]
+        yield batch, windows_coords[batch_start:batch_stop]
+
+
+# État des processus workers de _parallel_iterations (initialisé une fois par processus)
+_worker_state = {}
+
+
+def _init_worker(img_spec, iteration_params):
+    shm, img = attach_shared(img_spec)
+    _worker_state["shm"] = shm  # le segment doit rester ouvert tant que la vue est utilisée
+    _worker_state["img"] = img
+    _worker_state["iteration_params"] = iteration_params
+
+
+def _worker_detect_iteration(h, w):
+    return _detect_iteration(_worker_state["img"], h, w, **_worker_state["iteration_params"])
+
+
+def _parallel_iterations(img, heights, widths, iteration_params, executor, n_jobs):
+    """
+    Exécute les itérations de detect_ecocup sur un pool de threads ou de processus.
+    :return: Générateur des résultats de _detect_iteration, dans l'ordre des itérations.
+    """
+    n_jobs = get_n_jobs(n_jobs)
+
+    if executor == "thread":
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            yield from pool.map(lambda hw: _detect_iteration(img, *hw, **iteration_params), zip(heights, widths))
+        return
+
+    shm, img_spec = share_array(img)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_worker, initargs=(img_spec, iteration_params)
+        ) as pool:
+            yield from pool.map(_worker_detect_iteration, heights, widths)
+    finally:
+        release_shared(shm)
+
+
+def _window_features(img, h, w, px_step, features_func, pyramid=None, keep=None, target_shape=None, exact=False):
+    """
+    Mode "window" : découpe des fenêtres (h, w) et (w, h), normalisation de chacune puis extraction des features.
+    :param keep: Voir _window_patches.
+    :return: Coordonnées int32 (n_windows, 4) et features (n_windows, n_features).
+    """
+    windows_coords, normalized_parts = _window_patches(img, h, w, px_step, pyramid, keep, target_shape, exact)
+    if len(windows_coords) == 0:
+        return windows_coords, None
+
+    start = time.time()
+    features = features_func(normalized_parts) # np.array
+    print(f"\tTemps d'extraction de features pour {len(windows_coords)} : {time.time() - start}")
+
+    return windows_coords, features
+
+
+def _window_patches(img, h, w, px_step, pyramid=None, keep=None, target_shape=None, exact=False):
+    """
+    Mode "window" : découpe des fenêtres (h, w) et (w, h) et normalisation de chacune.
+    :param keep: Fonction (coordonnées (n, 4)) -> masque booléen (n,) des fenêtres à normaliser (préfiltre), ou None.
+    :param exact: Voir detect_ecocup.
+    :return: Coordonnées int32 (n_windows, 4) et patchs normalisés (n_windows, *target_shape) des fenêtres gardées.
+    """
+    start = time.time()
+    # Fenêtres (h, w) puis même chose avec le rectangle retourné
+    target_shape = _resolve_target_shape(target_shape)
+    (windows, windows_coords), (windows_2, windows_coords_2) = _iter_window_grids(
+        img, h, w, px_step, pyramid, target_shape
+    )
+
+    # Seules les coordonnées sont concaténées (compactes), les fenêtres restent des vues sur l'image
+    windows_coords = np.concatenate([windows_coords, windows_coords_2])
+    n_windows = len(windows_coords)
+    print(f"\tTemps sliding_window x2 ({n_windows} généré): {time.time() - start}")
+
+    if n_windows == 0:
+        return windows_coords, None
+
+    rows = [row for grid in (windows, windows_2) for row in grid] # row i de la grille : coordonnées [i * n_y, (i + 1) * n_y)
+    if keep is not None:
+        mask = keep(windows_coords)
+        row_masks = np.split(mask, np.cumsum([len(row) for row in rows])[:-1])
+        # Suites de fenêtres gardées consécutives : des tranches de la ligne, donc des vues (un masque copierait tout)
+        rows = [
+            row[run_start:run_stop] for row, row_mask in zip(rows, row_masks) for run_start, run_stop in _mask_runs(row_mask)
+        ]
+        windows_coords = windows_coords[mask]
+        n_windows = len(windows_coords)
+        if n_windows == 0:
+            return windows_coords, None
+
+    start = time.time()
+    # Toutes les fenêtres d'une même ligne de la grille ont la même forme : normalisées en un seul lot
+    normalized_parts = np.concatenate([_normalize_windows(row, target_shape, exact) for row in rows])
+    print(f"\tTemps de traitement pour {n_windows} : {time.time() - start}")
+
+    return windows_coords, normalized_parts
+
+
+def _normalize_windows(windows, target_shape, exact=False):
+    """
+    Normalisation de fenêtres de même forme : en un seul lot (normalize_patches), ou une par une avec normalize_patch
+    si exact (voir detect_ecocup).
+    """
+    if exact:
+        return np.array([normalize_patch(window, target_shape) for window in windows])
+    return normalize_patches(windows, target_shape)
+
+
+def _mask_runs(mask):
+    """
+    Suites de True consécutifs d'un masque booléen 1D.
+    :return: Liste de (début, fin) (fin exclue).
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8)))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def _hog_pyramid_features(img, h, w, px_step, hog_params, target_shape=None):
+    """
+    Mode "hog_pyramid" : HOG calculé une fois sur l'image redimensionnée, descripteurs des fenêtres par tranches.
+    :return: Coordonnées int32 (n_windows, 4) et features (n_windows, n_features).
+    """
+    from utils.hog_pyramid import hog_pyramid_windows_both_orientations
+
+    start = time.time()
+    features, windows_coords = hog_pyramid_windows_both_orientations(
+        img, h, w, _resolve_target_shape(target_shape), px_step, hog_params
+    )
+    print(f"\tTemps d'extraction HOG par échelle pour {len(windows_coords)} : {time.time() - start}")
+    return windows_coords, features
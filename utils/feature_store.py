@@ -0,0 +1,236 @@
+"""
+Cache disque des features extraites des patchs d'entraînement.
+
+Chaque patch est identifié par l'empreinte de son contenu (fichier JPEG ou array), et chaque extracteur par son nom
+et ses paramètres : un dossier par couple (extracteur, paramètres), contenant des shards .npy (une ligne de features
+par patch) et un index JSON empreinte -> (shard, ligne).
+Après une modification du splitter, de l'augmenteur ou du normaliseur, seuls les patchs dont le contenu a changé
+ont une nouvelle empreinte : ce sont les seuls recalculés.
+Les features d'une requête sont rendues en memmap (lecture seule) sur un shard rangé dans l'ordre de la requête :
+les chargements suivants dans le même ordre se font sans copie.
+Un shard qui ne sert plus n'est effacé que lorsqu'aucun memmap rendu par le cache ne l'utilise encore (sous Windows,
+un fichier projeté en mémoire ne peut pas être supprimé) ; sinon il l'est à un appel suivant ou à la prochaine
+ouverture du cache.
+
+Exemple : features HOG du jeu normalisé groupé (les patchs sont identifiés par leur contenu, pas par les .jpg, qui
+ne sont écrits que si EXPORT_JPG ; voir aussi local_data/hard_negatives.py et utils/model_bundle.py) :
+
+    store = FeatureStore("HOG", {})
+    dataset = read_augmented(packed_path(os.path.join("local_data", "4_normalized_patches")))
+    X = dataset.features(np.arange(len(dataset)), HOG_extractor, hog_params={}, store=store)
+"""
+
+import hashlib
+import json
+import os
+import weakref
+
+import numpy as np
+
+FEATURE_STORE_FOLDER = os.path.join("local_data", "features_cache")
+FEATURE_STORE_MAX_VIEWS = 4  # nombre de requêtes (ordres de patchs) gardées rangées sur disque
+
+_INDEX_NAME = "index.json"
+
+
+def file_digest(path):
+    """
+    Empreinte du contenu d'un fichier.
+    """
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def array_digest(array):
+    """
+    Empreinte du contenu d'un array (valeurs, forme et type).
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.blake2b(array.data, digest_size=16)
+    digest.update(f"{array.shape}{array.dtype.str}".encode())
+    return digest.hexdigest()
+
+
+def load_patch(path):
+    """
+    Lecture d'un patch normalisé exporté en .jpg (EXPORT_JPG du normalizer) : le niveau de gris est dupliqué sur les
+    3 canaux RGB, on en isole 1.
+    """
+    import matplotlib.pyplot as plt  # importé à la première lecture seulement (voir local_data/image_io.py)
+
+    patch = plt.imread(path)
+    if patch.ndim == 3:
+        return patch[:, :, 0]
+    return patch
+
+
+class FeatureStore:
+    """
+    Features d'un extracteur (nom + paramètres) sur des patchs, indexées par empreinte de contenu.
+    """
+
+    def __init__(self, extractor_name, params=None, folder=FEATURE_STORE_FOLDER):
+        """
+        :param extractor_name: Nom de l'extracteur (ex : "HOG").
+        :param params: Paramètres de l'extracteur (dict sérialisable en JSON, sinon repr est utilisé).
+        Deux jeux de paramètres différents donnent deux caches distincts.
+        :param folder: Dossier racine du cache.
+        """
+        self.extractor_name = extractor_name
+        self.params = params or {}
+        params_json = json.dumps(self.params, sort_keys=True, default=repr)
+        params_digest = hashlib.blake2b(f"{extractor_name}:{params_json}".encode(), digest_size=8).hexdigest()
+        self.folder = os.path.join(folder, f"{extractor_name}_{params_digest}")
+        os.makedirs(self.folder, exist_ok=True)
+
+        index_path = os.path.join(self.folder, _INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        else:
+            index = {"extractor": extractor_name, "params": params_json, "next_shard": 0, "entries": {}, "views": {}}
+        self._index = index
+        self._live_shards = weakref.WeakValueDictionary() # shard -> memmap rendu, tant qu'il (ou une vue) existe
+        # Shards devenus inutiles alors qu'ils étaient encore projetés en mémoire lors d'une exécution précédente
+        self._remove_unused_shards()
+
+    def __len__(self):
+        return len(self._index["entries"])
+
+    def features_for_files(self, paths, extractor, loader=load_patch):
+        """
+        Features des patchs enregistrés dans paths (ex : .jpg exportés par les étapes) : seuls les fichiers absents du
+        cache sont lus et passés à l'extracteur. Pour les jeux groupés, voir features_for_patches.
+        :param paths: Chemins des patchs.
+        :param extractor: Fonction (array de patchs) -> array (n_patchs, n_features), comme HOG_extractor.
+        :param loader: Lecture d'un patch depuis son chemin.
+        :return: Array (n_patchs, n_features) en lecture seule, dans l'ordre de paths.
+        """
+        digests = [file_digest(path) for path in paths]
+
+        def compute(indices):
+            return extractor(np.array([loader(paths[i]) for i in indices]))
+
+        return self._get(digests, compute)
+
+    def features_for_patches(self, patches, extractor):
+        """
+        Features de patchs déjà chargés en mémoire, ou vues sur un jeu groupé (même comportement que
+        features_for_files, voir PackedDataset.features).
+        :param patches: Array (n_patchs, h, w) ou liste de patchs.
+        :return: Array (n_patchs, n_features) en lecture seule, dans l'ordre de patches.
+        """
+        digests = [array_digest(patch) for patch in patches]
+
+        def compute(indices):
+            return extractor(np.array([patches[i] for i in indices]))
+
+        return self._get(digests, compute)
+
+    def prune(self, keep_digests):
+        """
+        Oublie les patchs qui ne sont pas dans keep_digests (ex : supprimés par le splitter) et efface les shards
+        qui ne servent plus. Les requêtes rangées sont aussi oubliées (elles seront re-rangées au prochain appel).
+        """
+        keep_digests = set(keep_digests)
+        entries = self._index["entries"]
+        self._index["entries"] = {digest: location for digest, location in entries.items() if digest in keep_digests}
+        self._index["views"] = {}
+        self._remove_unused_shards()
+        self._save_index()
+
+    def _get(self, digests, compute):
+        """
+        :param digests: Empreintes des patchs demandés, dans l'ordre de la requête.
+        :param compute: Fonction (indices dans digests) -> features de ces patchs.
+        """
+        index = self._index
+        if len(digests) == 0:
+            return np.empty((0, 0))
+        request_key = hashlib.blake2b("".join(digests).encode(), digest_size=16).hexdigest()
+        if request_key in index["views"]:
+            # Requête déjà rangée : on remet la vue en fin de liste (LRU)
+            index["views"][request_key] = index["views"].pop(request_key)
+            self._save_index()
+            return self._load_shard(index["views"][request_key])
+
+        # Patchs manquants (première occurrence de chaque empreinte)
+        missing = {}
+        for i, digest in enumerate(digests):
+            if digest not in index["entries"] and digest not in missing:
+                missing[digest] = i
+
+        if missing:
+            print(f"{self.extractor_name} : {len(missing)}/{len(digests)} patchs à calculer")
+            features = np.asarray(compute(list(missing.values())))
+            features = features.reshape(len(missing), -1)
+            shard = self._write_shard(features)
+            for row, digest in enumerate(missing):
+                index["entries"][digest] = [shard, row]
+
+            if len(missing) == len(digests):
+                # Tout vient d'être calculé dans l'ordre de la requête : le shard est déjà la vue
+                return self._register_view(request_key, shard)
+
+        # Rangement des features dans l'ordre de la requête, directement dans un nouveau shard
+        locations = [index["entries"][digest] for digest in digests]
+        shards = {shard: self._load_shard(shard) for shard in {shard for shard, _ in locations}}
+        first = shards[locations[0][0]]
+        shard = index["next_shard"]
+        index["next_shard"] += 1
+        view = np.lib.format.open_memmap(
+            self._shard_path(shard), mode="w+", dtype=first.dtype, shape=(len(digests), first.shape[1])
+        )
+        shard_ids = np.array([shard_id for shard_id, _ in locations])
+        rows = np.array([row for _, row in locations])
+        for shard_id, data in shards.items():
+            mask = shard_ids == shard_id
+            view[mask] = data[rows[mask]]
+        view.flush()
+        # Plus de référence aux anciens shards : ceux qui ne servent plus peuvent être effacés par _register_view
+        del view, shards, first, data
+
+        for row, digest in enumerate(digests):
+            index["entries"][digest] = [shard, row]
+        return self._register_view(request_key, shard)
+
+    def _register_view(self, request_key, shard):
+        views = self._index["views"]
+        views[request_key] = shard
+        while len(views) > FEATURE_STORE_MAX_VIEWS:
+            del views[next(iter(views))]
+        self._remove_unused_shards()
+        self._save_index()
+        return self._load_shard(shard)
+
+    def _remove_unused_shards(self):
+        # Les shards encore projetés en mémoire (memmap rendu par _load_shard et toujours référencé) sont gardés
+        used = {shard for shard, _ in self._index["entries"].values()} | set(self._index["views"].values())
+        used |= set(self._live_shards.keys())
+        for name in os.listdir(self.folder):
+            if name.startswith("shard_") and name.endswith(".npy") and int(name[6:-4]) not in used:
+                try:
+                    os.remove(os.path.join(self.folder, name))
+                except PermissionError:
+                    pass # encore projeté par un autre processus (Windows) : effacé à une prochaine ouverture
+
+    def _write_shard(self, features):
+        shard = self._index["next_shard"]
+        self._index["next_shard"] += 1
+        np.save(self._shard_path(shard), np.ascontiguousarray(features))
+        return shard
+
+    def _load_shard(self, shard):
+        data = np.load(self._shard_path(shard), mmap_mode="r")
+        self._live_shards[shard] = data
+        return data
+
+    def _shard_path(self, shard):
+        return os.path.join(self.folder, f"shard_{shard:05d}.npy")
+
+    def _save_index(self):
+        # Écriture atomique : un index corrompu ferait tout recalculer
+        index_path = os.path.join(self.folder, _INDEX_NAME)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(self._index, f)
+        os.replace(index_path + ".tmp", index_path)
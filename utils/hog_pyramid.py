@@ -0,0 +1,233 @@
+"""
+Mode de détection "pyramide de HOG" (Dalal & Triggs).
+
+Plutôt que de découper chaque fenêtre, la redimensionner en target_shape puis en extraire le HOG,
+l'image entière est redimensionnée une seule fois par échelle, de sorte qu'une fenêtre (h, w) y mesure exactement
+target_shape. La grille de blocs HOG est calculée une seule fois sur cette image, et le descripteur de chaque fenêtre
+est une tranche de cette grille (les fenêtres qui se recouvrent partagent les mêmes gradients et histogrammes).
+Le pas de la fenêtre glissante est alors arrondi à un nombre entier de cellules HOG.
+"""
+
+import numpy as np
+from skimage.color import rgb2gray
+from skimage.feature import hog
+from skimage.transform import resize
+
+# Valeurs par défaut de skimage.feature.hog, celles utilisées par HOG_extractor dans les notebooks
+HOG_DEFAULT_PARAMS = {
+    "orientations": 9,
+    "pixels_per_cell": (8, 8),
+    "cells_per_block": (3, 3),
+    "block_norm": "L2-Hys",
+}
+
+
+def get_hog_params(hog_params=None):
+    """
+    Complète les paramètres HOG donnés avec les valeurs par défaut de skimage.
+    """
+    params = dict(HOG_DEFAULT_PARAMS)
+    if hog_params:
+        params.update(hog_params)
+    return params
+
+
+def hog_blocks(img, hog_params=None):
+    """
+    Grille des blocs HOG normalisés d'une image.
+    :param img: Image en niveaux de gris.
+    :param hog_params: Paramètres de skimage.feature.hog.
+    :return: Array (n_blocks_x, n_blocks_y, cells_per_block_x, cells_per_block_y, orientations).
+    """
+    return hog(img, feature_vector=False, **get_hog_params(hog_params))
+
+
+def hog_window_shape(target_shape, hog_params=None):
+    """
+    Nombre de blocs HOG (en hauteur, en largeur) couverts par un patch normalisé de forme target_shape.
+    """
+    params = get_hog_params(hog_params)
+    cells_x = target_shape[0] // params["pixels_per_cell"][0]
+    cells_y = target_shape[1] // params["pixels_per_cell"][1]
+    return cells_x - params["cells_per_block"][0] + 1, cells_y - params["cells_per_block"][1] + 1
+
+
+def hog_flip_permutation(target_shape, axes, hog_params=None):
+    """
+    Permutation des features HOG d'un patch normalisé de forme target_shape retourné selon axes :
+    hog(np.flip(patch, axes)).ravel() ~ hog(patch).ravel()[permutation].
+    Retourner le patch retourne la grille de cellules (et de blocs), et change chaque orientation theta en 180 - theta
+    si un seul axe est retourné (inchangée pour les deux, rotation de 180°).
+    Exacte (aux arrondis près) pour la rotation de 180°. Approchée pour un seul axe : les gradients d'orientation
+    exactement 0 (dont ceux des bords du patch, où skimage met une composante à 0) restent dans le premier intervalle.
+    :param axes: Axes retournés, parmi (0, 1).
+    :return: Array int64 (n_features,).
+    """
+    params = get_hog_params(hog_params)
+    cell_x, cell_y = params["pixels_per_cell"]
+    if target_shape[0] % cell_x or target_shape[1] % cell_y:
+        raise ValueError(f"target_shape={target_shape} n'est pas un multiple de pixels_per_cell={params['pixels_per_cell']}")
+
+    blocks_x, blocks_y = hog_window_shape(target_shape, params)
+    b_x, b_y = params["cells_per_block"]
+    permutation = np.arange(blocks_x * blocks_y * b_x * b_y * params["orientations"])
+    permutation = permutation.reshape(blocks_x, blocks_y, b_x, b_y, params["orientations"])
+    for axis in axes:
+        # Axe des blocs et axe des cellules dans le bloc
+        permutation = np.flip(permutation, (axis, axis + 2))
+    if len(axes) % 2 == 1:
+        permutation = np.flip(permutation, 4)
+    return permutation.ravel()
+
+
+def scale_hog_blocks(img, h, w, target_shape, hog_params=None):
+    """
+    Redimensionne l'image pour qu'une fenêtre (h, w) y mesure target_shape, et calcule sa grille HOG.
+    :return: Grille des blocs HOG (voir hog_blocks) et facteurs d'échelle (scale_x, scale_y) appliqués à l'image.
+    """
+    scale_x = target_shape[0] / h
+    scale_y = target_shape[1] / w
+    resized_shape = (int(round(img.shape[0] * scale_x)), int(round(img.shape[1] * scale_y)))
+    resized = resize(img, resized_shape, anti_aliasing=True)
+    return hog_blocks(resized, hog_params), (scale_x, scale_y)
+
+
+def hog_pyramid_window_grid(img, h, w, target_shape, x_step, y_step, hog_params=None):
+    """
+    Vue (sans copie) sur les descripteurs HOG de toutes les fenêtres (h, w) d'une image, calculés à partir
+    d'une seule grille HOG. Chaque descripteur est identique (aux effets de bord près) au HOG du patch normalisé.
+    :param img: Image en niveaux de gris.
+    :param h: Hauteur de la fenêtre.
+    :param w: Largeur de la fenêtre.
+    :param target_shape: Shape des patchs normalisés (celle de l'entraînement).
+    :param x_step: Pas de la fenêtre en hauteur (en pixels de l'image d'origine).
+    :param y_step: Pas de la fenêtre en largeur.
+    :param hog_params: Paramètres de skimage.feature.hog utilisés à l'entraînement.
+    :return: Vue (n_x, n_y, window_blocks_x, window_blocks_y, b_x, b_y, orientations) : grid[i, j].ravel() est le
+    descripteur de la fenêtre coords[i * n_y + j] ; et array int32 (n_x * n_y, 4) des coordonnées
+    (upper_left_x, upper_left_y, lower_right_x, lower_right_y) dans l'image d'origine.
+    """
+    params = get_hog_params(hog_params)
+    window_blocks = hog_window_shape(target_shape, params)
+    empty = np.empty((0, 0) + window_blocks), np.empty((0, 4), dtype=np.int32)
+
+    if img.shape[0] < h or img.shape[1] < w:
+        return empty
+
+    blocks, (scale_x, scale_y) = scale_hog_blocks(img, h, w, target_shape, params)
+    if blocks.shape[0] < window_blocks[0] or blocks.shape[1] < window_blocks[1]:
+        return empty
+
+    # Pas de la fenêtre glissante converti en nombre de cellules dans l'image redimensionnée
+    cell_x, cell_y = params["pixels_per_cell"]
+    step_x = max(1, int(round(x_step * scale_x / cell_x)))
+    step_y = max(1, int(round(y_step * scale_y / cell_y)))
+
+    # (positions_x, positions_y, b_x, b_y, orientations, window_blocks_x, window_blocks_y) : vue sur la grille
+    grid = np.lib.stride_tricks.sliding_window_view(blocks, window_blocks, axis=(0, 1))
+    grid = grid[::step_x, ::step_y]
+    # Même ordre que hog(patch).ravel() : (blocs_x, blocs_y, b_x, b_y, orientations)
+    grid = grid.transpose(0, 1, 5, 6, 2, 3, 4)
+    n_x, n_y = grid.shape[:2]
+
+    coords = block_grid_coords(img.shape, h, w, n_x, n_y, (step_x * cell_x, step_y * cell_y), (scale_x, scale_y))
+    return grid, coords
+
+
+def block_grid_coords(img_shape, h, w, n_x, n_y, steps, scales):
+    """
+    Coordonnées dans l'image d'origine des fenêtres (h, w) d'une grille n_x * n_y de positions de blocs HOG.
+    :param steps: Pas (en pixels de l'image redimensionnée) entre deux positions, en hauteur et en largeur.
+    :param scales: Facteurs d'échelle (scale_x, scale_y) de l'image redimensionnée (voir scale_hog_blocks).
+    :return: Array int32 (n_x * n_y, 4), position [i, j] de la grille en ligne i * n_y + j.
+    """
+    # Position des fenêtres (premier bloc = première cellule) ramenée dans l'image d'origine
+    upper_left_x = np.round(np.arange(n_x) * steps[0] / scales[0]).astype(np.int32)
+    upper_left_y = np.round(np.arange(n_y) * steps[1] / scales[1]).astype(np.int32)
+    upper_left_x = np.minimum(upper_left_x, img_shape[0] - h)
+    upper_left_y = np.minimum(upper_left_y, img_shape[1] - w)
+    upper_left_x, upper_left_y = np.meshgrid(upper_left_x, upper_left_y, indexing="ij")
+
+    coords = np.empty((n_x * n_y, 4), dtype=np.int32)
+    coords[:, 0] = upper_left_x.ravel()
+    coords[:, 1] = upper_left_y.ravel()
+    coords[:, 2] = coords[:, 0] + h
+    coords[:, 3] = coords[:, 1] + w
+    return coords
+
+
+def unrotate_coords(coords_rotated, width):
+    """
+    Coordonnées de fenêtres de l'image tournée (np.rot90, k=1) ramenées dans le repère de l'image.
+    :param width: Largeur de l'image d'origine.
+    """
+    # rot90 (k=1) : la ligne i de l'image tournée est la colonne (W - 1 - i) de l'image
+    coords = np.empty_like(coords_rotated)
+    coords[:, 0] = coords_rotated[:, 1]
+    coords[:, 1] = width - coords_rotated[:, 2]
+    coords[:, 2] = coords_rotated[:, 3]
+    coords[:, 3] = width - coords_rotated[:, 0]
+    return coords
+
+
+def hog_pyramid_windows(img, h, w, target_shape, x_step, y_step, hog_params=None):
+    """
+    Comme hog_pyramid_window_grid, mais avec les descripteurs copiés dans un array (n_windows, n_features).
+    """
+    grid, coords = hog_pyramid_window_grid(img, h, w, target_shape, x_step, y_step, hog_params)
+    return grid.reshape(len(coords), -1), coords
+
+
+def window_orientations(h, w):
+    """
+    Passes nécessaires pour les fenêtres (h, w) puis (w, h). normalize_patch tourne de 90° les patchs plus larges que
+    hauts : les fenêtres allongées sont cherchées debout sur l'image tournée. Une fenêtre carrée n'est jamais tournée,
+    elle n'a qu'une passe.
+    :return: Forme debout (hauteur >= largeur) des fenêtres cherchées, et liste de booléens dans l'ordre des fenêtres
+    (h, w) puis (w, h) (True : passe sur l'image tournée).
+    """
+    if h == w:
+        return (h, w), [False]
+    if h > w:
+        return (h, w), [False, True]
+    return (w, h), [True, False]
+
+
+def iter_hog_pyramid_orientations(img, h, w, target_shape, px_step, hog_params=None):
+    """
+    Grilles de descripteurs (voir hog_pyramid_window_grid) des fenêtres (h, w) puis (w, h) (une seule passe si h == w).
+    Les fenêtres allongées sont tournées de 90° par normalize_patch : on tourne donc l'image entière une fois,
+    ce qui les ramène à des fenêtres debout, puis on remet leurs coordonnées dans le repère de l'image.
+    :return: Générateur de couples (grille des descripteurs, coordonnées int32 (n, 4)).
+    """
+    if img.ndim == 3:
+        img = rgb2gray(img)
+
+    (upright_h, upright_w), passes = window_orientations(h, w)
+    for rotated in passes:
+        if not rotated:
+            yield hog_pyramid_window_grid(img, upright_h, upright_w, target_shape, px_step, px_step, hog_params)
+            continue
+        img_rotated = np.rot90(img, k=1)
+        grid, coords_rotated = hog_pyramid_window_grid(
+            img_rotated, upright_h, upright_w, target_shape, px_step, px_step, hog_params
+        )
+        yield grid, unrotate_coords(coords_rotated, img.shape[1])
+
+
+def hog_pyramid_windows_both_orientations(img, h, w, target_shape, px_step, hog_params=None):
+    """
+    Descripteurs et coordonnées de toutes les fenêtres (h, w) et (w, h) (une fois si h == w), voir
+    iter_hog_pyramid_orientations.
+    :return: Descripteurs (n_windows, n_features) et coordonnées int32 (n_windows, 4).
+    """
+    descriptors = []
+    coords = []
+    for grid, grid_coords in iter_hog_pyramid_orientations(img, h, w, target_shape, px_step, hog_params):
+        if len(grid_coords) > 0:
+            descriptors.append(grid.reshape(len(grid_coords), -1))
+            coords.append(grid_coords)
+
+    if not descriptors:
+        return np.empty((0, 0)), np.empty((0, 4), dtype=np.int32)
+    return np.concatenate(descriptors), np.concatenate(coords)
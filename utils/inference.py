@@ -0,0 +1,239 @@
+"""
+Détection en continu sur un dossier d'images ou une vidéo (point d'entrée hors notebooks).
+
+Les images (ou frames) sont décodées dans des threads en arrière-plan pendant que la précédente est classée :
+iter_imread pour un dossier (plusieurs lectures en avance), un thread dédié pour une vidéo (OpenCV lit les frames
+dans l'ordre). Chaque image passe par detect_ecocup puis non_maxima_suppression_v2, et ses détections sont écrites
+dans l'ordre des entrées, une ligne par fenêtre au format des labels_csv : coinhgY,coinhgX,Hauteur,Largeur,score
+(<nom>.csv dans le dossier de sortie, nom du fichier image ou numéro de frame sur 6 chiffres).
+
+Le modèle est un bundle enregistré par utils/model_bundle.py (classifieur, HOG, limites des fenêtres et paramètres
+de détection, que les options de la ligne de commande peuvent remplacer) :
+
+    python utils/inference.py <dossier_ou_video> <modele.joblib> <dossier_de_sortie> [options]
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from local_data.image_io import iter_imread
+from utils.detection import DETECTION_MODES
+from utils.model_bundle import load_detector
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+PREFETCH = 8       # nombre de frames vidéo décodées en avance
+REPORT_EVERY = 10  # le débit est affiché toutes les REPORT_EVERY images
+CSV_HEADER = ["coinhgY", "coinhgX", "Hauteur", "Largeur", "score"]
+
+
+def iter_folder_frames(folder, n_workers=None):
+    """
+    Images d'un dossier, par ordre de nom, lues en parallèle en avance (voir iter_imread).
+    :return: Générateur de (nom sans extension, image).
+    """
+    f_names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    paths = [os.path.join(folder, f) for f in f_names]
+    for f_name, img in zip(f_names, iter_imread(paths, n_workers)):
+        if img is not None:
+            yield os.path.splitext(f_name)[0], img
+
+
+def iter_video_frames(path, prefetch=PREFETCH):
+    """
+    Frames d'une vidéo, décodées par OpenCV dans un thread en arrière-plan (au plus prefetch frames en avance).
+    :return: Générateur de (numéro de frame sur 6 chiffres, image RGB uint8).
+    """
+    import cv2  # seulement pour les vidéos
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Impossible d'ouvrir la vidéo : {path}")
+
+    def read_frames():
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    frames = prefetch_iter(read_frames(), prefetch)
+    try:
+        for index, frame in enumerate(frames):
+            yield f"{index:06d}", frame
+    finally:
+        frames.close() # arrête le thread de décodage avant de libérer la vidéo
+        capture.release()
+
+
+def prefetch_iter(iterable, size):
+    """
+    Parcourt iterable dans un thread en arrière-plan, avec au plus size éléments en avance.
+    Une exception levée par iterable est relancée dans le thread appelant.
+    :return: Générateur des éléments de iterable, dans l'ordre.
+    """
+    items = queue.Queue(maxsize=max(size, 1))
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            items.put((done, None))
+        except BaseException as error:
+            items.put((done, error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Arrêt anticipé (break, exception) : le producteur ne reste pas bloqué sur une file pleine
+        stop.set()
+        thread.join()
+
+
+def iter_frames(source, n_workers=None, prefetch=PREFETCH):
+    """
+    Images d'un dossier ou frames d'une vidéo, selon source.
+    :return: Générateur de (nom, image).
+    """
+    if os.path.isdir(source):
+        return iter_folder_frames(source, n_workers)
+    return iter_video_frames(source, prefetch)
+
+
+def detections_rows(windows, scores):
+    """
+    Lignes au format des labels_csv des fenêtres gardées par la NMS.
+    :param windows: Fenêtres (n, 2, 2) ou (n, 4) (upper_left_x, upper_left_y, lower_right_x, lower_right_y), x étant
+    la ligne et y la colonne.
+    :return: Liste de [coinhgY, coinhgX, Hauteur, Largeur, score] (ligne, colonne, hauteur, largeur, score).
+    """
+    boxes = np.asarray(windows).reshape(-1, 4).astype(int)
+    return [
+        [box[0], box[1], box[2] - box[0], box[3] - box[1], float(score)] for box, score in zip(boxes, scores)
+    ]
+
+
+def write_detections(path, rows, header=False):
+    """
+    Enregistre les détections d'une image dans un csv (même écriture que annot.py).
+    """
+    with open(path, "w", newline="") as csvf:
+        writer = csv.writer(csvf, delimiter=",", quoting=csv.QUOTE_MINIMAL)
+        if header:
+            writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+
+
+def detect_frame(img, detector, verbose=False):
+    """
+    Détections finales d'une image (detect_ecocup puis non_maxima_suppression_v2, voir Detector.detect).
+    :param verbose: Si False, les logs par itération de detect_ecocup ne sont pas affichés.
+    :return: Lignes au format des labels_csv (voir detections_rows).
+    """
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+        best_windows, best_scores = detector.detect(img)
+    return detections_rows(best_windows, best_scores)
+
+
+def run_inference(frames, detector, output_folder, header=False, verbose=False):
+    """
+    Détection sur un flux d'images, détections écrites au fur et à mesure dans output_folder (dans l'ordre du flux).
+    Le débit soutenu (images traitées depuis le début / temps écoulé, décodage compris) est affiché toutes les
+    REPORT_EVERY images puis à la fin.
+    :param frames: Itérable de (nom, image), ex : iter_frames.
+    :param detector: Detector (voir utils.model_bundle.load_detector).
+    :return: Nombre d'images traitées, nombre de détections et débit soutenu (images/s).
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    n_frames = 0
+    n_detections = 0
+    detect_seconds = 0.0
+    start = time.time()
+    for name, img in frames:
+        start_detect = time.time()
+        rows = detect_frame(img, detector, verbose)
+        detect_seconds += time.time() - start_detect
+        write_detections(os.path.join(output_folder, f"{name}.csv"), rows, header)
+        n_frames += 1
+        n_detections += len(rows)
+        if n_frames % REPORT_EVERY == 0:
+            seconds = time.time() - start
+            print(f"{n_frames} images, {n_detections} détections : {n_frames / seconds:.2f} images/s")
+
+    seconds = time.time() - start
+    fps = n_frames / max(seconds, 1e-9)
+    print(
+        f"Total : {n_frames} images, {n_detections} détections en {seconds:.1f} s ({fps:.2f} images/s soutenues, "
+        f"{detect_seconds:.1f} s de détection, {seconds - detect_seconds:.1f} s d'attente du décodage et d'écriture)"
+    )
+    return n_frames, n_detections, fps
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Détection d'ecocups sur un dossier d'images ou une vidéo.")
+    parser.add_argument("source", help="Dossier d'images (.jpg, .png) ou fichier vidéo (lu avec OpenCV)")
+    parser.add_argument("model", help="Bundle enregistré par utils/model_bundle.py")
+    parser.add_argument("output", help="Dossier des csv de détections (un <nom>.csv par image)")
+    # Paramètres du bundle remplacés s'ils sont donnés
+    parser.add_argument("--mode", choices=DETECTION_MODES)
+    parser.add_argument("--px-step", type=int)
+    parser.add_argument("--scales-nb", type=int)
+    parser.add_argument("--ratios-nb", type=int)
+    parser.add_argument("--confidence-threshold", type=float)
+    parser.add_argument("--iou", type=float, help="Seuil d'IoU de la NMS")
+    parser.add_argument("--min-score", type=float, help="Score minimal d'une détection")
+    parser.add_argument("--workers", type=int, default=None, help="Threads de lecture d'un dossier (défaut : coeurs)")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH, help="Frames vidéo décodées en avance")
+    parser.add_argument("--header", action="store_true", help="Écrit la ligne d'en-tête des colonnes dans chaque csv")
+    parser.add_argument("--verbose", action="store_true", help="Affiche les logs par itération de detect_ecocup")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    start = time.time()
+    detector = load_detector(args.model)
+    print(f"Modèle chargé : {time.time() - start:.2f} s")
+
+    overrides = {
+        "mode": args.mode,
+        "px_step": args.px_step,
+        "scales_nb": args.scales_nb,
+        "ratios_nb": args.ratios_nb,
+        "confidence_threshold": args.confidence_threshold,
+    }
+    detector.detection_params.update({key: value for key, value in overrides.items() if value is not None})
+    nms_overrides = {"iou_decision_criteria": args.iou, "score_decision_criteria": args.min_score}
+    detector.nms_params = dict(
+        detector.nms_params, **{key: value for key, value in nms_overrides.items() if value is not None}
+    )
+
+    run_inference(iter_frames(args.source, args.workers, args.prefetch), detector, args.output, args.header, args.verbose)
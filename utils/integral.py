@@ -0,0 +1,237 @@
+"""
+Images intégrales (tables de sommes cumulées) pour des statistiques de fenêtres en temps constant.
+
+Une table T de forme (H + 1, W + 1) contient en T[i, j] la somme des pixels img[:i, :j] : la somme sur n'importe quelle
+fenêtre (x0, y0, x1, y1) vaut T[x1, y1] - T[x0, y1] - T[x1, y0] + T[x0, y0], soit 4 lectures quelle que soit sa taille.
+Les tables sont construites une fois par image (IntegralImage) et interrogées pour toutes les fenêtres de toutes les
+itérations (h, w) de detect_ecocup, sans découpe ni parcours des fenêtres :
+- moyenne et écart-type de l'intensité, énergie des contours (moyenne de la norme du gradient) : préfiltre des zones
+  plates ou sans texture (WindowPrefilter) ;
+- histogrammes intégraux des orientations du gradient (une table par classe d'orientation) : descripteur approché du
+  HOG par cellules (orientation_histograms), pour un premier balayage grossier.
+Les coordonnées des fenêtres sont au format de detect_ecocup : array int (n, 4)
+(upper_left_x, upper_left_y, lower_right_x, lower_right_y), x étant l'axe des lignes.
+"""
+
+import time
+
+import numpy as np
+
+ORIENTATION_BINS = 8       # classes d'orientation (0-180°), en nombre pair : la rotation de 90° de la normalisation
+                           # est alors un décalage exact de ORIENTATION_BINS // 2 classes
+DESCRIPTOR_CELLS = (8, 4)  # grille de cellules (lignes, colonnes) du descripteur, dans le repère du patch normalisé
+PREFILTER_RECALL = 0.995   # fraction des annotations gardée par les seuils de calibrate_prefilter
+
+
+def integral_table(values):
+    """
+    Table de sommes cumulées, avec une ligne et une colonne de zéros en tête.
+    :param values: Array (H, W) ou (H, W, k) (une table par canal).
+    :return: Array float64 (H + 1, W + 1[, k]).
+    """
+    table = np.zeros((values.shape[0] + 1, values.shape[1] + 1) + values.shape[2:], dtype=np.float64)
+    np.cumsum(values, axis=0, dtype=np.float64, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def window_sums(table, coords):
+    """
+    Sommes des valeurs de la table sur chaque fenêtre, en 4 lectures par fenêtre.
+    :param table: Voir integral_table.
+    :param coords: Array int (n, 4) des fenêtres.
+    :return: Array (n,) (ou (n, k) pour une table à k canaux).
+    """
+    coords = np.asarray(coords)
+    x0, y0, x1, y1 = coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]
+    return table[x1, y1] - table[x0, y1] - table[x1, y0] + table[x0, y0]
+
+
+def gradients(img):
+    """
+    Gradients par différences centrées (bords à 0), comme skimage.feature.hog.
+    :return: (gradient selon les lignes, gradient selon les colonnes).
+    """
+    g_row = np.zeros_like(img)
+    g_col = np.zeros_like(img)
+    g_row[1:-1] = img[2:] - img[:-2]
+    g_col[:, 1:-1] = img[:, 2:] - img[:, :-2]
+    return g_row, g_col
+
+
+class IntegralImage:
+    """
+    Tables intégrales d'une image en niveaux de gris : intensité, carré de l'intensité, norme du gradient.
+    Les histogrammes intégraux d'orientation ne sont construits qu'au premier appel de orientation_histograms
+    (n_bins tables, la plus grosse structure).
+    """
+
+    def __init__(self, img, n_bins=ORIENTATION_BINS):
+        img = np.asarray(img, dtype=np.float64)
+        if img.ndim != 2:
+            raise ValueError(f"Image en niveaux de gris attendue (voir preprocess_image), forme reçue : {img.shape}")
+        self.shape = img.shape
+        self.n_bins = n_bins
+        self.sum = integral_table(img)
+        self.sum_squares = integral_table(img * img)
+        self._g_row, self._g_col = gradients(img)
+        self.magnitude = integral_table(np.hypot(self._g_row, self._g_col))
+        self._orientations = None
+
+    @staticmethod
+    def areas(coords):
+        coords = np.asarray(coords)
+        return (coords[:, 2] - coords[:, 0]) * (coords[:, 3] - coords[:, 1])
+
+    def mean(self, coords):
+        return window_sums(self.sum, coords) / self.areas(coords)
+
+    def std(self, coords):
+        """
+        Écart-type de l'intensité de chaque fenêtre (E[x²] - E[x]², en temps constant).
+        """
+        areas = self.areas(coords)
+        mean = window_sums(self.sum, coords) / areas
+        return np.sqrt(np.maximum(window_sums(self.sum_squares, coords) / areas - mean * mean, 0))
+
+    def edge_energy(self, coords):
+        """
+        Moyenne de la norme du gradient sur chaque fenêtre.
+        """
+        return window_sums(self.magnitude, coords) / self.areas(coords)
+
+    def orientation_tables(self):
+        """
+        Histogrammes intégraux : table (H + 1, W + 1, n_bins), norme du gradient cumulée par classe d'orientation
+        (non signée, 0-180°, comme le HOG de skimage, sans interpolation entre classes).
+        """
+        if self._orientations is None:
+            orientation = np.rad2deg(np.arctan2(self._g_row, self._g_col)) % 180
+            bins = np.minimum((orientation * self.n_bins / 180).astype(np.intp), self.n_bins - 1)
+            weighted = np.zeros(self.shape + (self.n_bins,))
+            np.put_along_axis(weighted, bins[..., None], np.hypot(self._g_row, self._g_col)[..., None], axis=2)
+            self._orientations = integral_table(weighted)
+        return self._orientations
+
+    def orientation_histograms(self, coords, cells=DESCRIPTOR_CELLS):
+        """
+        Descripteur approché du HOG : histogramme des orientations de chaque cellule d'une grille cells, normalisé
+        (norme L2 sur toute la fenêtre). 4 lectures par coin de cellule, quelle que soit la taille de la fenêtre.
+        Les fenêtres plus larges que hautes sont décrites comme le patch tourné de 90° par la normalisation
+        (normalize_patch) : grille transposée, cellules tournées et orientations décalées de 90°.
+        :param coords: Array int (n, 4) des fenêtres.
+        :param cells: (cellules en hauteur, cellules en largeur) du patch normalisé.
+        :return: Array (n, cells[0] * cells[1] * n_bins).
+        """
+        coords = np.asarray(coords)
+        tables = self.orientation_tables()
+        descriptors = np.empty((len(coords), cells[0], cells[1], self.n_bins))
+        rotated = (coords[:, 3] - coords[:, 1]) > (coords[:, 2] - coords[:, 0])
+        for is_rotated in (False, True):
+            selected = np.flatnonzero(rotated == is_rotated)
+            if len(selected) == 0:
+                continue
+            grid = cells[::-1] if is_rotated else cells
+            c = coords[selected]
+            # Bords des cellules (n, grid[0] + 1) et (n, grid[1] + 1)
+            x_edges = c[:, [0]] + np.round(np.linspace(0, 1, grid[0] + 1) * (c[:, [2]] - c[:, [0]])).astype(np.intp)
+            y_edges = c[:, [1]] + np.round(np.linspace(0, 1, grid[1] + 1) * (c[:, [3]] - c[:, [1]])).astype(np.intp)
+            corners = tables[x_edges[:, :, None], y_edges[:, None, :]]
+            histograms = corners[:, 1:, 1:] - corners[:, :-1, 1:] - corners[:, 1:, :-1] + corners[:, :-1, :-1]
+            if is_rotated:
+                # Même rotation que rotate_90 (np.rot90, k=1) ; une rotation de 90° décale les orientations de 90°
+                histograms = np.roll(np.rot90(histograms, k=1, axes=(1, 2)), self.n_bins // 2, axis=3)
+            descriptors[selected] = histograms
+
+        descriptors = descriptors.reshape(len(coords), -1)
+        norms = np.sqrt(np.sum(descriptors ** 2, axis=1, keepdims=True))
+        return descriptors / (norms + 1e-6)
+
+
+def patches_orientation_histograms(patches, cells=DESCRIPTOR_CELLS, n_bins=ORIENTATION_BINS):
+    """
+    Descripteur de orientation_histograms sur des patchs normalisés (jeu d'entraînement d'un classifieur utilisé sur
+    les fenêtres de detect_ecocup).
+    :param patches: Array (n, height, width).
+    :return: Array (n, cells[0] * cells[1] * n_bins).
+    """
+    descriptors = np.empty((len(patches), cells[0] * cells[1] * n_bins))
+    for i, patch in enumerate(patches):
+        full = np.array([[0, 0, patch.shape[0], patch.shape[1]]])
+        descriptors[i] = IntegralImage(patch, n_bins).orientation_histograms(full, cells)[0]
+    return descriptors
+
+
+class WindowPrefilter:
+    """
+    Préfiltre des fenêtres plates ou sans texture : une fenêtre est rejetée, avant toute découpe, normalisation ou
+    extraction de features, si l'écart-type de son intensité est sous min_std ou son énergie de contours sous min_edge.
+    """
+
+    def __init__(self, min_std=0.0, min_edge=0.0):
+        self.min_std = min_std
+        self.min_edge = min_edge
+
+    def keep(self, integral, coords):
+        """
+        :param integral: IntegralImage de l'image prétraitée.
+        :param coords: Array int (n, 4) des fenêtres.
+        :return: Masque booléen (n,) des fenêtres gardées.
+        """
+        if len(coords) == 0:
+            return np.zeros(0, dtype=bool)
+        return (integral.std(coords) >= self.min_std) & (integral.edge_energy(coords) >= self.min_edge)
+
+    def filter(self, integral, coords, stats=None):
+        """
+        keep, avec mise à jour des statistiques stats (voir new_stats) sur place.
+        """
+        start = time.time()
+        mask = self.keep(integral, coords)
+        if stats is not None:
+            stats += (len(mask), len(mask) - np.count_nonzero(mask), time.time() - start)
+        return mask
+
+    @staticmethod
+    def new_stats():
+        """
+        Statistiques vides : (fenêtres en entrée, fenêtres rejetées, temps en secondes).
+        """
+        return np.zeros(3)
+
+    @staticmethod
+    def print_stats(stats):
+        n_in, n_rejected, seconds = stats
+        rate = n_rejected / n_in if n_in > 0 else 0
+        print(f"Préfiltre : {int(n_in)} fenêtres, {int(n_rejected)} rejetées ({100 * rate:.1f} %), {seconds:.3f} s")
+
+    def __repr__(self):
+        return f"WindowPrefilter(min_std={self.min_std:.4f}, min_edge={self.min_edge:.4f})"
+
+
+def calibrate_prefilter(samples, recall=PREFILTER_RECALL):
+    """
+    Seuils du préfiltre choisis sur des fenêtres annotées, pour en garder au moins la fraction recall sur chaque
+    critère.
+    :param samples: Itérable de (image prétraitée 2D, array (n, 4) des annotations au format des fenêtres).
+    :return: WindowPrefilter.
+    """
+    stds = []
+    edges = []
+    for img, gt_windows in samples:
+        if len(gt_windows) == 0:
+            continue
+        integral = IntegralImage(img)
+        gt_windows = np.asarray(gt_windows).astype(np.intp)
+        gt_windows[:, [0, 2]] = np.clip(gt_windows[:, [0, 2]], 0, img.shape[0])
+        gt_windows[:, [1, 3]] = np.clip(gt_windows[:, [1, 3]], 0, img.shape[1])
+        gt_windows = gt_windows[IntegralImage.areas(gt_windows) > 0]
+        stds.append(integral.std(gt_windows))
+        edges.append(integral.edge_energy(gt_windows))
+    if not stds:
+        raise ValueError("Aucune annotation pour calibrer le préfiltre")
+    prefilter = WindowPrefilter(
+        np.quantile(np.concatenate(stds), 1 - recall), np.quantile(np.concatenate(edges), 1 - recall)
+    )
+    print(f"Préfiltre calibré sur {sum(len(s) for s in stds)} annotations : {prefilter}")
+    return prefilter
@@ -0,0 +1,140 @@
+"""
+Mode de détection "linear" : HOG et modèle linéaire repliés en un filtre de corrélation.
+
+Avec un classifieur linéaire (LogisticRegression sur le HOG, presque aussi précis que le SVC polynomial dans
+resultats_classification.csv et bien plus rapide), le score d'une fenêtre est w . x + b, où x est une tranche de la
+grille des blocs HOG de l'image redimensionnée (voir utils.hog_pyramid). Les poids w, remis sous la forme de cette
+tranche (blocs_x, blocs_y, canaux), forment un gabarit : les scores de toutes les positions sont la corrélation du
+gabarit avec la grille, calculée en un seul appel sans construire ni copier les descripteurs des fenêtres :
+- pas d'une cellule (toutes les positions) : scipy.signal.correlate, par FFT si c'est plus rapide ;
+- pas de plusieurs cellules : produit scalaire du gabarit avec la vue (sans copie) des positions retenues, plus
+  rapide que la carte complète puis sous-échantillonnée (x5 à x15 pour px_step=35).
+La probabilité de la classe "gobelet" est la sigmoïde du score, comme predict_proba d'une LogisticRegression binaire.
+"""
+
+import numpy as np
+from scipy import signal
+from scipy.special import expit
+from sklearn.preprocessing import StandardScaler
+
+from utils.hog_pyramid import (
+    block_grid_coords, get_hog_params, hog_window_shape, scale_hog_blocks, unrotate_coords, window_orientations,
+)
+
+
+def fold_linear_classifier(classifier):
+    """
+    Poids et biais du score w . x + b d'un classifieur linéaire binaire.
+    :param classifier: Classifieur entraîné (coef_ et intercept_, ex : LogisticRegression), éventuellement dans un
+    Pipeline dont les étapes précédentes sont des StandardScaler (repliés dans les poids et le biais).
+    :return: Poids float64 (n_features,) et biais (float).
+    """
+    steps = getattr(classifier, "steps", None)
+    model = steps[-1][1] if steps is not None else classifier
+    if not hasattr(model, "coef_") or np.asarray(model.coef_).shape[0] != 1:
+        raise ValueError(f"Classifieur linéaire binaire attendu (coef_ et intercept_) : {type(model).__name__}")
+
+    weights = np.asarray(model.coef_, dtype=np.float64).ravel()
+    bias = float(np.asarray(model.intercept_).ravel()[0])
+    # Les StandardScaler devant le modèle sont affines : w . (x - mean) / scale + b = (w / scale) . x + b'
+    for name, step in reversed(steps[:-1] if steps is not None else []):
+        if not isinstance(step, StandardScaler):
+            raise ValueError(f"Étape {name} ({type(step).__name__}) impossible à replier dans le gabarit")
+        if step.with_std:
+            weights = weights / step.scale_
+        if step.with_mean:
+            bias -= float(np.dot(weights, step.mean_))
+    return weights, bias
+
+
+class LinearTemplate:
+    """
+    Gabarit de corrélation d'un classifieur linéaire sur le HOG des patchs normalisés.
+    weights : array (window_blocks_x, window_blocks_y, b_x * b_y * orientations), bias : float.
+    """
+
+    def __init__(self, classifier, target_shape, hog_params=None):
+        """
+        :param classifier: Classifieur linéaire binaire entraîné (coef_ et intercept_, ex : LogisticRegression),
+        éventuellement dans un Pipeline dont les étapes précédentes sont des StandardScaler (repliés dans le gabarit).
+        :param target_shape: Shape des patchs normalisés.
+        :param hog_params: Paramètres de skimage.feature.hog utilisés à l'entraînement.
+        """
+        params = get_hog_params(hog_params)
+        weights, bias = fold_linear_classifier(classifier)
+
+        window_blocks = hog_window_shape(target_shape, params)
+        block_size = params["cells_per_block"][0] * params["cells_per_block"][1] * params["orientations"]
+        if weights.size != window_blocks[0] * window_blocks[1] * block_size:
+            raise ValueError(
+                f"{weights.size} poids pour un HOG de {window_blocks[0] * window_blocks[1] * block_size} features "
+                f"(target_shape={target_shape}, hog_params={hog_params})"
+            )
+        # Même ordre que hog(patch).ravel() : (blocs_x, blocs_y, b_x, b_y, orientations)
+        self.weights = weights.reshape(window_blocks[0], window_blocks[1], block_size)
+        self.bias = bias
+        self.target_shape = tuple(target_shape)
+        self.hog_params = params
+
+    def score_map(self, blocks, steps=(1, 1)):
+        """
+        Scores (avant sigmoïde) des positions du gabarit sur une grille de blocs HOG, une position sur steps.
+        :param blocks: Grille des blocs HOG (voir hog_blocks), (n_blocks_x, n_blocks_y, b_x, b_y, orientations).
+        :param steps: Pas (en blocs) entre deux positions, en hauteur et en largeur.
+        :return: Array (ceil(n_x / steps[0]), ceil(n_y / steps[1])), avec n_x = n_blocks_x - window_blocks_x + 1
+        (de même pour n_y) : comme la carte complète sous-échantillonnée [::steps[0], ::steps[1]].
+        """
+        blocks = blocks.reshape(blocks.shape[0], blocks.shape[1], -1)
+        if blocks.shape[0] < self.weights.shape[0] or blocks.shape[1] < self.weights.shape[1]:
+            return np.empty((0, 0))
+        if tuple(steps) == (1, 1):
+            return signal.correlate(blocks, self.weights, mode="valid")[:, :, 0] + self.bias
+        # (positions_x, positions_y, canaux, window_blocks_x, window_blocks_y) : vue sur la grille
+        positions = np.lib.stride_tricks.sliding_window_view(blocks, self.weights.shape[:2], axis=(0, 1))
+        positions = positions[:: steps[0], :: steps[1]]
+        return np.einsum("xycuv,uvc->xy", positions, self.weights, optimize=True) + self.bias
+
+
+def linear_window_scores(img, h, w, template, x_step, y_step):
+    """
+    Probabilités de toutes les fenêtres (h, w) d'une image, pour le même pas que hog_pyramid_window_grid.
+    :param img: Image en niveaux de gris.
+    :param template: LinearTemplate.
+    :return: Probabilités (n_windows,) et coordonnées int32 (n_windows, 4), dans l'ordre de hog_pyramid_window_grid.
+    """
+    empty = np.empty(0), np.empty((0, 4), dtype=np.int32)
+    if img.shape[0] < h or img.shape[1] < w:
+        return empty
+
+    blocks, (scale_x, scale_y) = scale_hog_blocks(img, h, w, template.target_shape, template.hog_params)
+    # Pas de la fenêtre glissante converti en nombre de cellules, comme dans hog_pyramid_window_grid
+    cell_x, cell_y = template.hog_params["pixels_per_cell"]
+    step_x = max(1, int(round(x_step * scale_x / cell_x)))
+    step_y = max(1, int(round(y_step * scale_y / cell_y)))
+    scores = template.score_map(blocks, (step_x, step_y))
+    if scores.size == 0:
+        return empty
+
+    n_x, n_y = scores.shape
+    coords = block_grid_coords(img.shape, h, w, n_x, n_y, (step_x * cell_x, step_y * cell_y), (scale_x, scale_y))
+    return expit(scores.ravel()), coords
+
+
+def linear_window_scores_both_orientations(img, h, w, template, px_step):
+    """
+    Probabilités et coordonnées de toutes les fenêtres (h, w) et (w, h), dans l'ordre de
+    hog_pyramid_windows_both_orientations (fenêtres allongées calculées sur l'image tournée, voir window_orientations).
+    :return: Probabilités (n_windows,) et coordonnées int32 (n_windows, 4).
+    """
+    (upright_h, upright_w), passes = window_orientations(h, w)
+    all_probas = []
+    all_coords = []
+    for rotated in passes:
+        if not rotated:
+            probas, coords = linear_window_scores(img, upright_h, upright_w, template, px_step, px_step)
+        else:
+            probas, coords = linear_window_scores(np.rot90(img, k=1), upright_h, upright_w, template, px_step, px_step)
+            coords = unrotate_coords(coords, img.shape[1])
+        all_probas.append(probas)
+        all_coords.append(coords)
+    return np.concatenate(all_probas), np.concatenate(all_coords)
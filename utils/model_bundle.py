@@ -0,0 +1,223 @@
+"""
+Modèle de détection enregistré en un seul fichier ("bundle") : classifieur entraîné, paramètres du HOG, target_shape,
+limites des fenêtres (stats.txt) et paramètres de détection et de NMS.
+
+Le bundle est un dictionnaire enregistré par joblib sans compression : à la lecture, les arrays numpy du classifieur
+(vecteurs de support, coefficients) sont projetés en mémoire (mmap_mode="r") au lieu d'être copiés, et aucun fichier
+du dépôt n'est relu. load_detector rend un Detector prêt à l'emploi, sans dépendre du dossier courant.
+
+Démarrage à froid (benchmarks/bench_cold_start.py, interpréteur neuf, import compris) : l'essentiel du temps est
+l'import de sklearn et scipy pendant le dépickling du classifieur, 1 à 1.5 s pour un SVC ou une LogisticRegression
+sklearn. Une LogisticRegression (éventuellement derrière des StandardScaler) est donc enregistrée sous forme de
+LinearClassifier (poids et biais en arrays numpy, scalers repliés) : son chargement n'importe ni sklearn ni scipy et
+prend environ 0.2 s, import de numpy compris. Un SVC reste à 1 à 1.5 s.
+
+Création d'un bundle depuis la racine du dépôt (même entraînement que local_data/hard_negatives.py, sur le jeu
+normalisé et les négatifs difficiles déjà trouvés) :
+
+    python utils/model_bundle.py <modele.joblib>
+"""
+
+import os
+import sys
+import time
+from functools import partial
+
+import joblib
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import utils.detection as detection
+
+BUNDLE_VERSION = 1  # à incrémenter si le contenu du bundle change
+WINDOW_LIMITS = ("min_ratio", "max_ratio", "min_scale", "max_scale")
+DETECTION_PARAMS = {  # paramètres de detect_ecocup par défaut (les limites des fenêtres viennent de stats)
+    "px_step": 35,
+    "scales_nb": 10,
+    "ratios_nb": 5,
+    "confidence_threshold": 0.5,
+    "mode": "hog_pyramid",
+}
+NMS_PARAMS = {"iou_decision_criteria": 0.5, "score_decision_criteria": 0.5}
+
+
+def hog_extractor(patchs, hog_params=None):
+    """
+    HOG_extractor des notebooks, avec des paramètres de skimage.feature.hog (None ou {} : valeurs par défaut).
+    """
+    from skimage.feature import hog  # importé au premier calcul, pas au chargement du bundle
+
+    hog_params = {} if hog_params is None else hog_params
+    if len(patchs) == 0:
+        return np.empty((0, 0))
+    first_features = hog(patchs[0], **hog_params)
+    features = np.zeros(shape=(len(patchs), first_features.shape[0]), dtype=first_features.dtype)
+    for i, patch in enumerate(patchs):
+        features[i] = hog(patch, **hog_params)
+    return features
+
+
+class LinearClassifier:
+    """
+    LogisticRegression binaire réduite à ses poids (StandardScaler repliés, voir fold_linear_classifier) : mêmes
+    probabilités, calculées en numpy seul. coef_ et intercept_ comme sklearn, donc utilisable en mode "linear".
+    """
+
+    def __init__(self, weights, bias):
+        self.coef_ = np.asarray(weights, dtype=np.float64).reshape(1, -1)
+        self.intercept_ = np.array([bias], dtype=np.float64)
+
+    def decision_function(self, X):
+        return np.asarray(X) @ self.coef_[0] + self.intercept_[0]
+
+    def predict_proba(self, X):
+        # Sigmoïde stable (sans scipy.special.expit) : 1 / (1 + exp(-s)) = exp(-log(1 + exp(-s)))
+        probas = np.exp(-np.logaddexp(0, -self.decision_function(X)))
+        return np.stack([1 - probas, probas], axis=1)
+
+    def predict(self, X):
+        return (self.decision_function(X) > 0).astype(np.int64)
+
+
+def compact_classifier(classifier):
+    """
+    LinearClassifier équivalent si classifier est une LogisticRegression binaire (éventuellement derrière des
+    StandardScaler dans un Pipeline), classifier lui-même sinon.
+    """
+    from sklearn.linear_model import LogisticRegression
+
+    from utils.linear_detector import fold_linear_classifier
+
+    steps = getattr(classifier, "steps", None)
+    model = steps[-1][1] if steps is not None else classifier
+    if not isinstance(model, LogisticRegression) or len(model.classes_) != 2:
+        return classifier
+    try:
+        return LinearClassifier(*fold_linear_classifier(classifier))
+    except ValueError:
+        # Étapes impossibles à replier (autre chose qu'un StandardScaler)
+        return classifier
+
+
+def save_bundle(
+    path, classifier, target_shape, stats, hog_params=None, detection_params=None, nms_params=None, compact=True
+):
+    """
+    Enregistre un bundle.
+    :param classifier: Classifieur entraîné sur hog_extractor(patchs normalisés, hog_params).
+    :param target_shape: Shape des patchs normalisés de l'entraînement.
+    :param stats: Dictionnaire des limites des fenêtres (voir normalizer.get_stats), seules WINDOW_LIMITS sont gardées.
+    :param detection_params: Paramètres de detect_ecocup (par défaut DETECTION_PARAMS).
+    :param nms_params: Paramètres de non_maxima_suppression_v2 (par défaut NMS_PARAMS).
+    :param compact: Si True, une LogisticRegression est enregistrée en LinearClassifier (voir compact_classifier),
+    chargé sans importer sklearn.
+    """
+    bundle = {
+        "version": BUNDLE_VERSION,
+        "classifier": compact_classifier(classifier) if compact else classifier,
+        "hog_params": {} if hog_params is None else dict(hog_params),
+        "target_shape": tuple(int(n) for n in target_shape),
+        "stats": {key: stats[key] for key in WINDOW_LIMITS},
+        "detection_params": dict(DETECTION_PARAMS if detection_params is None else detection_params),
+        "nms_params": dict(NMS_PARAMS if nms_params is None else nms_params),
+    }
+    # Sans compression : condition pour que joblib.load puisse projeter les arrays en mémoire
+    joblib.dump(bundle, path, compress=0)
+
+
+def load_bundle(path, mmap_mode="r"):
+    """
+    Lit un bundle enregistré par save_bundle.
+    :param mmap_mode: Mode de projection en mémoire des arrays (None pour les copier en mémoire).
+    :return: Dictionnaire du bundle.
+    """
+    bundle = joblib.load(path, mmap_mode=mmap_mode)
+    version = bundle.get("version") if isinstance(bundle, dict) else None
+    if version != BUNDLE_VERSION:
+        raise ValueError(f"Version de bundle non supportée : {version} (attendue : {BUNDLE_VERSION}) pour {path}")
+    return bundle
+
+
+class Detector:
+    """
+    Détecteur prêt à l'emploi construit à partir d'un bundle : detect_ecocup puis non_maxima_suppression_v2.
+    """
+
+    def __init__(self, bundle):
+        self.classifier = bundle["classifier"]
+        self.hog_params = bundle["hog_params"]
+        self.target_shape = bundle["target_shape"]
+        self.features_func = partial(hog_extractor, hog_params=self.hog_params)
+        self.detection_params = dict(bundle["detection_params"], **bundle["stats"])
+        self.detection_params["hog_params"] = self.hog_params
+        # Shape de l'entraînement du classifieur, passée à chaque détection : pas de réglage global au processus, deux
+        # Detector de shapes différentes peuvent coexister
+        self.detection_params["target_shape"] = self.target_shape
+        self.nms_params = bundle["nms_params"]
+
+    def detect_all(self, img, **detection_params):
+        """
+        Toutes les fenêtres au-dessus de confidence_threshold, avant NMS.
+        :param detection_params: Paramètres de detect_ecocup qui remplacent ceux du bundle (ex : px_step, executor).
+        :return: Fenêtres (n, 2, 2) et scores (n,), comme detect_ecocup.
+        """
+        return detection.detect_ecocup(
+            img, self.classifier, self.features_func, **dict(self.detection_params, **detection_params)
+        )
+
+    def detect(self, img, **detection_params):
+        """
+        Détections finales d'une image, après NMS.
+        :return: Liste des fenêtres gardées (2, 2) et liste de leurs scores.
+        """
+        windows, scores = self.detect_all(img, **detection_params)
+        if len(windows) == 0:
+            return [], []
+        return detection.non_maxima_suppression_v2(windows, scores, **self.nms_params, output_score=True)
+
+
+def load_detector(path, mmap_mode="r"):
+    """
+    :return: Detector du bundle enregistré dans path.
+    """
+    return Detector(load_bundle(path, mmap_mode))
+
+
+if __name__ == "__main__":
+    import importlib
+
+    from local_data.augmented_dataset import read_augmented
+    from local_data.hard_negatives import STAGE_FOLDER, USE_FEATURE_STORE, load_hard_negatives, train_classifier
+    from local_data.packed_dataset import POS_LABEL, extract_features, packed_path
+    from utils.feature_store import FeatureStore
+
+    normalizer = importlib.import_module("local_data.4_normalized_patches.normalizer")
+
+    if len(sys.argv) != 2:
+        print("Usage : python utils/model_bundle.py <modele.joblib>")
+        sys.exit(1)
+    output = sys.argv[1]
+    hog_params = {}
+
+    start = time.time()
+    # Même cache que local_data/hard_negatives.py : les features déjà calculées par le bootstrapping sont reprises
+    store = FeatureStore("HOG", hog_params) if USE_FEATURE_STORE else None
+    extractor = partial(hog_extractor, hog_params=hog_params)
+    dataset = read_augmented(packed_path(STAGE_FOLDER))
+    X = dataset.features(np.arange(len(dataset)), extractor, hog_params=hog_params, store=store)
+    y = np.where(dataset.labels == POS_LABEL, 1, 0)
+    hard = load_hard_negatives()
+    if hard is not None:
+        X_hard = extract_features(np.stack([hard[i] for i in range(len(hard))]), extractor, store).astype(X.dtype)
+        X = np.concatenate([X, X_hard])
+        y = np.concatenate([y, np.zeros(len(X_hard), dtype=y.dtype)])
+    print(f"Features : {X.shape} ({time.time() - start} s)")
+
+    start = time.time()
+    classifier = train_classifier(X, y)
+    print(f"Entraînement : {time.time() - start} s")
+
+    save_bundle(output, classifier, normalizer.get_target_shape(), normalizer.get_stats(), hog_params)
+    start = time.time()
+    load_detector(output)
+    print(f"Bundle enregistré : {output} (chargement : {time.time() - start:.3f} s)")
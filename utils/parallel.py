@@ -0,0 +1,57 @@
+"""
+Utilitaires pour répartir le travail de détection sur plusieurs coeurs.
+
+Les images sont transmises aux processus via multiprocessing.shared_memory : elles sont copiées une seule fois
+dans un segment partagé, et chaque processus en crée une vue numpy, sans sérialisation de l'image à chaque tâche.
+"""
+
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+EXECUTORS = ("thread", "process")
+
+
+def get_n_jobs(n_jobs=None):
+    """
+    Nombre de workers à utiliser : n_jobs, ou le nombre de coeurs disponibles par défaut.
+    """
+    if n_jobs is None or n_jobs <= 0:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def share_array(array):
+    """
+    Copie un array dans un segment de mémoire partagée.
+    :param array: Array numpy à partager.
+    :return: Le segment (à fermer puis libérer avec release_shared) et sa description (name, shape, dtype),
+    à transmettre aux processus pour attach_shared.
+    """
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_shared(spec):
+    """
+    Vue numpy (lecture seule) sur un array partagé par share_array.
+    :param spec: Description (name, shape, dtype) retournée par share_array.
+    :return: Le segment (à garder en vie tant que la vue est utilisée) et la vue.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    return shm, array
+
+
+def release_shared(shm):
+    """
+    Ferme et libère un segment créé par share_array.
+    """
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,116 @@
+"""
+Pyramide d'images pour la recherche multi-échelle.
+
+Les niveaux sont des versions de plus en plus sous-échantillonnées (avec anti-aliasing) de l'image, construites
+une seule fois, chacune à partir de la précédente. Une fenêtre de grande taille est alors découpée dans le niveau le
+plus petit qui reste au moins aussi grand que le patch normalisé visé, au lieu d'être redimensionnée depuis la
+pleine résolution (l'anti-aliasing porte sur une zone bien plus petite).
+Les pyramides sont mises en cache par contenu d'image : des balayages répétés de paramètres sur la même image
+réutilisent la même pyramide.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from skimage.transform import resize
+
+PYRAMID_DOWNSCALE = 2.0  # facteur de réduction entre deux niveaux
+PYRAMID_MIN_SIZE = 32  # px : plus petit côté du dernier niveau
+PYRAMID_CACHE_SIZE = 4  # nombre de pyramides gardées en mémoire
+
+_pyramid_cache = OrderedDict()
+
+
+class ImagePyramid:
+    """
+    Niveaux sous-échantillonnés d'une image en niveaux de gris.
+    levels[0] est l'image elle-même, factors[i] = (facteur en hauteur, facteur en largeur) de levels[i].
+    """
+
+    def __init__(self, img, downscale=PYRAMID_DOWNSCALE, min_size=PYRAMID_MIN_SIZE):
+        self.downscale = downscale
+        self.levels = [img]
+        while True:
+            previous = self.levels[-1]
+            shape = (int(round(previous.shape[0] / downscale)), int(round(previous.shape[1] / downscale)))
+            if min(shape) < min_size:
+                break
+            level = resize(previous, shape, anti_aliasing=True)
+            self.levels.append(level.astype(img.dtype, copy=False))
+        self.factors = [(img.shape[0] / level.shape[0], img.shape[1] / level.shape[1]) for level in self.levels]
+
+    def __len__(self):
+        return len(self.levels)
+
+    def select_level(self, h, w, target_shape):
+        """
+        Niveau le plus petit dans lequel une fenêtre (h, w) (ou (w, h)) reste au moins aussi grande que target_shape.
+        :return: Indice du niveau.
+        """
+        # Facteur maximal de réduction avant que la fenêtre ne devienne plus petite que le patch normalisé
+        max_factor = min(max(h, w) / max(target_shape), min(h, w) / min(target_shape))
+        selected = 0
+        for i, (factor_x, factor_y) in enumerate(self.factors):
+            if max(factor_x, factor_y) <= max_factor:
+                selected = i
+        return selected
+
+    def level_window(self, level, h, w, x_step, y_step):
+        """
+        Taille et pas, dans le niveau level, d'une fenêtre (h, w) de pas (x_step, y_step) de l'image d'origine.
+        :return: (h, w, x_step, y_step) dans le niveau.
+        """
+        factor_x, factor_y = self.factors[level]
+        return (
+            max(1, int(round(h / factor_x))),
+            max(1, int(round(w / factor_y))),
+            max(1, int(round(x_step / factor_x))),
+            max(1, int(round(y_step / factor_y))),
+        )
+
+    def coords_to_image(self, level, coords, h, w):
+        """
+        Ramène des coordonnées de fenêtres du niveau level dans le repère de l'image d'origine.
+        :param coords: Array int32 (n, 4) (upper_left_x, upper_left_y, lower_right_x, lower_right_y) dans le niveau.
+        :param h: Hauteur de la fenêtre dans l'image d'origine.
+        :param w: Largeur de la fenêtre dans l'image d'origine.
+        :return: Array int32 (n, 4) dans l'image d'origine, fenêtres de taille (h, w) exactement.
+        """
+        if level == 0:
+            return coords
+        factor_x, factor_y = self.factors[level]
+        img_shape = self.levels[0].shape
+        image_coords = np.empty_like(coords)
+        image_coords[:, 0] = np.minimum(np.round(coords[:, 0] * factor_x), img_shape[0] - h)
+        image_coords[:, 1] = np.minimum(np.round(coords[:, 1] * factor_y), img_shape[1] - w)
+        image_coords[:, 2] = image_coords[:, 0] + h
+        image_coords[:, 3] = image_coords[:, 1] + w
+        return image_coords
+
+
+def get_pyramid(img, downscale=PYRAMID_DOWNSCALE, min_size=PYRAMID_MIN_SIZE):
+    """
+    Pyramide de l'image, construite au premier appel puis reprise du cache (clé : contenu de l'image et paramètres).
+    """
+    img = np.ascontiguousarray(img)
+    key = (
+        hashlib.blake2b(img.data, digest_size=16).hexdigest(),
+        img.shape,
+        img.dtype.str,
+        downscale,
+        min_size,
+    )
+    if key in _pyramid_cache:
+        _pyramid_cache.move_to_end(key)
+        return _pyramid_cache[key]
+
+    pyramid = ImagePyramid(img, downscale, min_size)
+    _pyramid_cache[key] = pyramid
+    while len(_pyramid_cache) > PYRAMID_CACHE_SIZE:
+        _pyramid_cache.popitem(last=False)
+    return pyramid
+
+
+def clear_pyramid_cache():
+    _pyramid_cache.clear()